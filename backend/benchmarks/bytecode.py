@@ -0,0 +1,84 @@
+'''
+Cold start import of a plugin whose directory the plugin process can't write to, so there is no __pycache__ to
+reuse: compiling the sources on every start as before, against loading the bytecode the loader precompiled.
+Every run imports the plugin in a fresh interpreter the way SandboxedPlugin does.
+
+Run from backend/: python -m benchmarks.bytecode
+'''
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from typing import List
+
+from decky_loader.plugin.bytecode import precompile_plugin
+
+MODULES = 20
+FUNCTIONS_PER_MODULE = 100
+RUNS = 10
+
+CHILD = '''
+import sys
+from importlib.util import module_from_spec, spec_from_file_location
+from os import path
+from time import perf_counter
+from decky_loader.plugin.bytecode import CachedSourceFileLoader, install_bytecode_cache
+
+# stands in for a plugin directory owned by someone else
+sys.dont_write_bytecode = True
+plugin_dir, cached = sys.argv[1], sys.argv[2] == "1"
+main_py = path.join(plugin_dir, "main.py")
+start = perf_counter()
+sys.path.append(path.join(plugin_dir, "py_modules"))
+if cached:
+    install_bytecode_cache(plugin_dir)
+    spec = spec_from_file_location("_", main_py, loader=CachedSourceFileLoader("_", main_py))
+else:
+    spec = spec_from_file_location("_", main_py)
+assert spec and spec.loader
+spec.loader.exec_module(module_from_spec(spec))
+print(perf_counter() - start)
+'''
+
+def make_plugin(plugin_dir: str):
+    py_modules = os.path.join(plugin_dir, "py_modules", "lib")
+    os.makedirs(py_modules)
+    open(os.path.join(py_modules, "__init__.py"), "w").close()
+    for m in range(MODULES):
+        with open(os.path.join(py_modules, f"module{m}.py"), "w") as file:
+            for f in range(FUNCTIONS_PER_MODULE):
+                file.write(f"def function{f}(values: list[int], scale: int = {f}) -> dict[str, int]:\n"
+                           f"    result = {{}}\n"
+                           f"    for i, value in enumerate(values):\n"
+                           f"        if value % {f + 2} == 0:\n"
+                           f"            result[f'key{{i}}'] = value * scale\n"
+                           f"    return result\n\n")
+    with open(os.path.join(plugin_dir, "main.py"), "w") as file:
+        file.writelines(f"from lib import module{m}\n" for m in range(MODULES))
+        file.write("\nclass Plugin:\n    async def _main(self):\n        pass\n")
+
+def measure(name: str, plugin_dir: str, cached: bool):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    times: List[float] = []
+    for _ in range(RUNS):
+        output = subprocess.check_output([sys.executable, "-c", CHILD, plugin_dir, "1" if cached else "0"], env=env)
+        times.append(float(output))
+    print(f"{name:>12}: {min(times) * 1000:6.1f}ms")
+
+def main():
+    root = tempfile.mkdtemp(prefix="decky-bench-")
+    os.environ["PRIVILEGED_PATH"] = os.environ["UNPRIVILEGED_PATH"] = root
+    try:
+        plugin_dir = os.path.join(root, "plugins", "bench")
+        make_plugin(plugin_dir)
+        lines = MODULES * FUNCTIONS_PER_MODULE * 7
+        print(f"{MODULES + 2} files, {lines} lines, best of {RUNS} imports")
+        measure("compile", plugin_dir, False)
+        precompile_plugin(plugin_dir)
+        measure("bytecode", plugin_dir, True)
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == "__main__":
+    main()
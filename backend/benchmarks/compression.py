@@ -0,0 +1,105 @@
+'''
+What permessage-deflate costs and saves on the frontend websocket. Every message is compressed the way aiohttp does
+it once the extension is negotiated: one raw deflate stream per connection at Z_BEST_SPEED, sync flushed after each
+message. Messages are a small reply, the plugin list, the store's release info and a file picker page.
+
+The second part times the same messages end to end over loopback, where the frontend connects from, with an aiohttp
+server and client with and without compression.
+
+Run from backend/: python -m benchmarks.compression
+'''
+import asyncio
+import zlib
+from time import perf_counter
+from typing import Any, Dict, List
+
+from aiohttp import ClientSession, WSMsgType, web
+
+from decky_loader.jsoncodec import dumps
+
+from .json_codec import file_picker_page
+
+ROUNDS = 200
+WS_PORT = 41338
+
+def release_info() -> List[Dict[str, Any]]:
+    download = "https://github.com/SteamDeckHomebrew/decky-loader/releases/download"
+    return [{
+        "tag_name": f"v3.{i}.0",
+        "prerelease": i % 3 == 0,
+        "published_at": f"2025-{i % 12 + 1:02d}-01T12:00:00Z",
+        "assets": [{
+            "name": name,
+            "browser_download_url": f"{download}/v3.{i}.0/{name}",
+            "size": 40_000_000 + i,
+            "content_type": "application/octet-stream",
+        } for name in ("PluginLoader", "PluginLoader.exe", "plugin_loader-release.service")],
+    } for i in range(30)]
+
+MESSAGES: Dict[str, str] = {
+    "reply": dumps({"type": 1, "id": 4711, "result": {"enabled": True, "volume": 0.75, "profile": "default"}}),
+    "plugin list": dumps({"type": 1, "id": 4712, "result": [
+        {"name": f"Plugin {i}", "version": f"1.{i}.0", "load_type": 1} for i in range(30)]}),
+    "release info": dumps({"type": 1, "id": 4713, "result": release_info()}),
+    "file picker page": dumps({"type": 1, "id": 4714, "result": file_picker_page()}),
+}
+
+def deflate():
+    print(f"deflate, per message averaged over {ROUNDS} on one connection")
+    for name, message in MESSAGES.items():
+        data = message.encode("utf-8")
+        compressor = zlib.compressobj(level=zlib.Z_BEST_SPEED, wbits=-15)
+        sizes: List[int] = []
+        start = perf_counter()
+        for _ in range(ROUNDS):
+            # the trailing 00 00 ff ff of the sync flush isn't sent
+            sizes.append(len((compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH))[:-4]))
+        elapsed = (perf_counter() - start) / ROUNDS
+        # the first time a message is sent, and again while the previous one is still in the window
+        print(f"{name:>16}: {len(data):7d} -> {sizes[0]:6d} bytes, repeated {sizes[-1]:6d}  {elapsed * 1e6:8.1f}us")
+
+async def serve(compress: bool) -> web.AppRunner:
+    async def handle(request: web.Request):
+        ws = web.WebSocketResponse(compress=compress)
+        await ws.prepare(request)
+        async for msg in ws:
+            await ws.send_str(MESSAGES[msg.data])
+        return ws
+
+    app = web.Application()
+    app.router.add_get("/ws", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", WS_PORT).start()
+    return runner
+
+async def round_trips(compress: bool):
+    runner = await serve(compress)
+    try:
+        async with ClientSession() as session:
+            async with session.ws_connect(f"http://127.0.0.1:{WS_PORT}/ws", compress=15 if compress else 0) as ws:
+                for name in MESSAGES:
+                    times: List[float] = []
+                    for _ in range(ROUNDS):
+                        start = perf_counter()
+                        await ws.send_str(name)
+                        msg = await ws.receive()
+                        assert msg.type == WSMsgType.TEXT
+                        times.append(perf_counter() - start)
+                    times.sort()
+                    label = f"{'deflate' if compress else 'plain'} {name}"
+                    print(f"{label:>24}: median {times[len(times) // 2] * 1e6:8.1f}us")
+    finally:
+        await runner.cleanup()
+
+async def loopback():
+    print(f"round trip over loopback, {ROUNDS} calls")
+    for compress in (False, True):
+        await round_trips(compress)
+
+def main():
+    deflate()
+    asyncio.run(loopback())
+
+if __name__ == "__main__":
+    main()
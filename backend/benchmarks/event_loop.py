@@ -0,0 +1,113 @@
+'''
+Latency of a websocket call round trip to the loader and of a call to a plugin process over its local socket, on the
+stock asyncio event loop and on uvloop. The loader's side of the websocket and both ends of the local socket run on
+the loop under test, each in their own process like they do on a device. The websocket client stands in for the
+frontend and always uses the stock loop.
+
+Needs uvloop importable, run from backend/: python -m benchmarks.event_loop
+'''
+import asyncio
+import os
+import tempfile
+from json import dumps, loads
+from multiprocessing import Process
+from time import perf_counter
+from typing import Any, Callable, Coroutine, Dict, List
+
+from aiohttp import ClientSession, WSMsgType, web
+
+from decky_loader.eventloop import create_event_loop
+from decky_loader.localplatform.localsocket import LocalSocket
+
+CALLS = 5000
+WS_PORT = 41337
+REPLY: Dict[str, Any] = {"type": 1, "id": 0,
+                         "result": {"name": "Example", "version": "1.0.0", "flags": [], "hidden": False}}
+
+def serve(kind: str, main: Callable[[], Coroutine[Any, Any, None]]):
+    loop = create_event_loop(kind)
+    loop.run_until_complete(main())
+
+async def ws_server():
+    async def handle(request: web.Request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        async for msg in ws:
+            call = loads(msg.data)
+            await ws.send_str(dumps({**REPLY, "id": call["id"]}))
+        return ws
+
+    app = web.Application()
+    app.router.add_get("/ws", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", WS_PORT).start()
+    await asyncio.Event().wait()
+
+async def ws_client() -> List[float]:
+    times: List[float] = []
+    async with ClientSession() as session:
+        for _ in range(50):
+            try:
+                ws = await session.ws_connect(f"http://127.0.0.1:{WS_PORT}/ws")
+                break
+            except OSError:
+                await asyncio.sleep(0.1)
+        else:
+            raise RuntimeError("websocket server didn't come up")
+        for id in range(CALLS):
+            start = perf_counter()
+            await ws.send_str(dumps({"type": 0, "id": id, "route": "loader/get_plugins", "args": []}))
+            msg = await ws.receive()
+            assert msg.type == WSMsgType.TEXT
+            times.append(perf_counter() - start)
+        await ws.close()
+    return times
+
+async def ipc_server(socket: LocalSocket):
+    async def on_new_message(line: str, channel: bool):
+        call = loads(line)
+        return dumps({**REPLY, "id": call["id"]})
+    await socket.setup_server(on_new_message)
+    await asyncio.Event().wait()
+
+async def ipc_client(socket: LocalSocket) -> List[float]:
+    times: List[float] = []
+    for id in range(CALLS):
+        start = perf_counter()
+        await socket.write_single_line(dumps({"type": 0, "id": id, "method": "get_plugins", "args": {}}))
+        await socket.read_single_line()
+        times.append(perf_counter() - start)
+    await socket.close_socket_connection()
+    return times
+
+def report(name: str, times: List[float]):
+    times.sort()
+    print(f"{name:>20}: median {times[len(times) // 2] * 1e6:6.1f}us  p99 {times[len(times) * 99 // 100] * 1e6:6.1f}us")
+
+def measure(kind: str):
+    server = Process(target=serve, args=(kind, ws_server), daemon=True)
+    server.start()
+    try:
+        report(f"{kind} websocket", asyncio.new_event_loop().run_until_complete(ws_client()))
+    finally:
+        server.terminate()
+
+    with tempfile.TemporaryDirectory(prefix="decky-bench-") as runtime_dir:
+        socket = LocalSocket(os.path.join(runtime_dir, "bench.sock"))
+        socket.create_ready_signal()
+        server = Process(target=serve, args=(kind, lambda: ipc_server(socket)), daemon=True)
+        server.start()
+        socket.detach_ready_signal()
+        try:
+            report(f"{kind} local socket", create_event_loop(kind).run_until_complete(ipc_client(socket)))
+        finally:
+            server.terminate()
+
+def main():
+    print(f"{CALLS} sequential calls")
+    for kind in ("asyncio", "uvloop"):
+        measure(kind)
+
+if __name__ == "__main__":
+    main()
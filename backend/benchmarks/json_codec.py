@@ -0,0 +1,51 @@
+'''
+Encoding and decoding the messages the loader handles most: a small call and its reply, the plugin list and a page
+of the file picker. Compares jsoncodec, which uses orjson when installed, against the standard library with its
+default options as the loader used it before.
+
+Run from backend/: python -m benchmarks.json_codec
+'''
+import json
+from timeit import repeat
+from typing import Any, Callable, Dict, List
+
+from decky_loader import jsoncodec
+
+RUNS = 5
+
+def file_picker_page() -> Dict[str, Any]:
+    files: List[Dict[str, Any]] = [{
+        "isdir": i < 20,
+        "name": f"Screenshot {i:04d} – Ünïcödé.png",
+        "realpath": f"/home/deck/Pictures/Screenshots/Screenshot {i:04d} – Ünïcödé.png",
+        "size": 1_048_576 + i * 317,
+        "modified": 1_760_000_000.123 + i,
+        "created": 1_760_000_000.456 + i,
+    } for i in range(1000)]
+    return {"realpath": "/home/deck/Pictures/Screenshots", "files": files, "total": len(files)}
+
+PAYLOADS: Dict[str, Any] = {
+    "call": {"type": 0, "id": 4711, "route": "loader/call_plugin_method", "args": ["Example", "get_state", {}]},
+    "reply": {"type": 1, "id": 4711, "result": {"enabled": True, "volume": 0.75, "profile": "default"}},
+    "plugin list": [{"name": f"Plugin {i}", "version": f"1.{i}.0", "load_type": 1} for i in range(30)],
+    "file picker page": file_picker_page(),
+}
+
+def best(fn: Callable[[], Any], number: int) -> float:
+    return min(repeat(fn, number=number, repeat=RUNS)) / number
+
+def main():
+    print(f"jsoncodec backend: {jsoncodec.JSON_BACKEND}, per message, best of {RUNS}")
+    for name, payload in PAYLOADS.items():
+        encoded = json.dumps(payload)
+        number = max(10, 2_000_000 // len(encoded))
+        dumps_json = best(lambda: json.dumps(payload), number)
+        dumps_codec = best(lambda: jsoncodec.dumps(payload), number)
+        loads_json = best(lambda: json.loads(encoded), number)
+        loads_codec = best(lambda: jsoncodec.loads(encoded), number)
+        print(f"{name:>16} ({len(encoded):6d} bytes): "
+              f"encode json {dumps_json * 1e6:8.2f}us codec {dumps_codec * 1e6:8.2f}us  "
+              f"decode json {loads_json * 1e6:8.2f}us codec {loads_codec * 1e6:8.2f}us")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+'''
+Memory of plugin processes with every plugin started at boot, against lazy plugins where only the ones that were
+called are running. Each process is forked from the loader and listens on its local socket like a plugin process
+does, without a plugin loaded into it, so the numbers are the floor of what every plugin costs.
+
+RSS is what the loader reports per plugin (get_process_rss), it counts pages shared with the loader for every
+process. PSS splits those between the processes sharing them.
+
+Run from backend/: python -m benchmarks.lazy_plugins
+'''
+import asyncio
+import os
+import tempfile
+from multiprocessing import Process
+from typing import List, Tuple
+
+from decky_loader.eventloop import create_event_loop
+from decky_loader.localplatform.localplatformlinux import get_process_rss
+from decky_loader.localplatform.localsocket import LocalSocket
+
+PLUGINS = 20
+# plugins the user opened since boot
+CALLED = 2
+
+def plugin_process(socket: LocalSocket):
+    async def on_new_message(line: str, channel: bool):
+        return line
+
+    async def serve():
+        await socket.setup_server(on_new_message)
+        await asyncio.Event().wait()
+
+    create_event_loop("asyncio").run_until_complete(serve())
+
+def get_process_pss(pid: int) -> int:
+    with open(f"/proc/{pid}/smaps_rollup") as smaps:
+        for line in smaps:
+            if line.startswith("Pss:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+async def start(runtime_dir: str, count: int) -> List[Process]:
+    processes: List[Process] = []
+    for i in range(count):
+        socket = LocalSocket(os.path.join(runtime_dir, f"plugin{i}.sock"))
+        socket.create_ready_signal()
+        process = Process(target=plugin_process, args=[socket], daemon=True)
+        try:
+            process.start()
+        finally:
+            socket.detach_ready_signal()
+        if not await socket.wait_until_ready():
+            raise RuntimeError("plugin process didn't come up")
+        processes.append(process)
+    return processes
+
+def measure(processes: List[Process]) -> Tuple[int, int]:
+    pids = [p.pid for p in processes if p.pid]
+    return sum(get_process_rss(pid) or 0 for pid in pids), sum(get_process_pss(pid) for pid in pids)
+
+async def run(name: str, count: int):
+    with tempfile.TemporaryDirectory(prefix="decky-bench-") as runtime_dir:
+        processes = await start(runtime_dir, count)
+        try:
+            rss, pss = measure(processes)
+            print(f"{name:>6}: {count:3d} processes  RSS {rss / 2**20:7.1f} MiB  PSS {pss / 2**20:7.1f} MiB")
+        finally:
+            for process in processes:
+                process.terminate()
+                process.join()
+
+def main():
+    print(f"{PLUGINS} plugins, {CALLED} of them called since boot")
+    asyncio.run(run("eager", PLUGINS))
+    asyncio.run(run("lazy", CALLED))
+
+if __name__ == "__main__":
+    main()
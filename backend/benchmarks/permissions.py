@@ -0,0 +1,64 @@
+'''
+Fixing the ownership and mode of a plugin tree with 10k files: `chown -R` and `chmod -R` as the loader used to run
+them, against the single native pass of localplatformlinux. "cold" runs on a tree where every entry has to change,
+"warm" on one that is already right, which is the common case on every boot.
+
+Run from backend/ as root: python -m benchmarks.permissions
+'''
+import os
+import shutil
+import subprocess
+import tempfile
+from time import perf_counter
+from typing import Callable, List
+
+from decky_loader.localplatform import localplatformlinux
+
+FILES = 10_000
+FILES_PER_DIR = 100
+RUNS = 5
+# owners the tree is switched between, so every cold run has something to change
+OWNERS = [(1000, 1000), (1001, 1001)]
+
+def make_tree(root: str):
+    for d in range(FILES // FILES_PER_DIR):
+        directory = os.path.join(root, f"dir{d}")
+        os.makedirs(directory)
+        for f in range(FILES_PER_DIR):
+            with open(os.path.join(directory, f"file{f}.py"), "w") as file:
+                file.write("pass\n")
+
+def subprocesses(root: str, uid: int, gid: int):
+    subprocess.call(["chown", "-R", f"{uid}:{gid}", root])
+    subprocess.call(["chmod", "-R", "755", root])
+
+def native(root: str, uid: int, gid: int):
+    localplatformlinux._set_owner_and_mode(root, uid, gid, 0o755, True) # pyright: ignore [reportPrivateUsage]
+
+def measure(name: str, fix: Callable[[str, int, int], None], root: str):
+    cold: List[float] = []
+    warm: List[float] = []
+    for run in range(RUNS):
+        uid, gid = OWNERS[run % 2]
+        start = perf_counter()
+        fix(root, uid, gid)
+        cold.append(perf_counter() - start)
+        start = perf_counter()
+        fix(root, uid, gid)
+        warm.append(perf_counter() - start)
+    print(f"{name:>14}: cold {min(cold) * 1000:7.1f}ms  warm {min(warm) * 1000:7.1f}ms")
+
+def main():
+    if os.geteuid() != 0:
+        raise SystemExit("Has to run as root to change owners")
+    root = tempfile.mkdtemp(prefix="decky-bench-")
+    try:
+        make_tree(root)
+        print(f"{FILES} files, best of {RUNS} runs")
+        measure("chown/chmod -R", subprocesses, root)
+        measure("native", native, root)
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == "__main__":
+    main()
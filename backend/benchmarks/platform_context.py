@@ -0,0 +1,88 @@
+'''
+Host lookups made while starting one plugin: the paths, host user and loader version that PluginWrapper and
+SandboxedPlugin ask for. "before" resolves them on every call like the loader used to, by dropping the platform
+context and the loader version before each lookup, "after" uses the cached context.
+
+Counted are calls into the passwd database, os.makedirs and importlib.metadata, and the read/write syscalls the
+kernel reports in /proc/self/io.
+
+Run from backend/: python -m benchmarks.platform_context
+'''
+import importlib.metadata
+import os
+import pwd
+import shutil
+import tempfile
+from collections import Counter
+from time import perf_counter
+from typing import Any, Callable, Dict, Tuple
+
+from decky_loader import helpers
+from decky_loader.enums import UserType
+from decky_loader.localplatform import localplatform, localplatformlinux
+
+STARTS = 200
+
+calls: Counter[str] = Counter()
+
+def count(module: Any, name: str):
+    original: Callable[..., Any] = getattr(module, name)
+    def counted(*args: Any, **kwargs: Any) -> Any:
+        calls[f"{module.__name__}.{name}"] += 1
+        return original(*args, **kwargs)
+    setattr(module, name, counted)
+
+def io_syscalls() -> int:
+    with open("/proc/self/io") as io:
+        stats = dict(line.split(": ") for line in io.read().splitlines())
+    return int(stats["syscr"]) + int(stats["syscw"])
+
+def plugin_start(before: bool):
+    def lookup(get: Callable[[], Any]):
+        if before:
+            localplatform.invalidate_platform_context()
+            helpers._loader_version = None # pyright: ignore [reportPrivateUsage]
+        get()
+
+    home = localplatform.get_unprivileged_path()
+    # the socket path and the six directories mkdir_as_user creates and chowns
+    for _ in range(7):
+        lookup(helpers.get_homebrew_path)
+    for _ in range(7):
+        lookup(lambda: localplatformlinux._get_user_ids(UserType.HOST_USER)) # pyright: ignore [reportPrivateUsage]
+    for _ in range(2):
+        lookup(lambda: localplatform.file_owner(home))
+    # the plugin process' environment
+    lookup(lambda: localplatform.get_home_path(UserType.HOST_USER))
+    lookup(localplatform.get_username)
+    lookup(helpers.get_loader_version)
+
+def measure(before: bool) -> Tuple[float, Dict[str, int], int]:
+    localplatform.invalidate_platform_context()
+    calls.clear()
+    syscalls = io_syscalls()
+    start = perf_counter()
+    for _ in range(STARTS):
+        plugin_start(before)
+    elapsed = perf_counter() - start
+    return elapsed, dict(calls), io_syscalls() - syscalls
+
+def main():
+    root = tempfile.mkdtemp(prefix="decky-bench-")
+    os.environ["UNPRIVILEGED_PATH"] = root
+    os.environ.pop("UNPRIVILEGED_USER", None)
+    for module, name in [(pwd, "getpwall"), (pwd, "getpwnam"), (pwd, "getpwuid"), (os, "makedirs"),
+                         (importlib.metadata, "version")]:
+        count(module, name)
+    print(f"per plugin start, averaged over {STARTS}")
+    try:
+        for label, before in [("before", True), ("after", False)]:
+            elapsed, lookups, syscalls = measure(before)
+            per_start = ", ".join(f"{name} {n / STARTS:g}" for name, n in sorted(lookups.items()))
+            print(f"{label:>6}: {elapsed / STARTS * 1e6:8.1f}us  {syscalls / STARTS:6.1f} read/write syscalls"
+                  f"  {per_start}")
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+from asyncio import AbstractEventLoop, TimerHandle
+from logging import getLogger
+import os
+from os import O_RDONLY, close, fstat, lstat, open as os_open, path, remove
+from stat import S_IROTH, S_ISREG
+from tempfile import gettempdir
+from typing import Dict
+
+from aiohttp.web import Application, FileResponse, Request, Response, get
+
+from .localplatform.localplatform import ON_LINUX, get_server_port
+from . import helpers
+
+# doesn't exist on Windows
+_o_nofollow: int = getattr(os, "O_NOFOLLOW", 0)
+
+# Upper bound for everything the store keeps alive, blobs held only by the store are evicted oldest first past this
+MAX_STORE_SIZE = 256 * 2 ** 20 # 256 MiB
+DEFAULT_TTL = 60 # seconds
+
+logger = getLogger("BlobStore")
+
+def get_blob_url(token: str) -> str:
+    return f"http://127.0.0.1:{get_server_port()}/blobs/{token}"
+
+def get_blob_temp_dir() -> str:
+    '''Where blobs created from bytes are written, tmpfs if available so they never touch the disk'''
+    return "/dev/shm" if ON_LINUX and path.isdir("/dev/shm") else gettempdir()
+
+class Blob:
+    def __init__(self, token: str, owner: str, file_path: str, fd: int, size: int, content_type: str | None, owned: bool) -> None:
+        self.token = token
+        self.owner = owner
+        self.path = file_path
+        self.fd = fd
+        self.size = size
+        self.content_type = content_type
+        # the file was created just for this blob (e.g. in /dev/shm) and is deleted with it
+        self.owned = owned
+        # one reference for the store itself, plus one per response being sent
+        self.refs = 1
+        self.expiry: TimerHandle | None = None
+
+    @property
+    def serve_path(self) -> str:
+        # Serving the descriptor opened at registration means swapping the file afterwards can't change what we send
+        return f"/proc/self/fd/{self.fd}" if ON_LINUX else self.path
+
+class BlobStore:
+    '''
+    Serves files handed over by plugins at short-lived, unguessable URLs, so binary payloads don't need to be
+    base64-encoded into JSON. Responses use sendfile and support range requests.
+    '''
+    def __init__(self, loop: AbstractEventLoop, server_instance: Application) -> None:
+        self.loop = loop
+        self.blobs: Dict[str, Blob] = {}
+        self.size = 0
+
+        server_instance.add_routes([
+            get("/blobs/{token}", self.handle_blob)
+        ])
+
+    def add(self, token: str, owner: str, file_path: str, content_type: str | None = None, ttl: float = DEFAULT_TTL,
+            owned: bool = False, owner_uid: int | None = None):
+        '''
+        Registers `file_path` under `token`. If `owner_uid` is set, the file has to be owned by that user or readable
+        by everyone, as the loader may run with more privileges than the plugin handing over the path.
+        Owned files are deleted together with the blob and have to be the owner's own files in the blob temp dir.
+        '''
+        if token in self.blobs:
+            raise ValueError(f"Blob {token} already exists")
+        real_path = path.realpath(file_path)
+        if owned and path.dirname(real_path) != get_blob_temp_dir():
+            raise PermissionError(f"{owner} may only hand over ownership of files in {get_blob_temp_dir()}")
+
+        fd = os_open(real_path, O_RDONLY | _o_nofollow)
+        try:
+            st = fstat(fd)
+            if not S_ISREG(st.st_mode):
+                raise ValueError(f"{file_path} is not a regular file")
+            if owner_uid is not None and st.st_uid != owner_uid and (owned or not st.st_mode & S_IROTH):
+                raise PermissionError(f"{owner} may not share {file_path}")
+        except:
+            close(fd)
+            raise
+
+        blob = Blob(token, owner, real_path, fd, st.st_size, content_type, owned)
+        blob.expiry = self.loop.call_later(ttl, self.release, token)
+        self.blobs[token] = blob
+        self.size += blob.size
+        logger.debug(f"Added blob {token} for {owner} ({blob.size} bytes)")
+        self._evict()
+
+    def release(self, token: str, owner: str | None = None):
+        '''
+        Drops the store's reference, the blob stays readable until responses in flight are done.
+        If `owner` is given, blobs of anyone else are left alone.
+        '''
+        blob = self.blobs.get(token)
+        if blob and owner is not None and blob.owner != owner:
+            logger.warning(f"{owner} tried to release blob {token} of {blob.owner}")
+            return
+        blob = self.blobs.pop(token, None)
+        if blob:
+            if blob.expiry:
+                blob.expiry.cancel()
+            self._unref(blob)
+
+    def release_owner(self, owner: str):
+        for token in [blob.token for blob in self.blobs.values() if blob.owner == owner]:
+            self.release(token)
+
+    def _unref(self, blob: Blob):
+        blob.refs -= 1
+        if blob.refs > 0:
+            return
+        self.size -= blob.size
+        if blob.owned:
+            try:
+                # only delete the path if it still is the file we were given
+                st, current = fstat(blob.fd), lstat(blob.path)
+                if (st.st_dev, st.st_ino) == (current.st_dev, current.st_ino):
+                    remove(blob.path)
+            except FileNotFoundError:
+                pass
+        close(blob.fd)
+        logger.debug(f"Freed blob {blob.token}")
+
+    def _evict(self):
+        # dicts keep insertion order, so this goes from oldest to newest
+        for blob in list(self.blobs.values()):
+            if self.size <= MAX_STORE_SIZE:
+                break
+            logger.info(f"Blob store is over {MAX_STORE_SIZE} bytes, evicting {blob.token} from {blob.owner}")
+            self.release(blob.token)
+
+    async def handle_blob(self, request: Request):
+        blob = self.blobs.get(request.match_info["token"])
+        if not blob:
+            return Response(text="Not Found", status=404)
+
+        blob.refs += 1
+        try:
+            headers = {"Cache-Control": "no-store"}
+            if blob.content_type:
+                headers["Content-Type"] = blob.content_type
+            res = FileResponse(blob.serve_path, headers=headers)
+            # prepare() sends the whole file (with sendfile where possible) and handles Range headers
+            await res.prepare(request)
+            return res
+        finally:
+            self._unref(blob)
+
+def get_blob_owner_uid(root_plugin: bool) -> int | None:
+    if not ON_LINUX or root_plugin:
+        return None
+    return helpers.get_user_id()
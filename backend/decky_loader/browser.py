@@ -5,7 +5,7 @@ import json
 
 # Partial imports
 from aiohttp import ClientSession
-from asyncio import sleep
+from asyncio import get_running_loop, sleep
 from hashlib import sha256
 from io import BytesIO
 from logging import getLogger
@@ -14,25 +14,18 @@ from re import sub
 from shutil import rmtree
 from time import time
 from zipfile import ZipFile
-from enum import IntEnum
 from typing import Dict, List, TypedDict
 
 # Local modules
-from .localplatform.localplatform import chown, chmod, get_chown_plugin_path
+from .localplatform.localplatform import chown, chmod, set_owner_and_mode, get_chown_plugin_path
 from .loader import Loader, Plugins
 from .helpers import get_ssl_context, download_remote_binary_to_path
-from .enums import UserType
+from .enums import UserType, PluginInstallType
 from .settings import SettingsManager
+from .plugin.bytecode import remove_plugin_bytecode
 
 logger = getLogger("Browser")
 
-class PluginInstallType(IntEnum):
-    INSTALL = 0
-    REINSTALL = 1
-    UPDATE = 2
-    DOWNGRADE = 3
-    OVERWRITE = 4
-
 class PluginInstallRequest(TypedDict):
     name: str
     artifact: str
@@ -131,7 +124,7 @@ class PluginBrowser:
 
         logger.debug("root_plugin %d, dir %s", root_plugin, plugin_dir)
         if get_chown_plugin_path():
-            return chown(plugin_dir, UserType.EFFECTIVE_USER if root_plugin else UserType.HOST_USER, True) and chown(plugin_dir, UserType.EFFECTIVE_USER, False) and chmod(plugin_dir, 755) and chown(plugin_json_path, UserType.EFFECTIVE_USER, False) and chmod(plugin_json_path, 755)
+            return set_owner_and_mode(plugin_dir, UserType.EFFECTIVE_USER if root_plugin else UserType.HOST_USER, 755) and chown(plugin_dir, UserType.EFFECTIVE_USER, False) and set_owner_and_mode(plugin_json_path, UserType.EFFECTIVE_USER, 755)
         else:
             logger.debug("chown disabled by environment")
             return True
@@ -159,6 +152,7 @@ class PluginBrowser:
                 self.cleanup_plugin_settings(name)
             logger.debug("removing files %s" % str(name))
             rmtree(plugin_dir)
+            remove_plugin_bytecode(plugin_dir)
         except FileNotFoundError:
             logger.warning(f"Plugin {name} not installed, skipping uninstallation")
         except Exception as e:
@@ -277,7 +271,8 @@ class PluginBrowser:
             plugin_dir = path.join(self.plugin_path, plugin_folder)
             await self.loader.ws.emit("loader/plugin_download_info", 95, "Store.download_progress_info.download_remote")
             ret = await self._download_remote_binaries_for_plugin_with_name(plugin_dir)
-            chown_ret = self.set_plugin_dir_permissions(plugin_dir)
+            # walks the whole plugin, keep it off the event loop
+            chown_ret = await get_running_loop().run_in_executor(None, self.set_plugin_dir_permissions, plugin_dir)
             if ret:
                 logger.info(f"Installed {name} (Version: {version})")
                 if name in self.loader.plugins:
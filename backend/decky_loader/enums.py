@@ -6,4 +6,11 @@ class UserType(IntEnum):
 
 class PluginLoadType(IntEnum):
     LEGACY_EVAL_IIFE = 0 # legacy, uses legacy serverAPI
-    ESMODULE_V1 = 1 # esmodule loading with modern @decky/backend apis
\ No newline at end of file
+    ESMODULE_V1 = 1 # esmodule loading with modern @decky/backend apis
+
+class PluginInstallType(IntEnum):
+    INSTALL = 0
+    REINSTALL = 1
+    UPDATE = 2
+    DOWNGRADE = 3
+    OVERWRITE = 4
@@ -0,0 +1,21 @@
+from asyncio import AbstractEventLoop, new_event_loop
+from logging import getLogger
+
+logger = getLogger("EventLoop")
+
+EVENT_LOOPS = ("asyncio", "uvloop")
+
+def create_event_loop(kind: str) -> AbstractEventLoop:
+    '''
+    Creates the event loop the loader or a plugin process runs on. `kind` is "asyncio" for the stock loop or "uvloop",
+    which falls back to the stock loop if uvloop isn't installed or can't be used on this platform.
+    '''
+    if kind == "uvloop":
+        try:
+            import uvloop # pyright: ignore [reportMissingImports]
+            return uvloop.new_event_loop() # pyright: ignore
+        except ImportError:
+            logger.warning("uvloop was requested but isn't available, using the asyncio event loop")
+    elif kind != "asyncio":
+        logger.warning(f"Unknown event loop {kind}, expected one of {', '.join(EVENT_LOOPS)}")
+    return new_event_loop()
@@ -2,9 +2,12 @@ import re
 import ssl
 import uuid
 import os
+import json
+import shutil
 import subprocess
 from hashlib import sha256
 import importlib.metadata
+from typing import Any
 
 import certifi
 from aiohttp.web import Request, Response, middleware
@@ -26,6 +29,7 @@ assets_regex = re.compile("^/plugins/.*/assets/.*")
 data_regex = re.compile("^/plugins/.*/data/.*")
 dist_regex = re.compile("^/plugins/.*/dist/.*")
 frontend_regex = re.compile("^/frontend/.*")
+channel_regex = re.compile("^/plugins/[^/]+/channel$")
 logger = getLogger("Main")
 
 def get_ssl_context():
@@ -43,8 +47,10 @@ async def csrf_middleware(request: Request, handler: Handler):
         str(request.rel_url).startswith("/static/") or \
         str(request.rel_url).startswith("/steam_resource/") or \
         str(request.rel_url).startswith("/frontend/") or \
+        str(request.rel_url).startswith("/blobs/") or \
         str(request.rel_url.path) == "/fetch" or \
         str(request.rel_url.path) == "/ws" or \
+        channel_regex.match(str(request.rel_url.path)) or \
         assets_regex.match(str(request.rel_url)) or \
         data_regex.match(str(request.rel_url)) or \
         dist_regex.match(str(request.rel_url)) or \
@@ -62,12 +68,21 @@ def get_homebrew_path() -> str:
 
 # Recursively create path and chown as user
 def mkdir_as_user(path: str):
+    '''Blocking, call it from an executor when on the event loop.'''
     path = os.path.realpath(path)
     os.makedirs(path, exist_ok=True)
     localplatform.chown(path)
 
-# Fetches the version of loader
+_loader_version: str | None = None
+
+# Fetches the version of loader, it can't change without restarting the loader so it is only looked up once
 def get_loader_version() -> str:
+    global _loader_version
+    if _loader_version is None:
+        _loader_version = _read_loader_version()
+    return _loader_version
+
+def _read_loader_version() -> str:
     try:
         # Normalize Python-style version to conform to Decky style
         v = Version(importlib.metadata.version("decky_loader"))
@@ -90,22 +105,73 @@ def get_loader_version() -> str:
 
 user_agent = f"Decky/{get_loader_version()} (https://decky.xyz)"
 
+def _get_pythonpaths_cache_key(python: str) -> dict[str, Any] | None:
+    # the python below runs with an empty environment on linux, so it's looked up on the default PATH
+    python_path = shutil.which(python, path=os.defpath if localplatform.ON_LINUX else None)
+    if python_path is None:
+        return None
+    python_path = os.path.realpath(python_path)
+
+    key: dict[str, Any] = {"python": python_path, "mtime": os.stat(python_path).st_mtime_ns, "user": get_user(), "user_site": {}}
+    if localplatform.ON_LINUX:
+        # user site-packages show up in sys.path only if they exist, so (dis)appearing ones have to invalidate the cache
+        user_lib = os.path.join(get_home_path(), ".local", "lib")
+        if os.path.isdir(user_lib):
+            for entry in sorted(os.listdir(user_lib)):
+                site_packages = os.path.join(user_lib, entry, "site-packages")
+                if entry.startswith("python") and os.path.isdir(site_packages):
+                    key["user_site"][site_packages] = os.stat(site_packages).st_mtime_ns
+    return key
+
 # returns the appropriate system python paths
 def get_system_pythonpaths() -> list[str]:
+    '''
+    Spawning the system python is slow on the deck, so its sys.path is cached on disk
+    until the interpreter or the user's site directories change.
+    '''
+    python = "python3" if localplatform.ON_LINUX else "python"
+    cache_path = os.path.join(localplatform.get_privileged_path(), "cache", "system_pythonpaths.json")
+
+    try:
+        key = _get_pythonpaths_cache_key(python)
+    except Exception as e:
+        logger.warning(f"Failed to check the system python: {str(e)}")
+        key = None
+
+    if key is not None:
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+            if cache["key"] == key:
+                return cache["paths"]
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.debug(f"Ignoring unreadable system python paths cache: {str(e)}")
+
     try:
         # run as normal normal user if on linux to also include user python paths
-        proc = subprocess.run(["python3" if localplatform.ON_LINUX else "python", "-c", "import sys; print('\\n'.join(x for x in sys.path if x))"],
+        proc = subprocess.run([python, "-c", "import sys; print('\\n'.join(x for x in sys.path if x))"],
         # TODO make this less insane
                               capture_output=True, user=localplatform.localplatform._get_user_id() if localplatform.ON_LINUX else None, env={} if localplatform.ON_LINUX else None) # pyright: ignore [reportPrivateUsage]
         
         proc.check_returncode()
 
         versions = [x.strip() for x in proc.stdout.decode().strip().split("\n")]
-        return [x for x in versions if x and not x.isspace()]
+        paths = [x for x in versions if x and not x.isspace()]
     except Exception as e:
         logger.warning(f"Failed to execute get_system_pythonpaths(): {str(e)}")
         return []
 
+    if key is not None:
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(cache_path, "w", encoding="utf-8") as f:
+                json.dump({"key": key, "paths": paths}, f)
+        except Exception as e:
+            logger.warning(f"Failed to cache system python paths: {str(e)}")
+    return paths
+
 # Download Remote Binaries to local Plugin
 async def download_remote_binary_to_path(url: str, binHash: str, path: str) -> bool:
     rv = False
@@ -165,7 +231,7 @@ def get_effective_user_group_id() -> int:
 
 # Get the effective user group of the running process
 def get_effective_user_group() -> str:
-    return localplatform.localplatform._get_effective_user_group() # pyright: ignore [reportPrivateUsage]
+    return localplatform.localplatform.get_group_name(get_effective_user_group_id())
 
 # Get the user owner of the given file path.
 def get_user_owner(file_path: str) -> str:
@@ -173,7 +239,7 @@ def get_user_owner(file_path: str) -> str:
 
 # Get the user group of the given file path, or the user group hosting the plugin loader
 def get_user_group(file_path: str | None = None) -> str:
-    return localplatform.localplatform._get_user_group(file_path) # pyright: ignore [reportPrivateUsage]
+    return localplatform.localplatform.get_group_name(os.stat(file_path).st_gid if file_path is not None else get_user_group_id())
 
 # Get the group id of the user hosting the plugin loader
 def get_user_group_id() -> int:
@@ -9,6 +9,8 @@ from aiohttp.client_exceptions import ClientConnectorError, ClientOSError
 from asyncio.exceptions import TimeoutError
 import uuid
 
+from .jsoncodec import dumps, loads
+
 BASE_ADDRESS = "http://localhost:8080"
 
 logger = getLogger("Injector")
@@ -44,7 +46,7 @@ class Tab:
     async def listen_for_message(self):
         if self.websocket:
             async for message in self.websocket:
-                data = message.json()
+                data = message.json(loads=loads)
                 yield data
             logger.warning(f"The Tab {self.title} socket has been disconnected while listening for messages.")
             await self.close_websocket()
@@ -53,7 +55,7 @@ class Tab:
         if self.websocket:
             self.cmd_id += 1
             dc["id"] = self.cmd_id
-            await self.websocket.send_json(dc)
+            await self.websocket.send_json(dc, dumps=dumps)
             if receive:
                 async for msg in self.listen_for_message():
                     if "id" in msg and msg["id"] == dc["id"]:
@@ -0,0 +1,56 @@
+'''
+JSON encoding and decoding for the frontend websocket, CDP and plugin IPC, which all go through here.
+Uses orjson when it is installed and the standard library otherwise. Output is the same either way as far as a JSON
+parser can tell: non-ASCII characters are written as UTF-8 like with ensure_ascii=False, only the whitespace differs.
+`canonical_dumps` sorts object keys, so equal values encode the same within a backend. Its output is used as a key,
+never sent anywhere.
+'''
+from json import JSONDecodeError, dumps as json_dumps, loads as json_loads
+from typing import Any
+
+try:
+    import orjson # pyright: ignore [reportMissingImports]
+except ImportError:
+    orjson = None
+
+JSON_BACKEND = "orjson" if orjson else "json"
+
+if orjson:
+    # the standard library turns int, float and bool keys into strings, orjson refuses them by default
+    _OPTIONS: int = orjson.OPT_NON_STR_KEYS # pyright: ignore
+
+    def dumps_bytes(obj: Any) -> bytes:
+        try:
+            return orjson.dumps(obj, option=_OPTIONS) # pyright: ignore
+        except TypeError:
+            # orjson only handles integers up to 64 bit, the standard library raises its own TypeError
+            # if the value really can't be encoded
+            return json_dumps(obj, ensure_ascii=False).encode("utf-8")
+
+    def dumps(obj: Any) -> str:
+        return dumps_bytes(obj).decode("utf-8")
+
+    def canonical_dumps(obj: Any) -> str:
+        try:
+            return orjson.dumps(obj, option=_OPTIONS | orjson.OPT_SORT_KEYS).decode("utf-8") # pyright: ignore
+        except TypeError:
+            return json_dumps(obj, ensure_ascii=False, sort_keys=True)
+
+    def loads(data: str | bytes) -> Any:
+        try:
+            return orjson.loads(data) # pyright: ignore
+        except JSONDecodeError:
+            # NaN and Infinity, which the standard library accepts
+            return json_loads(data)
+else:
+    def dumps(obj: Any) -> str:
+        return json_dumps(obj, ensure_ascii=False)
+
+    def dumps_bytes(obj: Any) -> bytes:
+        return dumps(obj).encode("utf-8")
+
+    def canonical_dumps(obj: Any) -> str:
+        return json_dumps(obj, ensure_ascii=False, sort_keys=True)
+
+    def loads(data: str | bytes) -> Any:
+        return json_loads(data)
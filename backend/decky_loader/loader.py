@@ -1,85 +1,69 @@
 from __future__ import annotations
-from asyncio import AbstractEventLoop, Queue, gather, sleep
+from asyncio import AbstractEventLoop, Queue, Task, gather, sleep
+from collections import Counter
+from json import load
 from logging import getLogger
-from os import listdir, path
+from os import getpid, listdir, path
 from pathlib import Path
+from time import monotonic
 from traceback import print_exc, format_exc
-from typing import Any, Tuple, Dict, cast
+from typing import Any, Tuple, Dict
 
-from aiohttp import web
+from aiohttp import WSMsgType, web
 from os.path import exists
-from decky_loader.helpers import get_homebrew_path
-from watchdog.events import RegexMatchingEventHandler, FileSystemEvent
-from watchdog.observers import Observer
+from decky_loader.helpers import get_csrf_token, get_homebrew_path
 
 from typing import TYPE_CHECKING, List
 if TYPE_CHECKING:
     from .main import PluginManager
+    from .watcher import FileChangeHandler
 
 from .plugin.plugin import PluginWrapper
+from .settings import SettingsManager
+from .localplatform.localplatform import get_privileged_path, get_lazy_plugins, get_plugin_idle_timeout, get_process_rss
 from .wsrouter import WSRouter
 from .enums import PluginLoadType
+from .jsoncodec import loads
 
 Plugins = dict[str, PluginWrapper]
 ReloadQueue = Queue[Tuple[str, str, bool | None] | Tuple[str, str]]
 
-class FileChangeHandler(RegexMatchingEventHandler):
-    def __init__(self, queue: ReloadQueue, plugin_path: str) -> None:
-        super().__init__(regexes=[r'^.*?dist\/index\.js$', r'^.*?main\.py$']) # pyright: ignore [reportUnknownMemberType]
-        self.logger = getLogger("file-watcher")
-        self.plugin_path = plugin_path
-        self.queue = queue
-        self.disabled = True
-
-    def maybe_reload(self, src_path: str):
-        if self.disabled:
-            return
-        plugin_dir = Path(path.relpath(src_path, self.plugin_path)).parts[0]
-        if exists(path.join(self.plugin_path, plugin_dir, "plugin.json")):
-            self.queue.put_nowait((path.join(self.plugin_path, plugin_dir, "main.py"), plugin_dir, True))
+# How many past startups are kept per plugin, to compare against after updates
+MAX_STARTUP_HISTORY = 10
 
-    def on_created(self, event: FileSystemEvent):
-        src_path = cast(str, event.src_path) #type: ignore # this is the correct type for this is in later versions of watchdog
-        if "__pycache__" in src_path:
-            return
-
-        # check to make sure this isn't a directory
-        if path.isdir(src_path):
-            return
-
-        # get the directory name of the plugin so that we can find its "main.py" and reload it; the
-        # file that changed is not necessarily the one that needs to be reloaded
-        self.logger.debug(f"file created: {src_path}")
-        self.maybe_reload(src_path)
-
-    def on_modified(self, event: FileSystemEvent):
-        src_path = cast(str, event.src_path) # type: ignore
-        if "__pycache__" in src_path:
-            return
-
-        # check to make sure this isn't a directory
-        if path.isdir(src_path):
-            return
+# Telemetry subscriptions are polled, this caps them at ~60 reads per second
+MIN_TELEMETRY_INTERVAL = 16 # ms
 
-        # get the directory name of the plugin so that we can find its "main.py" and reload it; the
-        # file that changed is not necessarily the one that needs to be reloaded
-        self.logger.debug(f"file modified: {src_path}")
-        self.maybe_reload(src_path)
+# How often lazily started plugins are checked for having been idle long enough to be stopped
+IDLE_CHECK_INTERVAL = 30 # seconds
 
 class Loader:
     def __init__(self, server_instance: PluginManager, ws: WSRouter, plugin_path: str, loop: AbstractEventLoop, live_reload: bool = False) -> None:
         self.loop = loop
         self.logger = getLogger("Loader")
         self.ws = ws
+        self.blob_store = server_instance.blob_store
         self.plugin_path = plugin_path
         self.logger.info(f"plugin_path: {self.plugin_path}")
         self.plugins: Plugins = {}
-        self.watcher = None
+        self.watcher: FileChangeHandler | None = None
         self.live_reload = live_reload
         self.reload_queue: ReloadQueue = Queue()
+        self.telemetry_subscriptions: Dict[int, Task[None]] = {}
+        self.last_telemetry_subscription = 0
+        # open telemetry subscriptions per plugin name, a plugin that's being watched isn't idle
+        self.telemetry_subscribers: Counter[str] = Counter()
+        # when each plugin was loaded and became usable during the last boot, see import_plugins
+        self.boot_timeline: List[Dict[str, Any]] = []
+        self.startup_history = SettingsManager("plugin_startup", path.join(get_privileged_path(), "settings"))
         self.loop.create_task(self.handle_reloads())
+        if get_lazy_plugins() and get_plugin_idle_timeout() > 0:
+            self.loop.create_task(self.suspend_idle_plugins(get_plugin_idle_timeout()))
 
         if live_reload:
+            # watchdog is only needed for live reload, so it isn't imported otherwise
+            from watchdog.observers import Observer
+            from .watcher import FileChangeHandler
             self.observer = Observer()
             self.watcher = FileChangeHandler(self.reload_queue, plugin_path)
             self.observer.schedule(self.watcher, self.plugin_path, recursive=True) # pyright: ignore [reportUnknownMemberType]
@@ -93,12 +77,19 @@ class Loader:
             web.get("/plugins/{plugin_name}/dist/{path:.*}", self.handle_plugin_dist),
             web.get("/plugins/{plugin_name}/assets/{path:.*}", self.handle_plugin_frontend_assets),
             web.get("/plugins/{plugin_name}/data/{path:.*}", self.handle_plugin_frontend_assets_from_data),
+            web.get("/plugins/{plugin_name}/channel", self.handle_plugin_channel),
         ])
 
         server_instance.ws.add_route("loader/get_plugins", self.get_plugins)
         server_instance.ws.add_route("loader/reload_plugin", self.handle_plugin_backend_reload)
         server_instance.ws.add_route("loader/call_plugin_method", self.handle_plugin_method_call)
         server_instance.ws.add_route("loader/call_legacy_plugin_method", self.handle_plugin_method_call_legacy)
+        server_instance.ws.add_route("loader/get_plugin_startup_profiles", self.get_plugin_startup_profiles)
+        server_instance.ws.add_route("loader/get_plugin_cache_stats", self.get_plugin_cache_stats)
+        server_instance.ws.add_route("loader/get_plugin_processes", self.get_plugin_processes)
+        server_instance.ws.add_route("loader/get_boot_timeline", self.get_boot_timeline)
+        server_instance.ws.add_route("loader/subscribe_telemetry", self.subscribe_telemetry)
+        server_instance.ws.add_route("loader/unsubscribe_telemetry", self.unsubscribe_telemetry)
 
     async def shutdown_plugins(self):
         await gather(*[self.plugins[plugin_name].stop() for plugin_name in self.plugins])
@@ -157,13 +148,64 @@ class Loader:
         with open(path.join(self.plugin_path, plugin.plugin_directory, "dist/index.js"), "r", encoding="utf-8") as bundle:
             return web.Response(text=bundle.read(), content_type="application/javascript")
 
-    async def import_plugin(self, file: str, plugin_directory: str, refresh: bool | None = False, batch: bool | None = False):
+    async def handle_plugin_channel(self, request: web.Request):
+        # Auth is a query param as JS WebSocket doesn't support headers
+        if request.rel_url.query.get("auth") != get_csrf_token():
+            return web.Response(text='Forbidden', status=403)
+        plugin = self.plugins.get(request.match_info["plugin_name"])
+        if plugin == None:
+            return web.Response(text='Plugin not found', status=404)
+        if plugin.passive:
+            return web.Response(text='Plugin has no backend', status=409)
+        reader, writer = await plugin.open_channel()
+
+        ws = web.WebSocketResponse()
+        try:
+            await ws.prepare(request)
+        except:
+            writer.close()
+            plugin.close_channel()
+            raise
+        self.logger.debug(f"Opened channel to {plugin.name}")
+
+        # Lines are relayed as-is in both directions, only the plugin process ever decodes them
+        async def relay_replies():
+            while not reader.at_eof():
+                line = await plugin.read_channel_line(reader)
+                if line:
+                    await ws.send_bytes(line)
+            await ws.close()
+
+        relay_task = self.loop.create_task(relay_replies())
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.TEXT:
+                    writer.write(msg.data.encode("utf-8") + b"\n")
+                elif msg.type == WSMsgType.BINARY:
+                    writer.write(msg.data + b"\n")
+                else:
+                    continue
+                await writer.drain()
+        finally:
+            relay_task.cancel()
+            writer.close()
+            plugin.close_channel()
+            self.logger.debug(f"Closed channel to {plugin.name}")
+
+        return ws
+
+    async def import_plugin(self, file: str, plugin_directory: str, refresh: bool | None = False, batch: bool | None = False) -> PluginWrapper | None:
         try:
             async def plugin_emitted_event(event: str, args: Any):
+                # skip formatting the arguments for the log too if the frontend doesn't listen to this plugin
+                if not self.ws.is_subscribed("loader/plugin_event", plugin.name):
+                    self.ws.dropped_events["loader/plugin_event"] += 1
+                    return
                 self.logger.debug(f"PLUGIN EMITTED EVENT: {event} with args {args}")
-                await self.ws.emit(f"loader/plugin_event", {"plugin": plugin.name, "event": event, "args": args})
+                await self.ws.emit(f"loader/plugin_event", {"plugin": plugin.name, "event": event, "args": args}, key=plugin.name)
 
-            plugin = PluginWrapper(file, plugin_directory, self.plugin_path, plugin_emitted_event)
+            plugin = PluginWrapper(file, plugin_directory, self.plugin_path, plugin_emitted_event, self.blob_store,
+                                   self.record_startup_profile)
             if plugin.name in self.plugins:
                     if not "debug" in plugin.flags and refresh:
                         self.logger.info(f"Plugin {plugin.name} is already loaded and has requested to not be re-loaded")
@@ -174,10 +216,16 @@ class Loader:
             if plugin.passive:
                 self.logger.info(f"Plugin {plugin.name} is passive")
 
-            self.plugins[plugin.name] = plugin.start()
-            self.logger.info(f"Loaded {plugin.name}")
+            await plugin.prepare()
+            if plugin.lazy:
+                self.plugins[plugin.name] = plugin
+                self.logger.info(f"Loaded {plugin.name}, its backend starts on the first call")
+            else:
+                self.plugins[plugin.name] = plugin.start()
+                self.logger.info(f"Loaded {plugin.name}")
             if not batch:
                 self.loop.create_task(self.dispatch_plugin(plugin.name, plugin.version, plugin.load_type))
+            return plugin
         except Exception as e:
             self.logger.error(f"Could not load {file}. {e}")
             print_exc()
@@ -185,13 +233,60 @@ class Loader:
     async def dispatch_plugin(self, name: str, version: str | None, load_type: int = PluginLoadType.ESMODULE_V1.value):
         await self.ws.emit("loader/import_plugin", name, version, load_type)        
 
-    async def import_plugins(self):
+    async def import_plugins(self, plugin_order: List[str] | None = None, hidden_plugins: List[str] | None = None):
+        '''
+        Loads the plugins in the order the user sorted them in, hidden ones last, so the plugins that are looked at
+        first are usable first. Each one is announced to the frontend as soon as its backend answers calls.
+        '''
         self.logger.info(f"import plugins from {self.plugin_path}")
 
         directories = [i for i in listdir(self.plugin_path) if path.isdir(path.join(self.plugin_path, i)) and path.isfile(path.join(self.plugin_path, i, "plugin.json"))]
+        hidden_plugins = hidden_plugins or []
+        # a plugin with a broken plugin.json goes by its directory
+        names = {directory: self.read_plugin_name(directory) or directory for directory in directories}
+        positions = {name: position for position, name in enumerate(plugin_order or [])}
+
+        def boot_order(directory: str) -> Tuple[bool, int]:
+            return (names[directory] in hidden_plugins, positions.get(names[directory], len(positions)))
+        directories.sort(key=boot_order)
+
+        boot_start = monotonic()
+        self.boot_timeline = []
         for directory in directories:
             self.logger.info(f"found plugin: {directory}")
-            await self.import_plugin(path.join(self.plugin_path, directory, "main.py"), directory, False, True)
+            entry: Dict[str, Any] = {"name": names[directory], "hidden": names[directory] in hidden_plugins,
+                                     "loaded": None, "ready": None, "failed": False}
+            self.boot_timeline.append(entry)
+            plugin = await self.import_plugin(path.join(self.plugin_path, directory, "main.py"), directory, False, True)
+            entry["loaded"] = monotonic() - boot_start
+            if plugin:
+                entry["lazy"] = plugin.lazy
+                entry["passive"] = plugin.passive
+                self.loop.create_task(self.dispatch_when_ready(plugin, entry, boot_start))
+            else:
+                entry["failed"] = True
+
+    def read_plugin_name(self, directory: str) -> str | None:
+        try:
+            with open(path.join(self.plugin_path, directory, "plugin.json"), "r", encoding="utf-8") as plugin_json:
+                return load(plugin_json)["name"]
+        except Exception:
+            # import_plugin reports broken plugins
+            return None
+
+    async def dispatch_when_ready(self, plugin: PluginWrapper, entry: Dict[str, Any], boot_start: float):
+        ready = await plugin.wait_until_ready()
+        entry["ready"] = monotonic() - boot_start
+        if not ready:
+            entry["failed"] = True
+            self.logger.error(f"Backend of {plugin.name} did not become ready {entry['ready']:.3f}s into boot")
+            return
+        self.logger.debug(f"{plugin.name} usable {entry['ready']:.3f}s into boot")
+        # a frontend that connected before this plugin was loaded didn't get it from loader/get_plugins
+        await self.ws.emit("loader/plugin_ready", plugin.name, plugin.version, plugin.load_type)
+
+    async def get_boot_timeline(self):
+        return self.boot_timeline
 
     async def handle_reloads(self):
         while True:
@@ -222,6 +317,76 @@ class Loader:
             raise e # throw again to pass the error to the frontend
         return result
 
+    def record_startup_profile(self, plugin: PluginWrapper):
+        assert plugin.startup_profile
+        history: List[Dict[str, Any]] = self.startup_history.getSetting(plugin.name, [])
+        # import trees are only kept for the current run, they are large
+        history.append({"version": plugin.version, "spawned": plugin.startup_profile["spawned"], "phases": plugin.startup_profile["phases"]})
+        self.startup_history.setSetting(plugin.name, history[-MAX_STARTUP_HISTORY:])
+
+    async def get_plugin_startup_profiles(self):
+        return {name: {"current": plugin.startup_profile, "history": self.startup_history.getSetting(name, [])}
+                for name, plugin in self.plugins.items()}
+
+    async def get_plugin_cache_stats(self):
+        return {name: plugin.method_cache.get_stats() for name, plugin in self.plugins.items()
+                if plugin.method_cache.policies or plugin.method_cache.coalesced}
+
+    async def get_plugin_processes(self):
+        '''Which plugin backends are running and their resident memory, to see what lazy starting saves'''
+        plugins = {name: plugin.get_process_info() for name, plugin in self.plugins.items() if not plugin.passive}
+        return {
+            "loader_rss": get_process_rss(getpid()),
+            "plugins_rss": sum(info["rss"] or 0 for info in plugins.values()),
+            "plugins": plugins
+        }
+
+    async def suspend_idle_plugins(self, idle_timeout: float):
+        while True:
+            await sleep(min(idle_timeout, IDLE_CHECK_INTERVAL))
+            for plugin in list(self.plugins.values()):
+                if not self.telemetry_subscribers[plugin.name]:
+                    await plugin.suspend_if_idle(idle_timeout)
+
+    async def subscribe_telemetry(self, plugin_name: str, channel: str, interval: int):
+        plugin = self.plugins.get(plugin_name)
+        if plugin and not plugin.passive:
+            # a lazy plugin only publishes while running
+            await plugin.wake()
+        self.last_telemetry_subscription += 1
+        subscription = self.last_telemetry_subscription
+        self.telemetry_subscriptions[subscription] = self.loop.create_task(
+            self.forward_telemetry(subscription, plugin_name, channel, max(interval, MIN_TELEMETRY_INTERVAL) / 1000))
+        return subscription
+
+    async def unsubscribe_telemetry(self, subscription: int):
+        task = self.telemetry_subscriptions.pop(subscription, None)
+        if task:
+            task.cancel()
+
+    async def forward_telemetry(self, subscription: int, plugin_name: str, channel: str, interval: float):
+        # Reads the latest value at the frontend's rate and only sends it on if it changed,
+        # so plugins can publish as often as they like without flooding the websocket
+        session = self.ws.get_calling_session()
+        last = None
+        self.telemetry_subscribers[plugin_name] += 1
+        try:
+            # the frontend is gone, nobody is listening to this subscription anymore
+            while not (session and session.expired):
+                plugin = self.plugins.get(plugin_name)
+                slot = plugin.telemetry.get(channel) if plugin else None
+                if slot:
+                    seq, payload = slot.read()
+                    if payload is not None and (slot, seq) != last:
+                        last = (slot, seq)
+                        await self.ws.emit("loader/telemetry", subscription, loads(payload), session=session)
+                await sleep(interval)
+        finally:
+            self.telemetry_subscriptions.pop(subscription, None)
+            self.telemetry_subscribers[plugin_name] -= 1
+            if not self.telemetry_subscribers[plugin_name]:
+                del self.telemetry_subscribers[plugin_name]
+
     async def handle_plugin_backend_reload(self, plugin_name: str):
         plugin = self.plugins[plugin_name]
 
@@ -0,0 +1,14 @@
+from typing import NamedTuple
+
+class PlatformContext(NamedTuple):
+    '''
+    Host details that don't change while the loader runs. They used to be looked up on every call (scanning the
+    whole passwd database, creating directories), now they are resolved once by get_platform_context.
+    '''
+    privileged_path: str
+    unprivileged_path: str
+    # the user hosting the plugin loader, None fields if it doesn't exist on this system
+    user: str
+    user_id: int | None
+    user_group_id: int | None
+    user_home: str | None
@@ -1,5 +1,7 @@
 import platform, os
 
+from .context import PlatformContext
+
 ON_WINDOWS = platform.system() == "Windows"
 ON_LINUX = not ON_WINDOWS
 
@@ -10,6 +12,13 @@ else:
     from .localplatformlinux import *
     from . import localplatformlinux as localplatform
 
+def get_platform_context() -> PlatformContext:
+    '''Paths and the host user, resolved on first use and cached until invalidate_platform_context() is called'''
+    return localplatform.get_platform_context()
+
+def invalidate_platform_context():
+    localplatform.invalidate_platform_context()
+
 def get_privileged_path() -> str:
     '''Get path accessible by elevated user. Holds plugins, decky loader and decky loader configs'''
     return localplatform.get_privileged_path()
@@ -34,6 +43,30 @@ def get_server_port() -> int:
 def get_live_reload() -> bool:
     return os.getenv("LIVE_RELOAD", "1") == "1"
 
+def get_loop_monitor() -> bool:
+    '''Whether the loader and plugin processes watch their event loops for blocking code, see loopmonitor.py'''
+    return os.getenv("LOOP_MONITOR", "1") == "1"
+
+def get_event_loop_kind() -> str:
+    '''Event loop of the loader, "asyncio" or "uvloop", see eventloop.py'''
+    return os.getenv("EVENT_LOOP", "asyncio")
+
+def get_plugin_event_loop_kind() -> str:
+    '''Event loop of plugin processes, chosen separately since plugins may use libraries that only work on asyncio's'''
+    return os.getenv("PLUGIN_EVENT_LOOP", "asyncio")
+
+def get_max_background_calls() -> int:
+    '''How many background calls the loader, and each plugin process, runs at once, see priority.py'''
+    return max(int(os.getenv("MAX_BACKGROUND_CALLS", "2")), 1)
+
+def get_lazy_plugins() -> bool:
+    '''Whether plugin backends start on their first call instead of at boot, unless they have the "background" flag'''
+    return os.getenv("LAZY_PLUGINS", "0") == "1"
+
+def get_plugin_idle_timeout() -> float:
+    '''Seconds without calls after which a lazily started plugin backend is stopped again, 0 to keep it running'''
+    return float(os.getenv("PLUGIN_IDLE_TIMEOUT", "600"))
+
 def get_keep_systemd_service() -> bool:
     return os.getenv("KEEP_SYSTEMD_SERVICE", "0") == "1"
 
@@ -1,10 +1,10 @@
 from re import compile
 from asyncio import Lock, create_subprocess_exec
 from asyncio.subprocess import PIPE, DEVNULL, STDOUT, Process
-from subprocess import call as call_sync
-import os, pwd, grp, sys, logging
-from typing import IO, Any, Mapping
+import os, pwd, grp, stat, sys, logging
+from typing import IO, Any, Iterator, Mapping
 from ..enums import UserType
+from .context import PlatformContext
 
 logger = logging.getLogger("localplatform")
 
@@ -18,11 +18,14 @@ async def run(args: list[str], stdin: ProcessIO = DEVNULL, stdout: ProcessIO = P
 
 # Get the user id hosting the plugin loader
 def _get_user_id() -> int:
-    return pwd.getpwnam(_get_user()).pw_uid
+    user_id = get_platform_context().user_id
+    if user_id is None:
+        raise KeyError(f"getpwnam(): name not found: '{_get_user()}'")
+    return user_id
 
 # Get the user hosting the plugin loader
 def _get_user() -> str:
-    return get_unprivileged_user()
+    return get_platform_context().user
 
 # Get the effective user id of the running process
 def _get_effective_user_id() -> int:
@@ -36,54 +39,85 @@ def _get_effective_user() -> str:
 def _get_effective_user_group_id() -> int:
     return os.getegid()
 
-# Get the effective user group of the running process
-def _get_effective_user_group() -> str:
-    return grp.getgrgid(_get_effective_user_group_id()).gr_name
+# Get the name of the given group id
+def get_group_name(group_id: int) -> str:
+    return grp.getgrgid(group_id).gr_name
 
 # Get the user owner of the given file path.
 def _get_user_owner(file_path: str) -> str:
     return pwd.getpwuid(os.stat(file_path).st_uid).pw_name
 
-# Get the user group of the given file path, or the user group hosting the plugin loader
-def _get_user_group(file_path: str | None = None) -> str:
-    return grp.getgrgid(os.stat(file_path).st_gid if file_path is not None else _get_user_group_id()).gr_name
-
 # Get the group id of the user hosting the plugin loader
 def _get_user_group_id() -> int:
-    return pwd.getpwuid(_get_user_id()).pw_gid
-
-def chown(path : str,  user : UserType = UserType.HOST_USER, recursive : bool = True) -> bool:
-    user_str = ""
+    group_id = get_platform_context().user_group_id
+    if group_id is None:
+        raise KeyError(f"getpwnam(): name not found: '{_get_user()}'")
+    return group_id
 
+def _get_user_ids(user: UserType) -> tuple[int, int]:
     if user == UserType.HOST_USER:
-        user_str = _get_user()+":"+_get_user_group()
+        return _get_user_id(), _get_user_group_id()
     elif user == UserType.EFFECTIVE_USER:
-        user_str = _get_effective_user()+":"+_get_effective_user_group()
+        return _get_effective_user_id(), _get_effective_user_group_id()
     else:
         raise Exception("Unknown User Type")
 
-    result = call_sync(["chown", "-R", user_str, path] if recursive else ["chown", user_str, path])
-    return result == 0
+# Yields every entry below path without following symlinks, like chown -R does
+def _walk(path: str) -> Iterator[tuple[str, os.stat_result]]:
+    dirs = [path]
+    while dirs:
+        with os.scandir(dirs.pop()) as entries:
+            for entry in entries:
+                yield entry.path, entry.stat(follow_symlinks=False)
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+
+def _set_owner_and_mode(path: str, uid: int | None, gid: int | None, mode: int | None, recursive: bool) -> bool:
+    '''
+    Walks the tree once and only touches entries that actually need changing,
+    so a tree that's already right costs a stat per file instead of a process spawn and two full passes.
+    '''
+    ok = True
+
+    def fix(entry_path: str, st: os.stat_result, follow_symlinks: bool):
+        nonlocal ok
+        try:
+            if uid is not None and gid is not None and (st.st_uid != uid or st.st_gid != gid):
+                os.chown(entry_path, uid, gid, follow_symlinks=follow_symlinks)
+            # chmod can't change a symlink itself on Linux and must not change its target
+            if mode is not None and not stat.S_ISLNK(st.st_mode) and stat.S_IMODE(st.st_mode) != mode:
+                os.chmod(entry_path, mode)
+        except OSError as e:
+            logger.debug(f"Failed to fix permissions of {entry_path}: {e}")
+            ok = False
+
+    try:
+        if recursive and os.path.isdir(path):
+            for entry_path, st in _walk(path):
+                fix(entry_path, st, False)
+        fix(path, os.stat(path), True)
+    except OSError as e:
+        logger.debug(f"Failed to fix permissions of {path}: {e}")
+        return False
+
+    return ok
+
+def chown(path : str,  user : UserType = UserType.HOST_USER, recursive : bool = True) -> bool:
+    uid, gid = _get_user_ids(user)
+    return _set_owner_and_mode(path, uid, gid, None, recursive)
 
 def chmod(path : str, permissions : int, recursive : bool = True) -> bool:
     if _get_effective_user_id() != 0:
         return True
 
-    try:
-        octal_permissions = int(str(permissions), 8)
-
-        if recursive:
-            for root, dirs, files in os.walk(path):  
-                for d in dirs:  
-                    os.chmod(os.path.join(root, d), octal_permissions)
-                for d in files:
-                    os.chmod(os.path.join(root, d), octal_permissions)
-
-        os.chmod(path, octal_permissions)
-    except:
-        return False
+    return _set_owner_and_mode(path, None, None, int(str(permissions), 8), recursive)
 
-    return True
+def set_owner_and_mode(path : str, user : UserType, permissions : int, recursive : bool = True) -> bool:
+    '''chown and chmod in a single pass. Blocking, call it from an executor when on the event loop.'''
+    uid, gid = _get_user_ids(user)
+    # like chmod, only root is expected to fix modes
+    mode = int(str(permissions), 8) if _get_effective_user_id() == 0 else None
+    return _set_owner_and_mode(path, uid, gid, mode, recursive)
 
 def file_owner(path : str) -> UserType|None:
     user_owner = _get_user_owner(path)
@@ -101,6 +135,9 @@ def get_home_path(user : UserType = UserType.HOST_USER) -> str:
     user_name = "root"
 
     if user == UserType.HOST_USER:
+        user_home = get_platform_context().user_home
+        if user_home is not None:
+            return user_home
         user_name = _get_user()
     elif user == UserType.EFFECTIVE_USER:
         user_name = _get_effective_user()
@@ -178,15 +215,29 @@ async def restart_webhelper() -> bool:
     res, _, _ = await run(["killall", "-s", "SIGTERM", "steamwebhelper"], stdout=DEVNULL, stderr=DEVNULL)
     return res.returncode == 0
 
-def get_privileged_path() -> str:
-    path = os.getenv("PRIVILEGED_PATH")
-
-    if path == None:
-        path = get_unprivileged_path()
+_platform_context: PlatformContext | None = None
+
+def get_platform_context() -> PlatformContext:
+    global _platform_context
+    if _platform_context is None:
+        unprivileged_path = _resolve_unprivileged_path()
+        privileged_path = os.getenv("PRIVILEGED_PATH", unprivileged_path)
+        os.makedirs(privileged_path, exist_ok=True)
+        user = _resolve_unprivileged_user(unprivileged_path)
+        try:
+            pw = pwd.getpwnam(user)
+            _platform_context = PlatformContext(privileged_path, unprivileged_path, user, pw.pw_uid, pw.pw_gid, pw.pw_dir)
+        except KeyError:
+            _platform_context = PlatformContext(privileged_path, unprivileged_path, user, None, None, None)
+    return _platform_context
+
+def invalidate_platform_context():
+    '''Makes the next get_platform_context() resolve everything again, e.g. after changing the environment'''
+    global _platform_context
+    _platform_context = None
 
-    os.makedirs(path, exist_ok=True)
-
-    return path
+def get_privileged_path() -> str:
+    return get_platform_context().privileged_path
 
 def _parent_dir(path : str | None) -> str | None:
     if path == None:
@@ -198,6 +249,9 @@ def _parent_dir(path : str | None) -> str | None:
     return os.path.dirname(path)
 
 def get_unprivileged_path() -> str:
+    return get_platform_context().unprivileged_path
+
+def _resolve_unprivileged_path() -> str:
     path = os.getenv("UNPRIVILEGED_PATH")
     
     if path == None:
@@ -224,13 +278,15 @@ def get_unprivileged_path() -> str:
 
     return path
 
-
 def get_unprivileged_user() -> str:
+    return get_platform_context().user
+
+def _resolve_unprivileged_user(unprivileged_path: str) -> str:
     user = os.getenv("UNPRIVILEGED_USER")
 
     if user == None:
         # Lets hope we can extract it from the unprivileged dir
-        dir = os.path.realpath(get_unprivileged_path())
+        dir = os.path.realpath(unprivileged_path)
 
         pws = sorted(pwd.getpwall(), reverse=True, key=lambda pw: len(pw.pw_dir))
         for pw in pws:
@@ -279,3 +335,11 @@ async def close_cef_socket():
             return
 
         logger.info("CEF socket closed")
+
+def get_process_rss(pid: int) -> int | None:
+    '''Resident memory of a process in bytes, None if it is gone'''
+    try:
+        with open(f"/proc/{pid}/statm", "r") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
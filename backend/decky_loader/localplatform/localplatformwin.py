@@ -1,4 +1,5 @@
 from ..enums import UserType
+from .context import PlatformContext
 import os, sys
 
 def chown(path : str,  user : UserType = UserType.HOST_USER, recursive : bool = True) -> bool:
@@ -7,6 +8,9 @@ def chown(path : str,  user : UserType = UserType.HOST_USER, recursive : bool =
 def chmod(path : str, permissions : int, recursive : bool = True) -> bool:
     return True # Stubbed
 
+def set_owner_and_mode(path : str, user : UserType, permissions : int, recursive : bool = True) -> bool:
+    return True # Stubbed
+
 def file_owner(path : str) -> UserType|None:
     return UserType.HOST_USER # Stubbed
 
@@ -40,11 +44,27 @@ def get_effective_username() -> str:
 def get_username() -> str:
     return os.getlogin()
 
+_platform_context: PlatformContext | None = None
+
+def get_platform_context() -> PlatformContext:
+    global _platform_context
+    if _platform_context is None:
+        path = _resolve_unprivileged_path()
+        _platform_context = PlatformContext(path, path, os.getenv("UNPRIVILEGED_USER", os.getlogin()), None, None, os.path.expanduser("~"))
+    return _platform_context
+
+def invalidate_platform_context():
+    global _platform_context
+    _platform_context = None
+
 def get_privileged_path() -> str:
     '''On windows, privileged_path is equal to unprivileged_path'''
-    return get_unprivileged_path()
+    return get_platform_context().privileged_path
 
 def get_unprivileged_path() -> str:
+    return get_platform_context().unprivileged_path
+
+def _resolve_unprivileged_path() -> str:
     path = os.getenv("UNPRIVILEGED_PATH")
 
     if path == None:
@@ -55,10 +75,13 @@ def get_unprivileged_path() -> str:
     return path
 
 def get_unprivileged_user() -> str:
-    return os.getenv("UNPRIVILEGED_USER", os.getlogin())
+    return get_platform_context().user
 
 async def restart_webhelper() -> bool:
     return True # Stubbed
 
 async def close_cef_socket():
-    return # Stubbed
\ No newline at end of file
+    return # Stubbed
+
+def get_process_rss(pid: int) -> int | None:
+    return None # Stubbed
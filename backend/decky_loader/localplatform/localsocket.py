@@ -1,19 +1,33 @@
-import asyncio, time
-from typing import Any, Callable, Coroutine
+import asyncio
+from hashlib import sha256
+from multiprocessing import Pipe
+from multiprocessing.connection import Connection
+from inspect import isasyncgen
+from os import path
+from typing import Any, AsyncIterator, Callable, Coroutine
 import random
 
 from .localplatform import ON_WINDOWS
 
 BUFFER_LIMIT = 2 ** 20  # 1 MiB
+READY_TIMEOUT = 30 # seconds to wait for the plugin process to start listening
+UNIX_PATH_MAX = 107 # sun_path is 108 bytes including the trailing NUL
+
+def get_socket_path(runtime_dir: str, name: str) -> str:
+    socket_path = path.join(runtime_dir, f"{name}.sock")
+    if len(socket_path.encode("utf-8")) > UNIX_PATH_MAX:
+        # long plugin directory names would overflow sun_path, fall back to a stable hash of the name
+        socket_path = path.join(runtime_dir, f"{sha256(name.encode('utf-8')).hexdigest()[:16]}.sock")
+    return socket_path
 
 class UnixSocket:
-    def __init__(self):
+    def __init__(self, socket_addr: str):
         '''
-        on_new_message takes 1 string argument.
+        on_new_message takes the line and whether it came in over a channel connection.
         It's return value gets used, if not None, to write data to the socket.
         Method should be async
         '''
-        self.socket_addr = f"/tmp/plugin_socket_{time.time()}"
+        self.socket_addr = socket_addr
         self.on_new_message = None
         self.socket = None
         self.reader = None
@@ -21,26 +35,91 @@ class UnixSocket:
         self.server_writer = None
         self.open_lock = asyncio.Lock()
         self.active = True
+        # The plugin process signals this pipe once its server is listening, so the loader never has to poll for it
+        self.ready = False
+        self._ready_receiver: Connection | None = None
+        self._ready_sender: Connection | None = None
 
-    async def setup_server(self, on_new_message: Callable[[str], Coroutine[Any, Any, Any]]):
+    async def setup_server(self, on_new_message: Callable[[str, bool], Coroutine[Any, Any, Any]]):
         try:
             self.on_new_message = on_new_message
             self.socket = await asyncio.start_unix_server(self._listen_for_method_call, path=self.socket_addr, limit=BUFFER_LIMIT)
+            self.signal_ready()
         except asyncio.CancelledError:
             await self.close_socket_connection()
             raise
 
+    def create_ready_signal(self):
+        '''
+        Called in the loader right before the plugin process is started, and paired with detach_ready_signal right
+        after. Otherwise plugin processes forked in the meantime would inherit the sending end and keep it open.
+        '''
+        self._ready_receiver, self._ready_sender = Pipe(duplex=False)
+
+    def signal_ready(self):
+        '''
+        Called in the plugin process once the server accepts connections.
+        '''
+        assert self._ready_sender
+        self._ready_sender.send_bytes(b"1")
+        self._ready_sender.close()
+
+    def detach_ready_signal(self):
+        '''
+        Called in the loader once the plugin process has been started.
+        Dropping our copy of the sending end lets us notice a plugin process that exits before it is ready.
+        '''
+        assert self._ready_sender
+        self._ready_sender.close()
+
+    async def wait_until_ready(self, timeout: float = READY_TIMEOUT) -> bool:
+        if self.ready:
+            return True
+        if not self._ready_receiver:
+            # the plugin process was never started
+            return False
+        receiver = self._ready_receiver
+
+        loop = asyncio.get_running_loop()
+        if ON_WINDOWS:
+            # the proactor loop can't watch pipe handles
+            signaled = await loop.run_in_executor(None, receiver.poll, timeout)
+        else:
+            signal: asyncio.Future[bool] = loop.create_future()
+            fd = receiver.fileno()
+            loop.add_reader(fd, lambda: signal.done() or signal.set_result(True))
+            try:
+                signaled = await asyncio.wait_for(signal, timeout)
+            except asyncio.TimeoutError:
+                signaled = False
+            finally:
+                loop.remove_reader(fd)
+
+        if not signaled:
+            return False
+
+        try:
+            receiver.recv_bytes()
+        except EOFError:
+            # the plugin process exited without ever listening
+            return False
+
+        receiver.close()
+        self.ready = True
+        return True
+
+    async def _open_connection(self):
+        return await asyncio.open_unix_connection(self.socket_addr, limit=BUFFER_LIMIT)
+
     async def _open_socket_if_not_exists(self):
         if not self.reader:
-            retries = 0
-            while retries < 10:
-                try:
-                    self.reader, self.writer = await asyncio.open_unix_connection(self.socket_addr, limit=BUFFER_LIMIT)
-                    return True
-                except:
-                    await asyncio.sleep(2)
-                    retries += 1
-            return False
+            if not await self.wait_until_ready():
+                return False
+            try:
+                self.reader, self.writer = await self._open_connection()
+                return True
+            except:
+                return False
         else:
             return True
 
@@ -83,7 +162,18 @@ class UnixSocket:
 
         await self._write_single_line(writer, message)
 
+    async def open_channel(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        '''
+        Opens an additional connection to the plugin's server, used to proxy raw lines without going through the shared connection.
+        '''
+        # the shared connection has to exist first, as the plugin process sends its events to the first connection it accepted
+        await self.get_socket_connection()
+        return await self._open_connection()
+
     async def _read_single_line(self, reader: asyncio.StreamReader) -> str:
+        return (await self.read_raw_line(reader)).decode("utf-8")
+
+    async def read_raw_line(self, reader: asyncio.StreamReader) -> bytes:
         line = bytearray()
         while self.active:
             try:
@@ -99,7 +189,7 @@ class UnixSocket:
             else:
                 break
 
-        return line.decode("utf-8")
+        return bytes(line)
     
     async def _write_single_line(self, writer: asyncio.StreamWriter, message : str):
         if not message.endswith("\n"):
@@ -108,55 +198,63 @@ class UnixSocket:
         writer.write(message.encode("utf-8"))
         await writer.drain()
     
+    async def _write_lines(self, writer: asyncio.StreamWriter, messages: AsyncIterator[str]):
+        # drain() in between keeps a fast producer from outrunning the reader
+        try:
+            async for message in messages:
+                await self._write_single_line(writer, message)
+        finally:
+            # e.g. the connection is gone, whatever produces the lines can stop
+            if isasyncgen(messages):
+                await messages.aclose()
+
     async def write_single_line_server(self, message: str):
         if self.server_writer is None:
             return
         await self._write_single_line(self.server_writer, message)
 
     async def _listen_for_method_call(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
-        self.server_writer = writer
+        if self.server_writer is None:
+            self.server_writer = writer
         while self.active and self.on_new_message:
 
-            def _(task: asyncio.Task[str|None]):
+            def _(task: asyncio.Task[str|AsyncIterator[str]|None]):
                 res = task.result()
-                if res is not None:
+                if isinstance(res, str):
                     asyncio.create_task(self._write_single_line(writer, res))
+                elif res is not None:
+                    asyncio.create_task(self._write_lines(writer, res))
 
             line = await self._read_single_line(reader)
-            asyncio.create_task(self.on_new_message(line)).add_done_callback(_)
+            if line == "":
+                # the other end hung up, e.g. a closed frontend channel
+                break
+            # lines from connections other than the loader's come from frontend channels
+            asyncio.create_task(self.on_new_message(line, writer is not self.server_writer)).add_done_callback(_)
+        writer.close()
             
 class PortSocket (UnixSocket):
-    def __init__(self):
+    def __init__(self, socket_addr: str):
         '''
-        on_new_message takes 1 string argument.
+        on_new_message takes the line and whether it came in over a channel connection.
         It's return value gets used, if not None, to write data to the socket.
         Method should be async
         '''
-        super().__init__()
+        super().__init__(socket_addr)
         self.host = "127.0.0.1"
         self.port = random.sample(range(40000, 60000), 1)[0]
     
-    async def setup_server(self, on_new_message: Callable[[str], Coroutine[Any, Any, Any]]):
+    async def setup_server(self, on_new_message: Callable[[str, bool], Coroutine[Any, Any, Any]]):
         try:
             self.on_new_message = on_new_message
             self.socket = await asyncio.start_server(self._listen_for_method_call, host=self.host, port=self.port, limit=BUFFER_LIMIT)
+            self.signal_ready()
         except asyncio.CancelledError:
             await self.close_socket_connection()
             raise
 
-    async def _open_socket_if_not_exists(self):
-        if not self.reader:
-            retries = 0
-            while retries < 10:
-                try:
-                    self.reader, self.writer = await asyncio.open_connection(host=self.host, port=self.port, limit=BUFFER_LIMIT)
-                    return True
-                except:
-                    await asyncio.sleep(2)
-                    retries += 1
-            return False
-        else:
-            return True
+    async def _open_connection(self):
+        return await asyncio.open_connection(host=self.host, port=self.port, limit=BUFFER_LIMIT)
 
 if ON_WINDOWS:
     class LocalSocket (PortSocket):  # type: ignore
@@ -0,0 +1,78 @@
+import sys
+from asyncio import AbstractEventLoop, Task, sleep
+from collections import deque
+from logging import getLogger
+from threading import Event, Thread, get_ident
+from time import monotonic, time
+from traceback import format_stack
+from typing import Any, Deque, Dict, List
+
+TICK_INTERVAL = 0.5 # seconds
+SLOW_THRESHOLD = 0.1 # seconds of lag before a stall is reported
+MAX_SLOW_CALLBACKS = 20 # how many stalls are kept for get_stats
+
+logger = getLogger("LoopMonitor")
+
+class LoopMonitor:
+    '''
+    Measures how late the event loop runs a callback scheduled every `TICK_INTERVAL`, which is how long everything
+    else on the loop (e.g. WS messages) had to wait. A watcher thread grabs the loop thread's stack while it is
+    stalled, so the blocking code shows up in the log. This costs one wakeup per tick on the loop and one every
+    `threshold / 2` in the thread, so it can stay on in production.
+    '''
+    def __init__(self, loop: AbstractEventLoop, name: str, threshold: float = SLOW_THRESHOLD) -> None:
+        self.loop = loop
+        self.name = name
+        self.threshold = threshold
+        self.ticks = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.slow_callbacks: Deque[Dict[str, Any]] = deque(maxlen=MAX_SLOW_CALLBACKS)
+        self._last_tick = monotonic()
+        self._stall_stack: List[str] | None = None
+        self._stopped = Event()
+        self._task: Task[None] | None = None
+
+    def start(self):
+        self._loop_thread = get_ident()
+        self._last_tick = monotonic()
+        self._task = self.loop.create_task(self._tick())
+        Thread(target=self._watch, name=f"{self.name} loop monitor", daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+
+    async def _tick(self):
+        while True:
+            expected = monotonic() + TICK_INTERVAL
+            await sleep(TICK_INTERVAL)
+            self._last_tick = now = monotonic()
+            lag = max(now - expected, 0)
+            self.ticks += 1
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+            if lag > self.threshold:
+                self.stalls += 1
+                stack, self._stall_stack = self._stall_stack, None
+                self.slow_callbacks.append({"time": time(), "lag": lag, "stack": stack})
+                logger.warning(f"{self.name} event loop was blocked for {lag * 1000:.0f}ms"
+                               + (f" in:\n{''.join(stack)}" if stack else ""))
+
+    def _watch(self):
+        while not self._stopped.wait(self.threshold / 2):
+            if self._stall_stack is None and monotonic() - self._last_tick > TICK_INTERVAL + self.threshold:
+                frame = sys._current_frames().get(self._loop_thread) # pyright: ignore [reportPrivateUsage]
+                if frame:
+                    self._stall_stack = format_stack(frame)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "ticks": self.ticks,
+            "average_lag": self.total_lag / self.ticks if self.ticks else 0,
+            "max_lag": self.max_lag,
+            "stalls": self.stalls,
+            "slow_callbacks": list(self.slow_callbacks)
+        }
@@ -1,17 +1,23 @@
+from __future__ import annotations
+# Has to come first to see every import when running with --profile-startup
+from .startup import start_profiling, mark_phase, finish_profiling
+start_profiling()
+
 # Change PyInstaller files permissions
 import sys
-from typing import Any, Dict
+from typing import TYPE_CHECKING, Any, Dict
 from .localplatform.localplatform import (chmod, chown, service_stop, service_start,
                             ON_WINDOWS, ON_LINUX, get_log_level, get_live_reload, 
                             get_server_port, get_server_host, get_chown_plugin_path,
-                            get_privileged_path, restart_webhelper)
+                            get_privileged_path, get_unprivileged_path, get_loop_monitor, restart_webhelper,
+                            get_event_loop_kind)
 if hasattr(sys, '_MEIPASS'):
     chmod(sys._MEIPASS, 755) # type: ignore
     
 # Full imports
 import multiprocessing
 multiprocessing.freeze_support()
-from asyncio import AbstractEventLoop, CancelledError, Task, all_tasks, current_task, gather, new_event_loop, set_event_loop, sleep
+from asyncio import AbstractEventLoop, CancelledError, Task, all_tasks, current_task, gather, set_event_loop, sleep
 from logging import basicConfig, getLogger
 from os import path
 from traceback import format_exc
@@ -21,22 +27,27 @@ import aiohttp_cors # pyright: ignore [reportMissingTypeStubs]
 # Partial imports
 from aiohttp import client_exceptions
 from aiohttp.web import Application, Response, Request, get, run_app, static # pyright: ignore [reportUnknownVariableType]
-from aiohttp_jinja2 import setup as jinja_setup
 from setproctitle import getproctitle, setproctitle, setthreadtitle
 
 # local modules
-from .browser import PluginBrowser
+from .blobs import BlobStore
 from .helpers import (REMOTE_DEBUGGER_UNIT, create_inject_script, csrf_middleware, get_csrf_token, get_loader_version,
                      mkdir_as_user, get_system_pythonpaths, get_effective_user_id)
                      
 from .injector import get_gamepadui_tab, Tab
 from .loader import Loader
+from .loopmonitor import LoopMonitor
 from .settings import SettingsManager
-from .updater import Updater
 from .utilities import Utilities
 from .enums import UserType
+from .eventloop import create_event_loop
 from .wsrouter import WSRouter
 
+# The updater and the plugin browser aren't needed to serve the frontend, they are imported once used
+if TYPE_CHECKING:
+    from .browser import PluginBrowser
+    from .updater import Updater
+
 
 basicConfig(
     level=get_log_level(),
@@ -71,24 +82,29 @@ class PluginManager:
             )
         })
         self.ws = WSRouter(self.loop, self.web_app)
+        self.blob_store = BlobStore(self.loop, self.web_app)
         self.plugin_loader = Loader(self, self.ws, plugin_path, self.loop, get_live_reload())
         self.settings = SettingsManager("loader", path.join(get_privileged_path(), "settings"))
-        self.plugin_browser = PluginBrowser(plugin_path, self.plugin_loader.plugins, self.plugin_loader, self.settings) 
+        self._plugin_browser: PluginBrowser | None = None
         self.utilities = Utilities(self)
-        self.updater = Updater(self)
+        self._updater: Updater | None = None
         self.last_webhelper_exit: float = 0
         self.webhelper_crash_count: int = 0
         self.inject_fallback: bool = False
-
-        jinja_setup(self.web_app)
+        self.loop_monitor: LoopMonitor | None = None
+        if get_loop_monitor():
+            self.loop_monitor = LoopMonitor(self.loop, "Loader")
+            self.loop_monitor.start()
 
         async def startup(_: Application):
+            mark_phase("server startup")
             if self.settings.getSetting("cef_forward", False):
                 self.loop.create_task(service_start(REMOTE_DEBUGGER_UNIT))
             else:
                 self.loop.create_task(service_stop(REMOTE_DEBUGGER_UNIT))
             self.loop.create_task(self.loader_reinjector())
             self.loop.create_task(self.load_plugins())
+            self.loop.create_task(self.start_deferred_subsystems())
 
         self.web_app.on_startup.append(startup)
         self.web_app.on_shutdown.append(self.shutdown)
@@ -100,6 +116,27 @@ class PluginManager:
             self.cors.add(route) # pyright: ignore [reportUnknownMemberType]
         self.web_app.add_routes([static("/static", path.join(path.dirname(__file__), 'static'))])
 
+    @property
+    def plugin_browser(self) -> PluginBrowser:
+        if self._plugin_browser is None:
+            from .browser import PluginBrowser
+            self._plugin_browser = PluginBrowser(plugin_path, self.plugin_loader.plugins, self.plugin_loader, self.settings)
+        return self._plugin_browser
+
+    @property
+    def updater(self) -> Updater:
+        if self._updater is None:
+            from .updater import Updater
+            self._updater = Updater(self)
+        return self._updater
+
+    async def start_deferred_subsystems(self):
+        # yield to the server setup first, the updater only has to be there by the time the frontend asks for it
+        await sleep(0)
+        # constructing it registers its routes and schedules the update checks
+        _ = self.updater
+        mark_phase("deferred subsystems")
+
     async def handle_crash(self):
         if not self.reinject:
             return
@@ -162,15 +199,19 @@ class PluginManager:
         loop.default_exception_handler(context)
 
     async def get_auth_token(self, request: Request):
+        mark_phase("auth token")
         return Response(text=get_csrf_token())
 
     async def load_plugins(self):
         # await self.wait_for_server()
         logger.debug("Loading plugins")
-        await self.plugin_loader.import_plugins()
+        await self.plugin_loader.import_plugins(self.settings.getSetting("pluginOrder", []), self.settings.getSetting("hiddenPlugins", []))
         if self.settings.getSetting("pluginOrder", None) == None:
           self.settings.setSetting("pluginOrder", list(self.plugin_loader.plugins.keys()))
           logger.debug("Did not find pluginOrder setting, set it to default")
+        mark_phase("plugins loaded")
+        profile_path = path.join(get_unprivileged_path(), "logs", "loader_startup_profile.log")
+        finish_profiling(profile_path)
 
     async def loader_reinjector(self):
         while self.reinject:
@@ -252,6 +293,7 @@ class PluginManager:
         run_app(self.web_app, host=get_server_host(), port=get_server_port(), loop=self.loop, access_log=None, handle_signals=True, shutdown_timeout=40)
 
 def main():
+    mark_phase("imports")
     setproctitle(f"Decky Loader {get_loader_version()} ({getproctitle()})")
     setthreadtitle("Decky Loader")
     if ON_WINDOWS:
@@ -264,9 +306,12 @@ def main():
 
     # Append the system and user python paths
     sys.path.extend(get_system_pythonpaths())
+    mark_phase("system python paths")
 
     logger.info(f"Starting Decky version {get_loader_version()}")
 
-    loop = new_event_loop()
+    loop = create_event_loop(get_event_loop_kind())
     set_event_loop(loop)
-    PluginManager(loop).run()
+    manager = PluginManager(loop)
+    mark_phase("subsystems")
+    manager.run()
@@ -0,0 +1,94 @@
+import sys
+from importlib.machinery import (BYTECODE_SUFFIXES, EXTENSION_SUFFIXES, SOURCE_SUFFIXES, ExtensionFileLoader,
+                                 FileFinder, SourceFileLoader, SourcelessFileLoader)
+from importlib.util import MAGIC_NUMBER, source_hash
+from logging import getLogger
+from marshal import loads
+from os import makedirs, path, stat, walk
+from py_compile import PycInvalidationMode, PyCompileError, compile as compile_source
+from shutil import rmtree
+from types import CodeType
+
+from ..localplatform.localplatform import get_privileged_path
+
+logger = getLogger("bytecode")
+
+# Flags of a pyc that is validated against the hash of its source, see PEP 552
+CHECKED_HASH_FLAGS = 0b11
+
+def get_bytecode_cache_dir() -> str:
+    '''
+    Plugin directories usually aren't writable by the plugin process, so it would recompile everything on every
+    start. The loader compiles plugins into this directory instead, which plugin processes only read from.
+    '''
+    return path.join(get_privileged_path(), "cache", "bytecode")
+
+def get_cached_bytecode_path(source_path: str) -> str:
+    # same layout as sys.pycache_prefix
+    head, tail = path.split(path.abspath(source_path))
+    return path.join(get_bytecode_cache_dir(), head.lstrip(path.sep), f"{path.splitext(tail)[0]}.{sys.implementation.cache_tag}.pyc")
+
+def _get_plugin_sources(plugin_dir: str):
+    main_py = path.join(plugin_dir, "main.py")
+    if path.isfile(main_py):
+        yield main_py
+    for root, dirs, files in walk(path.join(plugin_dir, "py_modules")):
+        dirs[:] = [d for d in dirs if d != "__pycache__"]
+        for file in files:
+            if file.endswith(".py"):
+                yield path.join(root, file)
+
+def precompile_plugin(plugin_dir: str) -> int:
+    '''Byte-compiles main.py and py_modules of a plugin into the cache, returns how many files were (re)compiled.'''
+    compiled = 0
+    for source_path in _get_plugin_sources(plugin_dir):
+        cache_path = get_cached_bytecode_path(source_path)
+        try:
+            # a stale entry is harmless as it's checked against the source hash on import, this just saves work
+            if path.exists(cache_path) and stat(cache_path).st_mtime >= stat(source_path).st_mtime:
+                continue
+            makedirs(path.dirname(cache_path), exist_ok=True)
+            compile_source(source_path, cfile=cache_path, dfile=source_path, doraise=True, invalidation_mode=PycInvalidationMode.CHECKED_HASH)
+            compiled += 1
+        except (OSError, PyCompileError) as e:
+            # the plugin fails to import with a proper error later on if the source is broken
+            logger.debug(f"Could not precompile {source_path}: {e}")
+    return compiled
+
+def remove_plugin_bytecode(plugin_dir: str):
+    rmtree(path.join(get_bytecode_cache_dir(), path.abspath(plugin_dir).lstrip(path.sep)), ignore_errors=True)
+
+class CachedSourceFileLoader(SourceFileLoader):
+    '''
+    Loads source files with the bytecode from the loader's cache if it matches the source,
+    and falls back to the regular __pycache__ handling otherwise.
+    '''
+    def get_code(self, fullname: str) -> CodeType | None:
+        source_path = self.get_filename(fullname)
+        try:
+            with open(get_cached_bytecode_path(source_path), "rb") as f:
+                data = f.read()
+            source = self.get_data(source_path)
+        except OSError:
+            return super().get_code(fullname)
+
+        if (data[:4] != MAGIC_NUMBER or int.from_bytes(data[4:8], "little") != CHECKED_HASH_FLAGS
+                or data[8:16] != source_hash(source)):
+            return super().get_code(fullname)
+        return loads(data[16:])
+
+def install_bytecode_cache(plugin_dir: str):
+    '''Makes imports of modules inside plugin_dir use the bytecode cache, called in the plugin process.'''
+    plugin_dir = path.abspath(plugin_dir)
+    loaders = [(ExtensionFileLoader, EXTENSION_SUFFIXES), (CachedSourceFileLoader, SOURCE_SUFFIXES),
+               (SourcelessFileLoader, BYTECODE_SUFFIXES)]
+
+    def path_hook(entry: str) -> FileFinder:
+        entry = path.abspath(entry)
+        if entry != plugin_dir and not entry.startswith(plugin_dir + path.sep):
+            raise ImportError("Not a plugin path")
+        return FileFinder(entry, *loaders) # pyright: ignore [reportArgumentType]
+
+    sys.path_hooks.insert(0, path_hook)
+    # finders for paths that were already used are cached
+    sys.path_importer_cache.clear()
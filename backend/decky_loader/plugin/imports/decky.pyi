@@ -16,7 +16,9 @@ __version__ = '1.0.0'
 
 import logging
 
-from typing import Any
+from typing import Any, Callable, TypeVar
+
+_F = TypeVar("_F", bound=Callable[..., Any])
 
 """
 Constants
@@ -182,4 +184,54 @@ async def emit(event: str, *args: Any) -> None:
     """
     Triggers all event listeners in the frontend waiting for `event`, passing the remaining `*args` as the arguments to each listener function.
     (Event listeners are set up in the frontend via the `addEventListener` function from `@decky/api`)
-    """
\ No newline at end of file
+    """
+
+def cacheable(ttl: float, invalidate_on: str | list[str] | None = None) -> Callable[[_F], _F]:
+    """
+    Marks a method as cacheable: the loader keeps its result for `ttl` seconds and answers calls with the same
+    arguments without asking the plugin again. Emitting any of the `invalidate_on` events drops the cached results,
+    e.g. emit "config_changed" after saving the config `get_config` returns.
+    Only use this for methods that don't have side effects. The same can be declared in plugin.json:
+    `"cache": {"get_config": {"ttl": 60, "invalidate_on": ["config_changed"]}}`
+    """
+
+def coalesce(method: _F) -> _F:
+    """
+    Marks a method whose identical calls may share a result: while a call is running, calls with the same arguments
+    wait for it instead of running the method again, e.g. when several components load the same data at once.
+    Methods marked with `cacheable` already behave like this. The same can be declared in plugin.json:
+    `"coalesce": ["list_profiles"]`
+    """
+
+"""
+Blob sharing
+"""
+
+async def share_file(path: str, content_type: str | None = None, ttl: float = 60) -> str:
+    """
+    Makes the file at `path` downloadable by the frontend and returns its URL, so binary data doesn't have to be
+    base64-encoded into a method result. The URL supports range requests and stops working after `ttl` seconds
+    or once `release_blob` is called.
+    The file has to be owned by the plugin's user or readable by everyone. Later changes to it may not be served.
+    """
+
+async def share_bytes(data: bytes, content_type: str | None = None, ttl: float = 60) -> str:
+    """
+    Like `share_file`, but for data in memory. The data is written to shared memory and freed by the loader
+    once the URL expires or is released.
+    """
+
+async def release_blob(url: str) -> None:
+    """
+    Invalidates a URL returned by `share_file` or `share_bytes` before its `ttl` runs out.
+    """
+
+"""
+Telemetry
+"""
+async def publish(channel: str, value: Any) -> None:
+    """
+    Sets the current value of the telemetry `channel`, e.g. a sensor reading.
+    Only the latest value is kept; the frontend reads it at its own rate (see `subscribeTelemetry` in the frontend
+    backend API), so publishing many times per second is cheap and never queues up.
+    """
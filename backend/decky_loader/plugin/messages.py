@@ -1,12 +1,40 @@
-from typing import Any, TypedDict
+from typing import Any, Callable, Coroutine, TypedDict
 from enum import IntEnum
 from uuid import uuid4
-from asyncio import Event
+from asyncio import Event, Queue
+from json import dumps
 
 class SocketMessageType(IntEnum):
     CALL = 0
     RESPONSE = 1
     EVENT = 2
+    # Results of async generator methods, Plugin -> Loader. The RESPONSE only announces the stream.
+    CHUNK = 3
+    STREAM_END = 4
+    # Flow control for streams, Loader -> Plugin
+    STREAM_CREDIT = 5
+    STREAM_CANCEL = 6
+    # Blob store, Plugin -> Loader
+    BLOB_ADD = 7
+    BLOB_RELEASE = 8
+    # Latest-value telemetry, Plugin -> Loader. Only sent when a channel's shared memory slot is (re)created
+    TELEMETRY_SLOT = 9
+    # Startup phase timings, requested by the Loader once connected and answered by the Plugin
+    STARTUP_PROFILE = 10
+    # Profiling session, Loader -> Plugin. Answered with a RESPONSE holding the blob URL of the result
+    PROFILE = 11
+    # Event loop statistics, Loader -> Plugin. Answered with a RESPONSE
+    LOOP_STATS = 12
+    # Methods declared with decky.cacheable and decky.coalesce, requested by the Loader once connected and answered by the Plugin
+    METHOD_POLICY = 13
+    # Queue latency per call priority, Loader -> Plugin. Answered with a RESPONSE
+    PRIORITY_STATS = 14
+
+# How many chunks a plugin may send ahead of what the loader has consumed
+STREAM_WINDOW = 16
+
+# Marks the end of a stream in MethodCallStream's queue, chunks themselves may be None
+_STREAM_END = object()
 
 class SocketResponseDict(TypedDict):
     type: SocketMessageType
@@ -33,4 +61,50 @@ class MethodCallRequest:
         await self.event.wait()
         if not self.response.success:
             raise Exception(self.response.result)
-        return self.response.result
\ No newline at end of file
+        return self.response.result
+
+class MethodCallStream:
+    '''
+    Loader side of a method call whose result is an async generator.
+    Chunks are handed out as they arrive, and the plugin is granted more credit as they are consumed, so at most
+    `STREAM_WINDOW` chunks are ever buffered. Closing the stream early cancels the generator in the plugin.
+    '''
+    def __init__(self, id: str, write_line: Callable[[str], Coroutine[Any, Any, Any]]) -> None:
+        self.id = id
+        self.write_line = write_line
+        self.chunks: Queue[Any] = Queue()
+        self.consumed = 0
+        self.end: SocketResponseDict | None = None
+        self.closed = False
+
+    def put_chunk(self, chunk: Any):
+        self.chunks.put_nowait(chunk)
+
+    def finish(self, dc: SocketResponseDict):
+        self.end = dc
+        self.chunks.put_nowait(_STREAM_END)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Any:
+        if self.closed:
+            raise StopAsyncIteration
+
+        chunk = await self.chunks.get()
+        if chunk is _STREAM_END:
+            self.closed = True
+            assert self.end is not None
+            if not self.end["success"]:
+                raise Exception(self.end["res"])
+            raise StopAsyncIteration
+
+        self.consumed += 1
+        if self.consumed % (STREAM_WINDOW // 2) == 0:
+            await self.write_line(dumps({"type": SocketMessageType.STREAM_CREDIT, "id": self.id, "credit": STREAM_WINDOW // 2}))
+        return chunk
+
+    async def aclose(self):
+        if not self.closed and not self.end:
+            self.closed = True
+            await self.write_line(dumps({"type": SocketMessageType.STREAM_CANCEL, "id": self.id}))
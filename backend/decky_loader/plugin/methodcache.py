@@ -0,0 +1,121 @@
+from asyncio import Task
+from time import monotonic
+from typing import Any, Dict, List, Set, Tuple, cast
+
+from ..jsoncodec import canonical_dumps
+
+# Attribute set on plugin methods by decky.cacheable, holding the same policy as plugin.json's "cache" entries
+CACHE_POLICY_ATTRIBUTE = "__decky_cache__"
+# Set by decky.coalesce, like plugin.json's "coalesce" list
+COALESCE_ATTRIBUTE = "__decky_coalesce__"
+
+def parse_cache_policy(policy: Dict[str, Any]) -> Dict[str, Any]:
+    '''Normalizes a method's cache policy, `invalidate_on` may be given as a single event name'''
+    events: Any = policy.get("invalidate_on") or []
+    if isinstance(events, str):
+        events = [events]
+    if not isinstance(events, list) or not all(isinstance(event, str) for event in cast(List[Any], events)):
+        raise ValueError(f"invalidate_on has to be an event name or a list of them, not {events!r}")
+    invalidate_on = cast(List[str], events)
+    return {"ttl": float(policy["ttl"]), "invalidate_on": invalidate_on}
+
+class MethodCache:
+    '''
+    Results of a plugin's cacheable methods, so repeated calls of e.g. "get config" don't have to go through the
+    plugin process. Entries are keyed by the method and its arguments and dropped once their TTL runs out or the
+    plugin emits one of the method's invalidation events.
+
+    Identical calls of cacheable and coalesced methods that overlap share a single call to the plugin.
+    '''
+    def __init__(self) -> None:
+        # method name -> {"ttl": seconds, "invalidate_on": [event names]}
+        self.policies: Dict[str, Dict[str, Any]] = {}
+        # (method name, encoded arguments) -> (expiry, result)
+        self.entries: Dict[Tuple[str, str], Tuple[float, Any]] = {}
+        # bumped by every invalidation of a method, results of calls started before that are not stored
+        self.generations: Dict[str, int] = {}
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+        self.coalesced: Set[str] = set()
+        # (method name, encoded arguments, priority) -> (generation it was started in, call)
+        # Calls of different priorities aren't shared, an interactive call mustn't wait in the background lane.
+        self.in_flight: Dict[Tuple[str, str, str], Tuple[int, Task[Any]]] = {}
+        # calls that joined one already in flight instead of reaching the plugin
+        self.saved_calls: Dict[str, int] = {}
+
+    def set_policies(self, policies: Dict[str, Dict[str, Any]], coalesced: List[str]):
+        self.clear()
+        self.policies = {method: parse_cache_policy(policy) for method, policy in policies.items()}
+        self.coalesced = set(coalesced)
+
+    def is_cacheable(self, method_name: str) -> bool:
+        return method_name in self.policies
+
+    def is_shared(self, method_name: str) -> bool:
+        return method_name in self.policies or method_name in self.coalesced
+
+    def key(self, method_name: str, args: Tuple[Any, ...]) -> Tuple[str, str]:
+        return (method_name, canonical_dumps(args))
+
+    def get(self, key: Tuple[str, str]) -> Tuple[bool, Any]:
+        '''Returns whether there is a fresh entry for `key`, and its result'''
+        method_name = key[0]
+        entry = self.entries.get(key)
+        if entry and entry[0] > monotonic():
+            self.hits[method_name] = self.hits.get(method_name, 0) + 1
+            return True, entry[1]
+        if entry:
+            del self.entries[key]
+        self.misses[method_name] = self.misses.get(method_name, 0) + 1
+        return False, None
+
+    def generation(self, method_name: str) -> int:
+        return self.generations.get(method_name, 0)
+
+    def join(self, key: Tuple[str, str], priority: str) -> Task[Any] | None:
+        '''Returns the identical call of the same priority in flight, unless the method was invalidated since it started'''
+        call = self.in_flight.get((*key, priority))
+        if not call or call[0] != self.generation(key[0]):
+            return None
+        self.saved_calls[key[0]] = self.saved_calls.get(key[0], 0) + 1
+        return call[1]
+
+    def put(self, key: Tuple[str, str], generation: int, result: Any):
+        method_name = key[0]
+        # the method was invalidated while it ran, the result may already be outdated
+        if generation != self.generation(method_name):
+            return
+        self.entries[key] = (monotonic() + self.policies[method_name]["ttl"], result)
+
+    def invalidate(self, event: str):
+        methods = [method for method, policy in self.policies.items() if event in policy["invalidate_on"]]
+        if not methods:
+            return
+        for method in methods:
+            self.generations[method] = self.generation(method) + 1
+        self.entries = {key: entry for key, entry in self.entries.items() if key[0] not in methods}
+
+    def clear(self):
+        for method in self.policies.keys() | self.coalesced:
+            self.generations[method] = self.generation(method) + 1
+        self.entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        methods: List[Dict[str, Any]] = []
+        for method in self.policies:
+            hits, misses = self.hits.get(method, 0), self.misses.get(method, 0)
+            methods.append({"method": method, "hits": hits, "misses": misses,
+                            "hit_ratio": hits / (hits + misses) if hits + misses else None,
+                            "saved_calls": self.saved_calls.get(method, 0)})
+        for method in self.coalesced - self.policies.keys():
+            methods.append({"method": method, "hits": 0, "misses": 0, "hit_ratio": None,
+                            "saved_calls": self.saved_calls.get(method, 0)})
+        hits, misses = sum(self.hits.values()), sum(self.misses.values())
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / (hits + misses) if hits + misses else None,
+            "saved_calls": sum(self.saved_calls.values()),
+            "entries": len(self.entries),
+            "methods": methods
+        }
@@ -1,24 +1,32 @@
-from asyncio import CancelledError, Task, create_task, sleep, wait
-from json import dumps, load, loads
+from asyncio import CancelledError, Event, Lock, StreamReader, Task, TimeoutError, create_task, current_task, get_running_loop, shield, sleep, wait, wait_for
+from json import load
 from logging import getLogger
 from os import path
 from multiprocessing import Process
-from time import time
+from time import monotonic, time
 from traceback import format_exc
 
+from .bytecode import precompile_plugin
 from .sandboxed_plugin import SandboxedPlugin
-from .messages import MethodCallRequest, SocketMessageType
+from .messages import MethodCallRequest, MethodCallStream, SocketMessageType
+from .methodcache import MethodCache
 from ..enums import PluginLoadType, UserType
-from ..localplatform.localplatform import file_owner, chown, chmod, get_chown_plugin_path
-from ..localplatform.localsocket import LocalSocket
+from ..localplatform.localplatform import file_owner, chown, set_owner_and_mode, get_chown_plugin_path, get_lazy_plugins, get_process_rss
+from ..localplatform.localsocket import READY_TIMEOUT, LocalSocket, get_socket_path
 from ..helpers import get_homebrew_path, mkdir_as_user
+from ..blobs import BlobStore, get_blob_owner_uid, get_blob_temp_dir
+from ..telemetry import TelemetrySlot
+from ..jsoncodec import dumps, loads
+from ..priority import current_priority
 
-from typing import Any, Callable, Coroutine, Dict, List
+from typing import Any, Callable, Coroutine, Dict, List, Tuple
 
 EmittedEventCallbackType = Callable[[str, Any], Coroutine[Any, Any, Any]]
+StartupProfileCallbackType = Callable[["PluginWrapper"], None]
 
 class PluginWrapper:
-    def __init__(self, file: str, plugin_directory: str, plugin_path: str, emit_callback: EmittedEventCallbackType) -> None:
+    def __init__(self, file: str, plugin_directory: str, plugin_path: str, emit_callback: EmittedEventCallbackType, blob_store: BlobStore,
+                 startup_profile_callback: StartupProfileCallbackType | None = None) -> None:
         self.file = file
         self.plugin_path = plugin_path
         self.plugin_directory = plugin_directory
@@ -41,34 +49,154 @@ class PluginWrapper:
         self.author = json["author"]
         self.flags = json["flags"]
         self.api_version = json["api_version"] if "api_version" in json else 0
+        # cacheable and coalesced methods, more can be declared with decky.cacheable and decky.coalesce.
+        # Cache policies from here take precedence over those.
+        self.cache_policies: Dict[str, Dict[str, Any]] = json["cache"] if "cache" in json else {}
+        self.coalesced_methods: List[str] = json["coalesce"] if "coalesce" in json else []
+        self.method_cache = MethodCache()
         
         self.passive = not path.isfile(self.file)
 
         self.log = getLogger("plugin")
-
-        if get_chown_plugin_path():
-            # ensure plugin folder ownership
-            if file_owner(plugin_dir_path) != UserType.EFFECTIVE_USER:
-                chown(plugin_dir_path, UserType.EFFECTIVE_USER if "root" in self.flags else UserType.HOST_USER, True)
-                chown(plugin_dir_path, UserType.EFFECTIVE_USER, False)
-                chmod(plugin_dir_path, 755, True)
-            # fix plugin.json permissions
-            if file_owner(plugin_json_path) != UserType.EFFECTIVE_USER:
-                chown(plugin_json_path, UserType.EFFECTIVE_USER, False)
-                chmod(plugin_json_path, 755, False)
+        self._set_method_policies({"cache": {}, "coalesce": [], "streams": []})
 
         self.sandboxed_plugin = SandboxedPlugin(self.name, self.passive, self.flags, self.file, self.plugin_directory, self.plugin_path, self.version, self.author, self.api_version)
         self.proc: Process | None = None
-        self._socket = LocalSocket()
+        # started on the first call instead of at boot and stopped again once idle, see Loader.suspend_idle_plugins
+        self.lazy = get_lazy_plugins() and "background" not in self.flags
+        self.starts = 0
+        self._socket = self._create_socket()
+        self._start_lock = Lock()
+        # set while suspend_if_idle stops the process, which is still alive until it has
+        self._stopping = False
+        # calls and channels using the plugin process right now, it isn't stopped while there are any
+        self._users = 0
+        self.last_used = monotonic()
+        # set once the loader connected to the process' socket, or the process exited before it could
+        self._ready = Event()
+        self._ready_ok = False
         self._listener_task: Task[Any]
         self._method_call_requests: Dict[str, MethodCallRequest] = {}
+        self._method_call_streams: Dict[str, MethodCallStream] = {}
+        self.telemetry: Dict[str, TelemetrySlot] = {}
 
         self.emitted_event_callback: EmittedEventCallbackType = emit_callback
+        self.startup_profile_callback = startup_profile_callback
+        self.spawn_time: float | None = None
+        # phase timings in seconds since spawning, reported by the plugin process once it is listening
+        self.startup_profile: Dict[str, Any] | None = None
+        self.blob_store = blob_store
 
         # TODO enable this after websocket release
         self.legacy_method_warning = False
 
+    def __str__(self) -> str:
+        return self.name
+
+    def _create_socket(self) -> LocalSocket:
         home = get_homebrew_path()
+        return LocalSocket(get_socket_path(path.join(home, "run"), self.plugin_directory))
+
+    @property
+    def running(self) -> bool:
+        return self.proc != None and self.proc.is_alive()
+
+    async def _use(self):
+        '''Starts the process of a lazy plugin if it isn't running. Has to be paired with _release.'''
+        self._users += 1
+        self.last_used = monotonic()
+        try:
+            if self.lazy and (self._stopping or not self.running):
+                # also waits for the plugin to be stopped if it is being suspended right now, then starts it again
+                async with self._start_lock:
+                    if not self.running:
+                        self.log.info(f"Starting {self.name} on demand")
+                        self.start()
+        except:
+            # the caller doesn't get to _release if starting failed or it was cancelled while waiting
+            self._release()
+            raise
+
+    def _release(self):
+        self._users -= 1
+        self.last_used = monotonic()
+
+    async def wake(self):
+        '''Starts a lazy plugin without calling it, e.g. for the frontend to get its telemetry'''
+        await self._use()
+        self._release()
+
+    def _is_idle(self, idle_timeout: float) -> bool:
+        # open streams are in use even when no calls are, the loader doesn't suspend plugins with telemetry subscribers
+        return (self.lazy and self.running and self._users == 0 and not self._method_call_streams
+                and monotonic() - self.last_used > idle_timeout)
+
+    async def wait_until_ready(self) -> bool:
+        '''
+        Waits until the backend answers calls, returns False if it didn't come up. Passive plugins and lazy ones that
+        haven't been started yet are usable right away.
+        '''
+        if self.passive or (self.lazy and not self.running):
+            return True
+        if not self.proc:
+            return False
+        try:
+            await wait_for(self._ready.wait(), READY_TIMEOUT)
+        except TimeoutError:
+            return False
+        return self._ready_ok
+
+    async def suspend_if_idle(self, idle_timeout: float) -> bool:
+        '''Stops a lazy plugin that hasn't been called in `idle_timeout` seconds, it starts again on the next call'''
+        if not self._is_idle(idle_timeout):
+            return False
+        async with self._start_lock:
+            if not self._is_idle(idle_timeout):
+                return False
+            self.log.info(f"Stopping {self.name} after {monotonic() - self.last_used:.0f}s without calls")
+            self._stopping = True
+            try:
+                await self.stop()
+            finally:
+                self._stopping = False
+        return True
+
+    def get_process_info(self) -> Dict[str, Any]:
+        running = self.running
+        return {
+            "lazy": self.lazy,
+            "running": running,
+            "starts": self.starts,
+            "idle_for": monotonic() - self.last_used,
+            "rss": get_process_rss(self.proc.pid) if running and self.proc and self.proc.pid else None
+        }
+
+    async def prepare(self):
+        '''
+        Fixes ownership of the plugin's files, byte-compiles it and creates its directories. This walks whole trees,
+        so it runs in an executor instead of blocking the event loop.
+        '''
+        await get_running_loop().run_in_executor(None, self._prepare_directories)
+
+    def _prepare_directories(self):
+        plugin_dir_path = path.join(self.plugin_path, self.plugin_directory)
+        plugin_json_path = path.join(plugin_dir_path, "plugin.json")
+
+        if get_chown_plugin_path():
+            # ensure plugin folder ownership
+            if file_owner(plugin_dir_path) != UserType.EFFECTIVE_USER:
+                set_owner_and_mode(plugin_dir_path, UserType.EFFECTIVE_USER if "root" in self.flags else UserType.HOST_USER, 755, True)
+                chown(plugin_dir_path, UserType.EFFECTIVE_USER, False)
+            # fix plugin.json permissions
+            if file_owner(plugin_json_path) != UserType.EFFECTIVE_USER:
+                set_owner_and_mode(plugin_json_path, UserType.EFFECTIVE_USER, 755, False)
+
+        compiled = precompile_plugin(plugin_dir_path)
+        if compiled:
+            self.log.debug(f"Compiled {compiled} files of {self.name}")
+
+        home = get_homebrew_path()
+        mkdir_as_user(path.join(home, "run"))
         mkdir_as_user(path.join(home, "settings", self.plugin_directory))
         # TODO maybe dont chown this?
         mkdir_as_user(path.join(home, "data"))
@@ -76,58 +204,252 @@ class PluginWrapper:
         # TODO maybe dont chown this?
         mkdir_as_user(path.join(home, "logs"))
         mkdir_as_user(path.join(home, "logs", self.plugin_directory))
-
-    def __str__(self) -> str:
-        return self.name
     
-    async def _response_listener(self):
-        while self._socket.active:
+    async def _response_listener(self, socket: LocalSocket):
+        # the plugin process signals its socket once it's listening, from then on calls go through
+        _, writer = await socket.get_socket_connection()
+        if writer != None:
+            self._set_ready()
+        # answered with the phase timings, see SandboxedPlugin._mark_phase
+        await socket.write_single_line(dumps({"type": SocketMessageType.STARTUP_PROFILE}))
+        await socket.write_single_line(dumps({"type": SocketMessageType.METHOD_POLICY}))
+        while socket.active:
             try:
-                line = await self._socket.read_single_line()
+                line = await socket.read_single_line()
+                if line == None and not (self.proc and self.proc.is_alive()):
+                    self.log.error(f"Plugin {self.name} exited before its backend became ready")
+                    self._ready.set()
+                    break
                 if line != None:
+                    if not self._ready_ok:
+                        # the connection only came up after the first attempt timed out
+                        self._set_ready()
                     res = loads(line)
                     if res["type"] == SocketMessageType.EVENT.value:
+                        # before any later responses are cached
+                        self.method_cache.invalidate(res["event"])
                         create_task(self.emitted_event_callback(res["event"], res["args"]))
                     elif res["type"] == SocketMessageType.RESPONSE.value:
+                        if res.get("stream"):
+                            # the method is an async generator, its chunks follow
+                            res["res"] = self._method_call_streams[res["id"]] = MethodCallStream(res["id"], socket.write_single_line)
                         self._method_call_requests.pop(res["id"]).set_result(res)
+                    elif res["type"] == SocketMessageType.CHUNK.value:
+                        self._method_call_streams[res["id"]].put_chunk(res["res"])
+                    elif res["type"] == SocketMessageType.STREAM_END.value:
+                        self._method_call_streams.pop(res["id"]).finish(res)
+                    elif res["type"] == SocketMessageType.BLOB_ADD.value:
+                        self._add_blob(res)
+                    elif res["type"] == SocketMessageType.BLOB_RELEASE.value:
+                        self.blob_store.release(res["token"], self.name)
+                    elif res["type"] == SocketMessageType.TELEMETRY_SLOT.value:
+                        self._open_telemetry_slot(res)
+                    elif res["type"] == SocketMessageType.STARTUP_PROFILE.value:
+                        self._set_startup_profile(res)
+                    elif res["type"] == SocketMessageType.METHOD_POLICY.value:
+                        self._set_method_policies(res)
             except CancelledError:
                 self.log.info(f"Stopping response listener for {self.name}")
-                await self._socket.close_socket_connection()
+                await socket.close_socket_connection()
                 raise
             except:
                 pass
 
+    def _add_blob(self, res: Dict[str, Any]):
+        try:
+            self.blob_store.add(res["token"], self.name, res["path"], res["content_type"], res["ttl"], res["owned"],
+                                get_blob_owner_uid("root" in self.flags))
+        except Exception as e:
+            # the plugin already handed out the URL, it will just 404
+            self.log.error(f"Plugin {self.name} failed to share {res['path']}: {e}")
+
+    def _open_telemetry_slot(self, res: Dict[str, Any]):
+        try:
+            slot = TelemetrySlot.open(res["path"], get_blob_owner_uid("root" in self.flags), get_blob_temp_dir())
+        except Exception as e:
+            self.log.error(f"Plugin {self.name} failed to open telemetry channel {res['channel']}: {e}")
+            return
+        # the plugin outgrew the previous slot and already dropped it
+        if res["channel"] in self.telemetry:
+            self.telemetry[res["channel"]].close(True)
+        self.telemetry[res["channel"]] = slot
+
+    def _set_ready(self):
+        self._ready_ok = True
+        self._ready.set()
+
+    def _set_startup_profile(self, res: Dict[str, Any]):
+        spawn_time = self.spawn_time or 0
+        self.startup_profile = {
+            "spawned": spawn_time,
+            "phases": [["spawned", 0]] + [[name, timestamp - spawn_time] for name, timestamp in res["phases"]],
+            "imports": res["imports"]
+        }
+        self.log.debug(f"Plugin {self.name} started in {self.startup_profile['phases'][-1][1]:.3f}s")
+        if self.startup_profile_callback:
+            self.startup_profile_callback(self)
+
+    def _set_method_policies(self, res: Dict[str, Any]):
+        policies: Dict[str, Dict[str, Any]] = {**res["cache"], **self.cache_policies}
+        coalesced: List[str] = res["coalesce"] + self.coalesced_methods
+        # the chunks of a stream go to the caller that started it, they can't be shared or replayed
+        streams = set(res["streams"]) & (policies.keys() | coalesced)
+        if streams:
+            self.log.warning(f"Plugin {self.name} can't cache or coalesce the streamed methods {', '.join(sorted(streams))}")
+        try:
+            self.method_cache.set_policies({method: policy for method, policy in policies.items() if method not in streams},
+                                           [method for method in coalesced if method not in streams])
+        except Exception as e:
+            self.log.error(f"Plugin {self.name} declared an invalid cache policy: {e}")
+            return
+        if self.method_cache.policies:
+            self.log.debug(f"Caching results of {', '.join(self.method_cache.policies)} for {self.name}")
+
+    def close_telemetry(self):
+        for slot in self.telemetry.values():
+            slot.close(True)
+        self.telemetry.clear()
+
     async def execute_legacy_method(self, method_name: str, kwargs: Dict[Any, Any]):
         if not self.legacy_method_warning:
             self.legacy_method_warning = True
             self.log.warning(f"Plugin {self.name} is using legacy method calls. This will be removed in a future release.")
         if self.passive:
             raise RuntimeError("This plugin is passive (aka does not implement main.py)")
-        
-        request = MethodCallRequest()
-        await self._socket.get_socket_connection()
-        await self._socket.write_single_line(dumps({ "type": SocketMessageType.CALL, "method": method_name, "args": kwargs, "id": request.id, "legacy": True }, ensure_ascii=False))
-        self._method_call_requests[request.id] = request
 
-        return await request.wait_for_result()
+        await self._use()
+        try:
+            request = MethodCallRequest()
+            _, writer = await self._socket.get_socket_connection()
+            if writer == None:
+                raise RuntimeError(f"Backend of plugin {self.name} did not become ready")
+            await self._socket.write_single_line(dumps({ "type": SocketMessageType.CALL, "method": method_name, "args": kwargs, "id": request.id, "legacy": True,
+                                                      "priority": current_priority.get() }))
+            self._method_call_requests[request.id] = request
+
+            return await request.wait_for_result()
+        finally:
+            self._release()
 
     async def execute_method(self, method_name: str, *args: List[Any]):
         if self.passive:
             raise RuntimeError("This plugin is passive (aka does not implement main.py)")
-        
+
+        if not self.method_cache.is_shared(method_name):
+            return await self._call_method(method_name, args)
+
+        key = self.method_cache.key(method_name, args)
+        if self.method_cache.is_cacheable(method_name):
+            hit, result = self.method_cache.get(key)
+            if hit:
+                return result
+
+        priority = current_priority.get()
+        call = self.method_cache.join(key, priority)
+        if call is None:
+            call = create_task(self._call_shared_method(key, priority, args))
+            self.method_cache.in_flight[(*key, priority)] = (self.method_cache.generation(method_name), call)
+            # a caller going away must not cancel the call for the others
+            return await shield(call)
+
+        result = await shield(call)
+        if isinstance(result, MethodCallStream):
+            # it belongs to whoever started the call, e.g. one made before the plugin said which methods stream
+            return await self._call_method(method_name, args)
+        return result
+
+    async def _call_shared_method(self, key: Tuple[str, str], priority: str, args: Tuple[Any, ...]):
+        method_name = key[0]
+        generation = self.method_cache.generation(method_name)
+        try:
+            result = await self._call_method(method_name, args)
+        finally:
+            # a newer identical call may have taken over the slot after an invalidation
+            if self.method_cache.in_flight.get((*key, priority), (None, None))[1] is current_task():
+                del self.method_cache.in_flight[(*key, priority)]
+        # streams can't be replayed
+        if self.method_cache.is_cacheable(method_name) and not isinstance(result, MethodCallStream):
+            self.method_cache.put(key, generation, result)
+        return result
+
+    async def _call_method(self, method_name: str, args: Tuple[Any, ...]):
+        await self._use()
+        try:
+            request = MethodCallRequest()
+            _, writer = await self._socket.get_socket_connection()
+            if writer == None:
+                raise RuntimeError(f"Backend of plugin {self.name} did not become ready")
+            await self._socket.write_single_line(dumps({ "type": SocketMessageType.CALL, "method": method_name, "args": args, "id": request.id,
+                                                      "priority": current_priority.get() }))
+            self._method_call_requests[request.id] = request
+
+            return await request.wait_for_result()
+        finally:
+            self._release()
+    
+    async def profile(self, duration: float, mode: str) -> str:
+        '''Profiles the plugin process, returns the blob URL of the result'''
+        return await self._control_request({ "type": SocketMessageType.PROFILE, "duration": duration, "mode": mode })
+
+    async def get_loop_stats(self) -> Dict[str, Any] | None:
+        return await self._control_request({ "type": SocketMessageType.LOOP_STATS })
+
+    async def get_priority_stats(self) -> Dict[str, Any]:
+        return await self._control_request({ "type": SocketMessageType.PRIORITY_STATS })
+
+    async def _control_request(self, message: Dict[str, Any]) -> Any:
+        # like method calls, but handled by the plugin process itself instead of the plugin
+        if self.passive:
+            raise RuntimeError("This plugin is passive (aka does not implement main.py)")
+        if self.lazy and not self.running:
+            # statistics and profiles of a stopped plugin aren't worth starting it for
+            raise RuntimeError(f"Plugin {self.name} is not running")
+
         request = MethodCallRequest()
-        await self._socket.get_socket_connection()
-        await self._socket.write_single_line(dumps({ "type": SocketMessageType.CALL, "method": method_name, "args": args, "id": request.id }, ensure_ascii=False))
+        _, writer = await self._socket.get_socket_connection()
+        if writer == None:
+            raise RuntimeError(f"Backend of plugin {self.name} did not become ready")
+        await self._socket.write_single_line(dumps({ **message, "id": request.id }))
         self._method_call_requests[request.id] = request
 
         return await request.wait_for_result()
-    
+
+    async def open_channel(self):
+        '''Opens a channel connection, which has to be handed back with close_channel'''
+        if self.passive:
+            raise RuntimeError("This plugin is passive (aka does not implement main.py)")
+
+        await self._use()
+        try:
+            return await self._socket.open_channel()
+        except:
+            self._release()
+            raise
+
+    def close_channel(self):
+        self._release()
+
+    async def read_channel_line(self, reader: StreamReader) -> bytes:
+        return await self._socket.read_raw_line(reader)
+
     def start(self):
         if self.passive:
             return self
+        if self.proc:
+            # restarted after being stopped, the old socket's ready signal is spent
+            self._socket = self._create_socket()
+        self._socket.create_ready_signal()
         self.proc = Process(target=self.sandboxed_plugin.initialize, args=[self._socket])
-        self.proc.start()
-        self._listener_task = create_task(self._response_listener())
+        self._ready = Event()
+        self._ready_ok = False
+        self.spawn_time = time()
+        self.starts += 1
+        self.last_used = monotonic()
+        try:
+            self.proc.start()
+        finally:
+            self._socket.detach_ready_signal()
+        self._listener_task = create_task(self._response_listener(self._socket))
         return self
 
     async def stop(self, uninstall: bool = False):
@@ -136,12 +458,23 @@ class PluginWrapper:
             if self.passive:
                 return
             self.log.info(f"Shutting down {self.name}")
+            self.blob_store.release_owner(self.name)
+            self.close_telemetry()
+            self.method_cache.clear()
+            if self.lazy and not self.running and not uninstall:
+                # never started, or already stopped for being idle
+                return
 
             pending: set[Task[None]] | None = None;
 
+            if uninstall and self.lazy and not self.running:
+                # _uninstall has to run like it would if the plugin had been started at boot
+                self.start()
+                await self._socket.wait_until_ready()
+
             if uninstall:
                 _, pending = await wait([
-                    create_task(self._socket.write_single_line(dumps({ "uninstall": uninstall }, ensure_ascii=False)))
+                    create_task(self._socket.write_single_line(dumps({ "uninstall": uninstall })))
                 ], timeout=1)
 
             self.terminate() # the plugin process will handle SIGTERM and shut down cleanly without a socket message
@@ -150,6 +483,7 @@ class PluginWrapper:
                 self._listener_task.cancel()
             
             await self.kill_if_still_running()
+            self._fail_pending_calls()
 
             if pending:
                 for pending_task in pending:
@@ -159,6 +493,17 @@ class PluginWrapper:
         except Exception as e:
             self.log.error(f"Error during shutdown for plugin {self.name}: {str(e)}\n{format_exc()}")
 
+    def _fail_pending_calls(self):
+        '''Answers the calls and ends the streams that the stopped process can't anymore'''
+        for request_id, request in self._method_call_requests.items():
+            request.set_result({"type": SocketMessageType.RESPONSE, "id": request_id, "success": False,
+                                "res": f"Plugin {self.name} was stopped"})
+        self._method_call_requests.clear()
+        for stream_id, stream in self._method_call_streams.items():
+            stream.finish({"type": SocketMessageType.STREAM_END, "id": stream_id, "success": False,
+                           "res": f"Plugin {self.name} was stopped"})
+        self._method_call_streams.clear()
+
     async def kill_if_still_running(self):
         start_time = time()
         while self.proc and self.proc.is_alive():
@@ -1,22 +1,34 @@
 import sys
 from os import path, environ
 from importlib.util import module_from_spec, spec_from_file_location
-from json import dumps, loads
 from logging import getLogger
 from traceback import format_exc
-from asyncio import (ensure_future, get_event_loop, new_event_loop,
-                     set_event_loop)
+from asyncio import CancelledError, Queue, Semaphore, Task, ensure_future, get_event_loop, set_event_loop
+from inspect import getattr_static, isasyncgen, isasyncgenfunction
+from tempfile import mkstemp
+from uuid import uuid4
 from signal import SIGINT, SIGTERM
+from time import monotonic, time
 from setproctitle import setproctitle, setthreadtitle
 
-from .messages import SocketResponseDict, SocketMessageType
+from .bytecode import CachedSourceFileLoader, install_bytecode_cache
+from .messages import SocketResponseDict, SocketMessageType, STREAM_WINDOW
+from .methodcache import CACHE_POLICY_ATTRIBUTE, COALESCE_ATTRIBUTE
 from ..localplatform.localsocket import LocalSocket
-from ..localplatform.localplatform import setgid, setuid, get_username, get_home_path, ON_LINUX
+from ..localplatform.localplatform import setgid, setuid, get_username, get_home_path, get_loop_monitor, get_plugin_event_loop_kind, get_max_background_calls, ON_LINUX
+from ..loopmonitor import LoopMonitor
+from ..priority import PriorityLanes, parse_priority
 from ..enums import UserType
+from ..eventloop import create_event_loop
 from .. import helpers
+from ..blobs import get_blob_temp_dir, get_blob_url
+from ..telemetry import TelemetrySlot, encode_value
+from ..jsoncodec import dumps, loads
+from ..profiler import PROFILE_TTL, profile
+from ..startup import PROFILE_STARTUP_FLAG, StartupProfiler, stop_profiling
 from .. import settings # pyright: ignore [reportUnusedImport]
 
-from typing import List, TypeVar, Any
+from typing import AsyncIterator, Dict, List, Tuple, TypeVar, Any
 
 DataType = TypeVar("DataType")
 
@@ -42,17 +54,30 @@ class SandboxedPlugin:
         self.api_version = api_version
         self.shutdown_running = False
         self.uninstalling = False
+        # running async generator methods by call id, with the credit the loader has granted them
+        self._streams: Dict[str, Tuple[Task[None], Semaphore]] = {}
+        self._telemetry: Dict[str, TelemetrySlot] = {}
+        # (phase, unix timestamp) as the loader compares them with when it spawned the process
+        self._startup_phases: List[Tuple[str, float]] = []
+        self._import_profile: List[Tuple[int, int, int, str]] | None = None
+        self._loop_monitor: LoopMonitor | None = None
+        # calls get the priority the loader received them with, so background work in one plugin can't hold up its
+        # interactive calls either. Streams only wait for a slot to start.
+        self._lanes = PriorityLanes(get_max_background_calls())
 
         self.log = getLogger("sandboxed_plugin")
 
     def initialize(self, socket: LocalSocket):
         self._socket = socket
+        self._mark_phase("process started")
+        # the loader's own profile is inherited when forking, it would count our imports too
+        stop_profiling()
 
         try:
             setproctitle(f"{self.name} ({self.file})")
             setthreadtitle(self.name)
 
-            loop = new_event_loop()
+            loop = create_event_loop(get_plugin_event_loop_kind())
             set_event_loop(loop)
             # When running Decky manually in a terminal, ctrl-c will trigger this, so we have to handle it properly
             if ON_LINUX:
@@ -61,9 +86,14 @@ class SandboxedPlugin:
             
             if self.passive:
                 return
+
+            if get_loop_monitor():
+                self._loop_monitor = LoopMonitor(loop, self.name)
+                self._loop_monitor.start()
                 
             setgid(UserType.EFFECTIVE_USER if "root" in self.flags else UserType.HOST_USER)
             setuid(UserType.EFFECTIVE_USER if "root" in self.flags else UserType.HOST_USER)
+            self._mark_phase("privileges dropped")
             # export a bunch of environment variables to help plugin developers
             environ["HOME"] = get_home_path(UserType.EFFECTIVE_USER if "root" in self.flags else UserType.HOST_USER)
             environ["USER"] = "root" if "root" in self.flags else get_username()
@@ -82,6 +112,8 @@ class SandboxedPlugin:
 
             # append the plugin's `py_modules` to the recognized python paths
             sys.path.append(path.join(environ["DECKY_PLUGIN_DIR"], "py_modules"))
+            # use the bytecode the loader compiled, as the plugin usually can't write its own __pycache__
+            install_bytecode_cache(environ["DECKY_PLUGIN_DIR"])
 
             #TODO: FIX IN A LESS CURSED WAY
             keys = [key for key in sys.modules if key.startswith("decky_loader.")]
@@ -98,15 +130,45 @@ class SandboxedPlugin:
             # copy the docstring over so we don't have to duplicate it
             emit.__doc__ = decky.emit.__doc__
             decky.emit = emit
+
+            async def share_file(file_path: str, content_type: str | None = None, ttl: float = 60) -> str:
+                return await self._share_blob(file_path, content_type, ttl, False)
+            async def share_bytes(data: bytes, content_type: str | None = None, ttl: float = 60) -> str:
+                return await self._share_bytes(data, content_type, ttl)
+            async def release_blob(url: str) -> None:
+                await self._socket.write_single_line_server(dumps({
+                    "type": SocketMessageType.BLOB_RELEASE,
+                    "token": url.rsplit("/", 1)[-1]
+                }))
+            share_file.__doc__ = decky.share_file.__doc__
+            share_bytes.__doc__ = decky.share_bytes.__doc__
+            release_blob.__doc__ = decky.release_blob.__doc__
+            decky.share_file = share_file
+            decky.share_bytes = share_bytes
+            decky.release_blob = release_blob
+
+            async def publish(channel: str, value: Any) -> None:
+                await self._publish(channel, value)
+            publish.__doc__ = decky.publish.__doc__
+            decky.publish = publish
             sys.modules["decky"] = decky
             # provided for compatibility
             sys.modules["decky_plugin"] = decky
+            self._mark_phase("environment set up")
 
-            spec = spec_from_file_location("_", self.file)
+            import_profiler = StartupProfiler() if PROFILE_STARTUP_FLAG in sys.argv else None
+
+            spec = spec_from_file_location("_", self.file, loader=CachedSourceFileLoader("_", self.file))
             assert spec is not None
             module = module_from_spec(spec)
             assert spec.loader is not None
-            spec.loader.exec_module(module)
+            try:
+                spec.loader.exec_module(module)
+            finally:
+                if import_profiler:
+                    import_profiler.stop()
+                    self._import_profile = import_profiler.imports
+            self._mark_phase("module executed")
             # TODO fix self weirdness once plugin.json versioning is done. need this before WS release!
             if self.api_version > 0:
                 self.Plugin = module.Plugin()
@@ -118,12 +180,14 @@ class SandboxedPlugin:
                     get_event_loop().run_until_complete(self.Plugin._migration())
                 else:
                     get_event_loop().run_until_complete(self.Plugin._migration(self.Plugin))
+                self._mark_phase("migration done")
             if hasattr(self.Plugin, "_main"):
                 if self.api_version > 0:
                     get_event_loop().create_task(self.Plugin._main())
                 else:
                     get_event_loop().create_task(self.Plugin._main(self.Plugin))
-            get_event_loop().create_task(socket.setup_server(self.on_new_message))
+                self._mark_phase("main scheduled")
+            get_event_loop().create_task(self._serve())
         except:
             self.log.error("Failed to start " + self.name + "!\n" + format_exc())
             sys.exit(0)
@@ -136,6 +200,54 @@ class SandboxedPlugin:
         finally:
             get_event_loop().close()
 
+    def _mark_phase(self, name: str):
+        self._startup_phases.append((name, time()))
+
+    async def _serve(self):
+        await self._socket.setup_server(self.on_new_message)
+        self._mark_phase("socket listening")
+
+    async def _share_bytes(self, data: bytes, content_type: str | None, ttl: float) -> str:
+        fd, file_path = mkstemp(prefix="decky-blob-", dir=get_blob_temp_dir())
+        with open(fd, "wb") as file:
+            file.write(data)
+        return await self._share_blob(file_path, content_type, ttl, True)
+
+    async def _share_blob(self, file_path: str, content_type: str | None, ttl: float, owned: bool) -> str:
+        # the token is picked here so the URL can be returned right away, the loader handles
+        # messages from this socket in order so it is registered before anyone can get hold of it
+        token = str(uuid4())
+        await self._socket.write_single_line_server(dumps({
+            "type": SocketMessageType.BLOB_ADD,
+            "token": token,
+            "path": file_path,
+            "content_type": content_type,
+            "ttl": ttl,
+            "owned": owned
+        }))
+        return get_blob_url(token)
+
+    async def _publish(self, channel: str, value: Any):
+        payload = encode_value(value)
+        slot = self._telemetry.get(channel)
+        if slot and slot.fits(payload):
+            # the common case, no IPC at all
+            slot.write(payload)
+            return
+
+        # first value on this channel, or too big for the current slot; leave room to grow
+        new_slot = TelemetrySlot.create(get_blob_temp_dir(), len(payload) * 2)
+        new_slot.write(payload)
+        self._telemetry[channel] = new_slot
+        await self._socket.write_single_line_server(dumps({
+            "type": SocketMessageType.TELEMETRY_SLOT,
+            "channel": channel,
+            "path": new_slot.path
+        }))
+        if slot:
+            # the loader deletes the file once it switched over
+            slot.close()
+
     async def _unload(self):
         try:
             self.log.info("Attempting to unload with plugin " + self.name + "'s \"_unload\" function.\n")
@@ -182,15 +294,68 @@ class SandboxedPlugin:
         loop.call_soon_threadsafe(loop.stop)
         sys.exit(0)
 
-    async def on_new_message(self, message : str) -> str|None:
+    async def on_new_message(self, message : str, channel: bool = False) -> str|AsyncIterator[str]|None:
+        received = monotonic()
         data = loads(message)
 
         if "uninstall" in data:
             self.uninstalling = data.get("uninstall")
             return
 
+        if data.get("type") == SocketMessageType.STARTUP_PROFILE:
+            return dumps({
+                "type": SocketMessageType.STARTUP_PROFILE,
+                "phases": self._startup_phases,
+                "imports": self._import_profile
+            })
+
+        if data.get("type") == SocketMessageType.METHOD_POLICY:
+            return dumps({
+                "type": SocketMessageType.METHOD_POLICY,
+                **self._get_method_policies()
+            })
+
+        if data.get("type") == SocketMessageType.PROFILE:
+            return dumps(await self._profile(data["id"], data["duration"], data["mode"]))
+
+        if data.get("type") == SocketMessageType.LOOP_STATS:
+            return dumps({
+                "type": SocketMessageType.RESPONSE,
+                "res": self._loop_monitor.get_stats() if self._loop_monitor else None,
+                "success": True,
+                "id": data["id"]
+            })
+
+        if data.get("type") == SocketMessageType.PRIORITY_STATS:
+            return dumps({
+                "type": SocketMessageType.RESPONSE,
+                "res": self._lanes.get_stats(),
+                "success": True,
+                "id": data["id"]
+            })
+
+        if data.get("type") == SocketMessageType.STREAM_CREDIT:
+            if data["id"] in self._streams:
+                _, credit = self._streams[data["id"]]
+                for _ in range(data["credit"]):
+                    credit.release()
+            return
+
+        if data.get("type") == SocketMessageType.STREAM_CANCEL:
+            if data["id"] in self._streams:
+                task, _ = self._streams[data["id"]]
+                task.cancel()
+            return
+
+        async with self._lanes.lane(parse_priority(data.get("priority")), received):
+            return await self._call_method(data, channel)
+
+    async def _call_method(self, data: Dict[str, Any], channel: bool) -> str|AsyncIterator[str]:
         d: SocketResponseDict = {"type": SocketMessageType.RESPONSE, "res": None, "success": True, "id": data["id"]}
         try:
+            # channel connections are proxied from the frontend without the loader inspecting them
+            if data["method"].startswith("_"):
+                raise Exception(f"Tried to call private method {data['method']}")
             if data.get("legacy"):
                 if self.api_version > 0:
                     raise Exception("Legacy methods may not be used on api_version > 0")
@@ -200,9 +365,86 @@ class SandboxedPlugin:
                 if self.api_version < 1 :
                     raise Exception("api_version 1 or newer is required to call methods with index-based arguments")
                 # New args
-                d["res"] = await getattr(self.Plugin, data["method"])(*data["args"])
+                res = getattr(self.Plugin, data["method"])(*data["args"])
+                if isasyncgen(res):
+                    if channel:
+                        # channels have no flow control, the frontend has to use stream() for these
+                        await res.aclose()
+                        raise Exception(f"{data['method']} streams its results, which channels don't support")
+                    return self._stream_result(data["id"], res)
+                d["res"] = await res
         except Exception as e:
             d["res"] = str(e)
             d["success"] = False
+        return dumps(d)
+
+    def _get_method_policies(self) -> Dict[str, Any]:
+        # without looking the methods up normally, properties would run
+        plugin_class = self.Plugin if isinstance(self.Plugin, type) else type(self.Plugin)
+        cache: Dict[str, Any] = {}
+        coalesce: List[str] = []
+        streams: List[str] = []
+        for name in dir(plugin_class):
+            if name.startswith("_"):
+                continue
+            method = getattr_static(plugin_class, name)
+            policy = getattr(method, CACHE_POLICY_ATTRIBUTE, None)
+            if policy:
+                cache[name] = policy
+            if getattr(method, COALESCE_ATTRIBUTE, False):
+                coalesce.append(name)
+            # staticmethod and classmethod wrap the function
+            if isasyncgenfunction(getattr(method, "__func__", method)):
+                streams.append(name)
+        return {"cache": cache, "coalesce": coalesce, "streams": streams}
+
+    async def _profile(self, call_id: str, duration: float, mode: str) -> SocketResponseDict:
+        d: SocketResponseDict = {"type": SocketMessageType.RESPONSE, "res": None, "success": True, "id": call_id}
+        try:
+            result, content_type = await profile(duration, mode)
+            d["res"] = await self._share_bytes(result, content_type, PROFILE_TTL)
+        except Exception as e:
+            d["res"] = str(e)
+            d["success"] = False
+        return d
+
+    async def _stream_result(self, call_id: str, gen: AsyncIterator[Any]) -> AsyncIterator[str]:
+        lines: Queue[str | None] = Queue()
+        credit = Semaphore(STREAM_WINDOW)
+        end = {"type": SocketMessageType.STREAM_END, "res": None, "success": True, "id": call_id}
+
+        async def pump():
+            try:
+                async for chunk in gen:
+                    # hold on to the chunk until the loader has room for it
+                    await credit.acquire()
+                    lines.put_nowait(dumps({"type": SocketMessageType.CHUNK, "id": call_id, "res": chunk}))
+            except CancelledError:
+                end["res"] = "Stream was cancelled"
+                end["success"] = False
+            except Exception as e:
+                end["res"] = str(e)
+                end["success"] = False
+            finally:
+                if isasyncgen(gen):
+                    await gen.aclose()
+
+        def finished(task: Task[None]):
+            self._streams.pop(call_id, None)
+            if task.cancelled():
+                # cancelled before it got to run, so the generator never started either
+                end["res"] = "Stream was cancelled"
+                end["success"] = False
+            lines.put_nowait(dumps(end))
+            lines.put_nowait(None)
+
+        task = get_event_loop().create_task(pump())
+        task.add_done_callback(finished)
+        self._streams[call_id] = (task, credit)
+        try:
+            yield dumps({"type": SocketMessageType.RESPONSE, "res": None, "success": True, "id": call_id, "stream": True})
+            while (line := await lines.get()) is not None:
+                yield line
         finally:
-            return dumps(d, ensure_ascii=False)
+            # the lines stopped being sent, e.g. the loader's connection is gone and no more credit will come
+            task.cancel()
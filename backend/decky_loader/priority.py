@@ -0,0 +1,76 @@
+from asyncio import Semaphore
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from time import monotonic
+from typing import Any, AsyncGenerator, Dict
+
+# Calls the user is waiting on, e.g. toggling a setting, are never held back
+INTERACTIVE = "interactive"
+# Long or heavy work like installs and filepicker scans, only a few of these run at once
+BACKGROUND = "background"
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+
+# the priority of the call being handled, so work it starts elsewhere (e.g. in a plugin) can be scheduled the same way
+current_priority: ContextVar[str] = ContextVar("current_priority", default=INTERACTIVE)
+
+def parse_priority(priority: Any, default: str = INTERACTIVE) -> str:
+    return priority if priority in PRIORITIES else default
+
+class LaneStats:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.waiting = 0
+        self.running = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "waiting": self.waiting,
+            "running": self.running,
+            "avg_wait": self.total_wait / self.calls if self.calls else 0,
+            "max_wait": self.max_wait
+        }
+
+class PriorityLanes:
+    '''
+    Schedules calls by priority: interactive ones start right away, background ones wait while `max_background` of
+    them are running, so a burst of background work can't crowd the event loop. Queue latency, from when a call
+    was received until it started, is recorded per priority.
+    '''
+    def __init__(self, max_background: int) -> None:
+        self.max_background = max_background
+        self._background = Semaphore(max_background)
+        self.lanes = {priority: LaneStats() for priority in PRIORITIES}
+
+    @asynccontextmanager
+    async def lane(self, priority: str, received: float) -> AsyncGenerator[None, None]:
+        '''Waits for a slot in the `priority` lane, `received` is the monotonic time the call came in'''
+        stats = self.lanes[priority]
+        stats.waiting += 1
+        try:
+            if priority == BACKGROUND:
+                await self._background.acquire()
+        finally:
+            stats.waiting -= 1
+
+        wait = monotonic() - received
+        stats.calls += 1
+        stats.total_wait += wait
+        stats.max_wait = max(stats.max_wait, wait)
+        stats.running += 1
+        token = current_priority.set(priority)
+        try:
+            yield
+        finally:
+            current_priority.reset(token)
+            stats.running -= 1
+            if priority == BACKGROUND:
+                self._background.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "max_background": self.max_background,
+            **{priority: stats.get_stats() for priority, stats in self.lanes.items()}
+        }
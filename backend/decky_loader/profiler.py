@@ -0,0 +1,90 @@
+from asyncio import sleep
+from collections import Counter
+from cProfile import Profile
+from io import StringIO
+from logging import getLogger
+from pstats import Stats
+import signal
+from types import FrameType
+from typing import Tuple
+
+from .localplatform.localplatform import ON_LINUX
+
+# Sessions are cut off after this, so a forgotten session can't keep slowing things down
+MAX_PROFILE_DURATION = 120 # seconds
+SAMPLE_INTERVAL = 0.005 # seconds of CPU time
+# How long the result stays downloadable
+PROFILE_TTL = 600 # seconds
+
+logger = getLogger("Profiler")
+
+# only one session per process, both profilers are process wide
+_session_running = False
+
+class StackSampler:
+    '''
+    Samples the stack of the main thread (which runs the event loop) every `interval` seconds of CPU time, using
+    SIGPROF. An idle process isn't sampled at all, so the result shows what is keeping it busy.
+    '''
+    def __init__(self, interval: float = SAMPLE_INTERVAL) -> None:
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+
+    # SIGPROF and the interval timers only exist on Linux, profile() doesn't sample anywhere else
+    def start(self):
+        self.previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self.previous_handler)
+
+    def _sample(self, _: int, frame: FrameType | None):
+        stack: list[str] = []
+        while frame:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+            frame = frame.f_back
+        self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        '''The format of Brendan Gregg's stackcollapse scripts, which flamegraph tools and speedscope read'''
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+async def profile(duration: float, mode: str = "sample") -> Tuple[bytes, str]:
+    '''
+    Profiles the calling process for `duration` seconds, returns the result and its content type.
+    `mode` is either "sample" for collapsed stacks (Linux only) or "cprofile" for pstats output.
+    '''
+    global _session_running
+    if _session_running:
+        raise RuntimeError("A profiling session is already running")
+    duration = min(max(duration, 0), MAX_PROFILE_DURATION)
+
+    _session_running = True
+    try:
+        logger.info(f"Profiling for {duration}s ({mode})")
+        if mode == "sample":
+            if not ON_LINUX:
+                raise RuntimeError("Sampling is only supported on Linux, use cprofile")
+            sampler = StackSampler()
+            sampler.start()
+            try:
+                await sleep(duration)
+            finally:
+                sampler.stop()
+            return sampler.collapsed().encode("utf-8"), "text/plain"
+        elif mode == "cprofile":
+            profiler = Profile()
+            profiler.enable()
+            try:
+                await sleep(duration)
+            finally:
+                profiler.disable()
+            output = StringIO()
+            Stats(profiler, stream=output).sort_stats("cumulative").print_stats()
+            return output.getvalue().encode("utf-8"), "text/plain"
+        else:
+            raise ValueError(f"Unknown profiling mode {mode}")
+    finally:
+        _session_running = False
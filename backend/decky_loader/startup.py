@@ -0,0 +1,93 @@
+# Only the standard library may be imported here, profiling has to start before the rest of the loader is imported
+import builtins
+import sys
+from os import makedirs, path
+from threading import get_ident
+from time import perf_counter
+from types import ModuleType
+from typing import Any, List, Mapping, Sequence, Tuple
+
+PROFILE_STARTUP_FLAG = "--profile-startup"
+
+class StartupProfiler:
+    '''
+    Collects what `--profile-startup` reports: how long every module took to import, in the format of
+    `python -X importtime` (which can't be passed to the frozen loader binary), and how long each startup phase took.
+    '''
+    def __init__(self) -> None:
+        self.start = perf_counter()
+        self.last_phase = self.start
+        # name, seconds since start, seconds since the previous phase
+        self.phases: List[Tuple[str, float, float]] = []
+        # self us, cumulative us, nesting depth, module, in the order the imports finished like -X importtime
+        self.imports: List[Tuple[int, int, int, str]] = []
+        # time spent in nested imports, one entry per import in progress
+        self._nested: List[float] = []
+        self._thread = get_ident()
+        self._import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def _timed_import(self, name: str, globals: Mapping[str, Any] | None = None, locals: Mapping[str, Any] | None = None,
+                      fromlist: Sequence[str] = (), level: int = 0) -> ModuleType:
+        # imports in executor threads would mess up the nesting
+        if get_ident() != self._thread:
+            return self._import(name, globals, locals, fromlist, level)
+
+        loaded = len(sys.modules)
+        self._nested.append(0)
+        start = perf_counter()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = perf_counter() - start
+            nested = self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+            # modules that were already imported cost next to nothing, only report the ones that got loaded
+            if len(sys.modules) != loaded:
+                self.imports.append((int((elapsed - nested) * 1e6), int(elapsed * 1e6), len(self._nested), "." * level + name))
+
+    def phase(self, name: str):
+        now = perf_counter()
+        self.phases.append((name, now - self.start, now - self.last_phase))
+        self.last_phase = now
+
+    def stop(self):
+        if builtins.__import__ == self._timed_import:
+            builtins.__import__ = self._import
+
+    def write(self, file_path: str):
+        makedirs(path.dirname(file_path), exist_ok=True)
+        with open(file_path, "w", encoding="utf-8") as f:
+            f.write("phase: since start [ms] | duration [ms] | name\n")
+            for name, since_start, duration in self.phases:
+                f.write(f"phase: {since_start * 1000:16.1f} | {duration * 1000:13.1f} | {name}\n")
+            f.write("\nimport time: self [us] | cumulative | imported package\n")
+            for self_us, cumulative_us, depth, name in self.imports:
+                f.write(f"import time: {self_us:9d} | {cumulative_us:10d} | {'  ' * depth}{name}\n")
+
+profiler: StartupProfiler | None = None
+
+def start_profiling():
+    global profiler
+    if profiler is None and PROFILE_STARTUP_FLAG in sys.argv:
+        profiler = StartupProfiler()
+
+def mark_phase(name: str):
+    if profiler:
+        profiler.phase(name)
+
+def stop_profiling():
+    '''Drops the profile without writing it, e.g. in plugin processes that inherited it'''
+    global profiler
+    if profiler:
+        profiler.stop()
+        profiler = None
+
+def finish_profiling(file_path: str):
+    global profiler
+    if profiler:
+        profiler.phase("done")
+        profiler.stop()
+        profiler.write(file_path)
+        profiler = None
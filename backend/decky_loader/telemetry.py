@@ -0,0 +1,90 @@
+from mmap import ACCESS_READ, ACCESS_WRITE, mmap
+import os
+from os import O_RDONLY, close, fstat, ftruncate, lstat, open as os_open, path, remove
+from stat import S_ISREG
+from struct import Struct
+from tempfile import mkstemp
+from typing import Any, Tuple
+
+from .jsoncodec import dumps_bytes
+
+# doesn't exist on Windows
+_o_nofollow: int = getattr(os, "O_NOFOLLOW", 0)
+
+# sequence number, payload length
+HEADER = Struct("=QI")
+DEFAULT_SLOT_SIZE = 4096
+MAX_READ_ATTEMPTS = 10
+
+class TelemetrySlot:
+    '''
+    A single latest-value slot in shared memory, written by a plugin and read by the loader.
+    Writers make the sequence number odd while updating and even once done (a seqlock), readers retry if it changed
+    underneath them. Neither side ever blocks the other, and values nobody read in time are simply overwritten.
+    '''
+    def __init__(self, file_path: str, fd: int, size: int, writable: bool) -> None:
+        self.path = file_path
+        self.fd = fd
+        self.size = size
+        self.map = mmap(fd, size, access=ACCESS_WRITE if writable else ACCESS_READ)
+        self.seq = 0
+
+    @classmethod
+    def create(cls, directory: str, capacity: int) -> "TelemetrySlot":
+        size = HEADER.size + max(capacity, DEFAULT_SLOT_SIZE)
+        fd, file_path = mkstemp(prefix="decky-telemetry-", dir=directory)
+        ftruncate(fd, size)
+        return cls(file_path, fd, size, True)
+
+    @classmethod
+    def open(cls, file_path: str, owner_uid: int | None, directory: str) -> "TelemetrySlot":
+        '''Opens a slot created by a plugin, with the same ownership rules as blobs since it's deleted by the loader.'''
+        real_path = path.realpath(file_path)
+        if path.dirname(real_path) != directory:
+            raise PermissionError(f"Telemetry slots have to be in {directory}")
+        fd = os_open(real_path, O_RDONLY | _o_nofollow)
+        try:
+            st = fstat(fd)
+            if not S_ISREG(st.st_mode) or st.st_size < HEADER.size:
+                raise ValueError(f"{file_path} is not a telemetry slot")
+            if owner_uid is not None and st.st_uid != owner_uid:
+                raise PermissionError(f"{file_path} is not owned by the plugin")
+            return cls(real_path, fd, st.st_size, False)
+        except:
+            close(fd)
+            raise
+
+    def fits(self, payload: bytes) -> bool:
+        return HEADER.size + len(payload) <= self.size
+
+    def write(self, payload: bytes):
+        self.seq += 1
+        HEADER.pack_into(self.map, 0, self.seq * 2 - 1, len(payload))
+        self.map[HEADER.size:HEADER.size + len(payload)] = payload
+        HEADER.pack_into(self.map, 0, self.seq * 2, len(payload))
+
+    def read(self) -> Tuple[int, bytes | None]:
+        '''Returns the sequence number and value, the value is None if there is none yet or it kept changing while reading'''
+        for _ in range(MAX_READ_ATTEMPTS):
+            seq, length = HEADER.unpack_from(self.map, 0)
+            if seq % 2:
+                continue
+            payload = self.map[HEADER.size:HEADER.size + min(length, self.size - HEADER.size)]
+            if HEADER.unpack_from(self.map, 0)[0] == seq:
+                return seq, payload if seq else None
+        return -1, None
+
+    def close(self, delete: bool = False):
+        if delete:
+            try:
+                # only delete the path if it still is the file we were given
+                st, current = fstat(self.fd), lstat(self.path)
+                if (st.st_dev, st.st_ino) == (current.st_dev, current.st_ino):
+                    remove(self.path)
+            except FileNotFoundError:
+                pass
+        self.map.close()
+        close(self.fd)
+
+def encode_value(value: Any) -> bytes:
+    return dumps_bytes(value)
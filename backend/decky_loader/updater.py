@@ -15,6 +15,7 @@ from aiohttp import ClientSession
 
 from . import helpers
 from .settings import SettingsManager
+from .priority import BACKGROUND
 if TYPE_CHECKING:
     from .main import PluginManager
 
@@ -54,9 +55,9 @@ class Updater:
             context.ws.add_route("updater/check_for_updates", self.check_for_updates);
             context.ws.add_route("updater/do_restart", self.do_restart);
             context.ws.add_route("updater/do_shutdown", self.do_shutdown);
-            context.ws.add_route("updater/do_update", self.do_update);
+            context.ws.add_route("updater/do_update", self.do_update, BACKGROUND);
             context.ws.add_route("updater/get_testing_versions", self.get_testing_versions);
-            context.ws.add_route("updater/download_testing_version", self.download_testing_version);
+            context.ws.add_route("updater/download_testing_version", self.download_testing_version, BACKGROUND);
             context.loop.create_task(self.version_reloader())
 
     def get_branch(self, manager: SettingsManager):
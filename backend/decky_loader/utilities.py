@@ -8,19 +8,25 @@ import re
 from traceback import format_exc
 from stat import FILE_ATTRIBUTE_HIDDEN # pyright: ignore [reportAttributeAccessIssue, reportUnknownVariableType]
 
-from asyncio import StreamReader, StreamWriter, start_server, gather, open_connection
+from asyncio import StreamReader, StreamWriter, start_server, gather, open_connection, wait_for
 from aiohttp import ClientSession, hdrs
 from aiohttp.web import Request, StreamResponse, Response, json_response, post
 from typing import TYPE_CHECKING, Callable, Coroutine, Dict, Any, List, TypedDict
 
 from logging import getLogger
 from pathlib import Path
+from tempfile import mkstemp
 
-from .browser import PluginInstallRequest, PluginInstallType
+from .enums import PluginInstallType
 if TYPE_CHECKING:
     from .main import PluginManager
+    # the plugin browser is only imported once something gets installed
+    from .browser import PluginInstallRequest
 from .injector import inject_to_tab, get_gamepadui_tab, close_old_tabs, get_tab
 from . import helpers
+from .blobs import get_blob_temp_dir, get_blob_url
+from .profiler import PROFILE_TTL, profile
+from .priority import BACKGROUND
 from .localplatform.localplatform import ON_WINDOWS, service_stop, service_start, get_home_path, get_username, get_use_cef_close_workaround, close_cef_socket, restart_webhelper
 
 class FilePickerObj(TypedDict):
@@ -62,8 +68,8 @@ class Utilities:
             context.ws.add_route("utilities/install_plugin", self.install_plugin)
             context.ws.add_route("utilities/install_plugins", self.install_plugins)
             context.ws.add_route("utilities/cancel_plugin_install", self.cancel_plugin_install)
-            context.ws.add_route("utilities/confirm_plugin_install", self.confirm_plugin_install)
-            context.ws.add_route("utilities/uninstall_plugin", self.uninstall_plugin)
+            context.ws.add_route("utilities/confirm_plugin_install", self.confirm_plugin_install, BACKGROUND)
+            context.ws.add_route("utilities/uninstall_plugin", self.uninstall_plugin, BACKGROUND)
             context.ws.add_route("utilities/execute_in_tab", self.execute_in_tab)
             context.ws.add_route("utilities/inject_css_into_tab", self.inject_css_into_tab)
             context.ws.add_route("utilities/remove_css_from_tab", self.remove_css_from_tab)
@@ -71,7 +77,7 @@ class Utilities:
             context.ws.add_route("utilities/disallow_remote_debugging", self.disallow_remote_debugging)
             context.ws.add_route("utilities/start_ssh", self.allow_remote_debugging)
             context.ws.add_route("utilities/stop_ssh", self.allow_remote_debugging)
-            context.ws.add_route("utilities/filepicker_ls", self.filepicker_ls)
+            context.ws.add_route("utilities/filepicker_ls", self.filepicker_ls, BACKGROUND)
             context.ws.add_route("utilities/disable_rdt", self.disable_rdt)
             context.ws.add_route("utilities/enable_rdt", self.enable_rdt)
             context.ws.add_route("utilities/get_tab_id", self.get_tab_id)
@@ -79,6 +85,10 @@ class Utilities:
             context.ws.add_route("utilities/http_request", self.http_request_legacy)
             context.ws.add_route("utilities/restart_webhelper", self.restart_webhelper)
             context.ws.add_route("utilities/close_cef_socket", self.close_cef_socket)
+            context.ws.add_route("utilities/profile", self.profile, BACKGROUND)
+            context.ws.add_route("utilities/get_loop_stats", self.get_loop_stats)
+            context.ws.add_route("utilities/get_event_stats", self.get_event_stats)
+            context.ws.add_route("utilities/get_priority_stats", self.get_priority_stats)
             context.ws.add_route("utilities/_call_legacy_utility", self._call_legacy_utility)
 
             context.web_app.add_routes([
@@ -309,6 +319,45 @@ class Utilities:
     async def restart_webhelper(self):
         await restart_webhelper()
 
+    async def profile(self, duration: float, mode: str = "sample", plugin_name: str | None = None) -> str:
+        '''
+        Profiles the loader, or the backend of `plugin_name`, for `duration` seconds.
+        Returns a URL the result can be downloaded from, see profiler.py for the modes.
+        '''
+        if plugin_name:
+            return await self.context.plugin_loader.plugins[plugin_name].profile(duration, mode)
+
+        result, content_type = await profile(duration, mode)
+        fd, file_path = mkstemp(prefix="decky-profile-", dir=get_blob_temp_dir())
+        with open(fd, "wb") as file:
+            file.write(result)
+        token = str(uuid.uuid4())
+        self.context.blob_store.add(token, "loader", file_path, content_type, PROFILE_TTL, True)
+        return get_blob_url(token)
+
+    async def get_loop_stats(self) -> Dict[str, Any]:
+        '''Event loop lag of the loader and each plugin backend, None where the monitor is off or the backend is gone'''
+        plugins = [plugin for plugin in self.context.plugin_loader.plugins.values() if not plugin.passive]
+        # a hung plugin backend is exactly what this is meant to find, so don't wait on it forever
+        stats = await gather(*[wait_for(plugin.get_loop_stats(), 5) for plugin in plugins], return_exceptions=True)
+        return {
+            "loader": self.context.loop_monitor.get_stats() if self.context.loop_monitor else None,
+            "plugins": {plugin.name: None if isinstance(res, BaseException) else res for plugin, res in zip(plugins, stats)}
+        }
+
+    async def get_event_stats(self) -> Dict[str, Any]:
+        '''What the frontend is subscribed to and how many events were sent or dropped for lack of a subscriber'''
+        return self.context.ws.get_event_stats()
+
+    async def get_priority_stats(self) -> Dict[str, Any]:
+        '''Queue latency per call priority in the loader and each plugin backend, see priority.py'''
+        plugins = [plugin for plugin in self.context.plugin_loader.plugins.values() if not plugin.passive]
+        stats = await gather(*[wait_for(plugin.get_priority_stats(), 5) for plugin in plugins], return_exceptions=True)
+        return {
+            "loader": self.context.ws.get_priority_stats(),
+            "plugins": {plugin.name: None if isinstance(res, BaseException) else res for plugin, res in zip(plugins, stats)}
+        }
+
     async def filepicker_ls(self, 
                             path: str | None = None, 
                             include_files: bool = True,
@@ -0,0 +1,54 @@
+from __future__ import annotations
+from logging import getLogger
+from os import path
+from os.path import exists
+from pathlib import Path
+from typing import TYPE_CHECKING, cast
+
+from watchdog.events import RegexMatchingEventHandler, FileSystemEvent
+
+if TYPE_CHECKING:
+    from .loader import ReloadQueue
+
+class FileChangeHandler(RegexMatchingEventHandler):
+    def __init__(self, queue: ReloadQueue, plugin_path: str) -> None:
+        super().__init__(regexes=[r'^.*?dist\/index\.js$', r'^.*?main\.py$']) # pyright: ignore [reportUnknownMemberType]
+        self.logger = getLogger("file-watcher")
+        self.plugin_path = plugin_path
+        self.queue = queue
+        self.disabled = True
+
+    def maybe_reload(self, src_path: str):
+        if self.disabled:
+            return
+        plugin_dir = Path(path.relpath(src_path, self.plugin_path)).parts[0]
+        if exists(path.join(self.plugin_path, plugin_dir, "plugin.json")):
+            self.queue.put_nowait((path.join(self.plugin_path, plugin_dir, "main.py"), plugin_dir, True))
+
+    def on_created(self, event: FileSystemEvent):
+        src_path = cast(str, event.src_path) #type: ignore # this is the correct type for this is in later versions of watchdog
+        if "__pycache__" in src_path:
+            return
+
+        # check to make sure this isn't a directory
+        if path.isdir(src_path):
+            return
+
+        # get the directory name of the plugin so that we can find its "main.py" and reload it; the
+        # file that changed is not necessarily the one that needs to be reloaded
+        self.logger.debug(f"file created: {src_path}")
+        self.maybe_reload(src_path)
+
+    def on_modified(self, event: FileSystemEvent):
+        src_path = cast(str, event.src_path) # type: ignore
+        if "__pycache__" in src_path:
+            return
+
+        # check to make sure this isn't a directory
+        if path.isdir(src_path):
+            return
+
+        # get the directory name of the plugin so that we can find its "main.py" and reload it; the
+        # file that changed is not necessarily the one that needs to be reloaded
+        self.logger.debug(f"file modified: {src_path}")
+        self.maybe_reload(src_path)
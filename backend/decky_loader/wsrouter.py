@@ -1,17 +1,27 @@
 from logging import getLogger
 
-from asyncio import AbstractEventLoop
+from asyncio import AbstractEventLoop, CancelledError, Task, gather
+from collections import Counter
+from contextvars import ContextVar
 
 from aiohttp import WSCloseCode, WSMsgType, WSMessage
 from aiohttp.web import Application, WebSocketResponse, Request, Response, get
 
 from enum import IntEnum
 
-from typing import Callable, Coroutine, Dict, Any, cast
+from time import monotonic
+
+from typing import AsyncIterator, Callable, Coroutine, Dict, Any, List, Set, Tuple, cast
 
 from traceback import format_exc
 
+from uuid import uuid4
+
 from .helpers import get_csrf_token
+from .jsoncodec import dumps, dumps_bytes, loads
+from .localplatform.localplatform import get_max_background_calls
+from .priority import INTERACTIVE, PriorityLanes, parse_priority
+from .wssession import MAX_OUTBOX_AGE, Session
 
 class MessageType(IntEnum):
     ERROR = -1
@@ -20,6 +30,17 @@ class MessageType(IntEnum):
     REPLY = 1
     # Pub/Sub, Backend -> Frontend
     EVENT = 3
+    # Streamed replies, Backend -> Frontend. The stream is finished by a REPLY or ERROR with the same id
+    CHUNK = 4
+    # Frontend -> Backend, stops a running call
+    CANCEL = 5
+    # Many calls in one frame, Frontend -> Backend -> Frontend. The reply carries a REPLY or ERROR for each call
+    BATCH = 6
+    # Frontend -> Backend, starts or stops sending EVENTs, see is_subscribed
+    SUBSCRIBE = 7
+    UNSUBSCRIBE = 8
+    # Backend -> Frontend, first message on every connection. Says whether the frontend's session was resumed
+    SESSION = 9
 
 # WSMessage with slightly better typings
 class WSMessageExtra(WSMessage):
@@ -31,71 +52,245 @@ class WSMessageExtra(WSMessage):
 
 Route = Callable[..., Coroutine[Any, Any, Any]]
 
+# the session whose call is being handled, for routes that need to send to only the caller (see get_calling_session)
+calling_session: ContextVar[Session | None] = ContextVar("calling_session", default=None)
+
 class WSRouter:
     def __init__(self, loop: AbstractEventLoop, server_instance: Application) -> None:
         self.loop = loop
-        self.ws: WebSocketResponse | None = None
-        self.instance_id = 0
+        # every connected frontend (game mode, desktop, a dashboard...) has its own session, see wssession.py
+        self.sessions: Dict[str, Session] = {}
+        # sequence number of the last message sent, shared so broadcasts are encoded once for all sessions
+        self.seq = 0
         self.routes: Dict[str, Route]  = {}
-        # self.subscriptions: Dict[str, Callable[[Any]]] = {}
+        # priority of calls to each route unless the caller asks for another one, see priority.py
+        self.route_priorities: Dict[str, str] = {}
+        self.lanes = PriorityLanes(get_max_background_calls())
+        self.running_batches: Set[Task[None]] = set()
+        self.sent_events: Counter[str] = Counter()
+        self.dropped_events: Counter[str] = Counter()
         self.logger = getLogger("WSRouter")
 
         server_instance.add_routes([
             get("/ws", self.handle)
         ])
 
-    async def write(self, data: Dict[str, Any]):
-        if self.ws != None:
-            await self.ws.send_json(data)
+    def get_calling_session(self) -> Session | None:
+        '''The session that made the call a route is handling, None outside of calls'''
+        return calling_session.get()
+
+    def _encode(self, data: Dict[str, Any]) -> Tuple[int, str]:
+        self.seq += 1
+        return self.seq, dumps({**data, "seq": self.seq})
+
+    async def write(self, session: Session, data: Dict[str, Any]):
+        session.send(*self._encode(data))
+        await session.drain()
+
+    async def write_binary(self, session: Session, header: Dict[str, Any], payload: bytes):
+        '''
+        Sends `payload` as is in a binary frame, prefixed with the length of the JSON header (4 bytes, little endian)
+        and the header itself. Only used for calls the frontend made with `binary` set, see wsrouter.ts.
+        '''
+        self.seq += 1
+        encoded_header = dumps_bytes({**header, "seq": self.seq})
+        session.send(self.seq, len(encoded_header).to_bytes(4, "little") + encoded_header + payload)
+        await session.drain()
+
+    async def _write_result(self, session: Session, type: MessageType, call_id: int, result: Any, binary: bool):
+        if binary and isinstance(result, (bytes, bytearray, memoryview)):
+            payload = result.tobytes() if isinstance(result, memoryview) else bytes(result)
+            await self.write_binary(session, {"type": type.value, "id": call_id}, payload)
         else:
-            self.logger.warning("Dropping message as there is no connected socket: %s", data)
+            await self.write(session, {"type": type.value, "id": call_id, "result": result})
+
+    def is_subscribed(self, event: str, key: str | None = None) -> bool:
+        '''
+        Whether any frontend listens to `event`. Events like loader/plugin_event can be subscribed to for only some
+        `key`s (plugin names), without a key this is true if it listens to any of them.
+        '''
+        return any(session.is_subscribed(event, key) for session in self.sessions.values())
+
+    def get_event_stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": {session.id: {
+                "connected": session.ws != None,
+                "subscriptions": {event: list(keys) for event, keys in session.subscriptions.items()},
+                "pending": session.pending_size,
+                "outbox": session.outbox_size
+            } for session in self.sessions.values()},
+            "sent": dict(self.sent_events),
+            "dropped": dict(self.dropped_events)
+        }
 
-    def add_route(self, name: str, route: Route):
+    def add_route(self, name: str, route: Route, priority: str = INTERACTIVE):
         self.routes[name] = route
+        self.route_priorities[name] = priority
 
     def remove_route(self, name: str):
         del self.routes[name]
+        self.route_priorities.pop(name, None)
 
-    async def _call_route(self, route: str, args: ..., call_id: int):
-        instance_id = self.instance_id
-        error = None
+    def get_priority_stats(self) -> Dict[str, Any]:
+        return self.lanes.get_stats()
+
+    def _priority(self, route: str, requested: Any) -> str:
+        return parse_priority(requested, self.route_priorities.get(route, INTERACTIVE))
+
+    async def _run_route(self, session: Session, route: str, args: ..., call_id: int, binary: bool, priority: str,
+                         received: float) -> Tuple[Any, Dict[str, Any] | None]:
+        '''Returns the result and the error of the call, streamed results are sent right away'''
+        # only affects this call's task
+        calling_session.set(session)
         try:
-            res = await self.routes[route](*args)
+            async with self.lanes.lane(priority, received):
+                res = await self.routes[route](*args)
+                if isinstance(res, AsyncIterator):
+                    await self._stream_reply(session, route, cast(AsyncIterator[Any], res), call_id, binary)
+                    res = None
+            return res, None
         except Exception as err:
-            error = {"name":err.__class__.__name__, "message":str(err), "traceback":format_exc()}
-            res = None
+            return None, {"name":err.__class__.__name__, "message":str(err), "traceback":format_exc()}
+
+    def _is_stale(self, session: Session, route: str, args: ..., res: Any) -> bool:
+        if not session.expired:
+            return False
+        try:
+            self.logger.warning("Ignoring %s reply for expired session %s with args %s and response %s", route, session.id, args, res)
+        except:
+            self.logger.warning("Ignoring %s reply for expired session %s (failed to log event data)", route, session.id)
+        return True
+
+    async def _call_route(self, session: Session, route: str, args: ..., call_id: int, binary: bool, priority: str, received: float):
+        res, error = await self._run_route(session, route, args, call_id, binary, priority, received)
         
-        if instance_id != self.instance_id:
-            try:
-                self.logger.warning("Ignoring %s reply from stale instance %d with args %s and response %s", route, instance_id, args, res)
-            except:
-                self.logger.warning("Ignoring %s reply from stale instance %d (failed to log event data)", route, instance_id)
-            finally:
-                return 
+        if self._is_stale(session, route, args, res):
+            return
 
         if error:
-            await self.write({"type": MessageType.ERROR.value, "id": call_id, "error": error})
+            await self.write(session, {"type": MessageType.ERROR.value, "id": call_id, "error": error})
         else:
-            await self.write({"type": MessageType.REPLY.value, "id": call_id, "result": res})
+            await self._write_result(session, MessageType.REPLY, call_id, res, binary)
+
+    async def _stream_reply(self, session: Session, route: str, stream: AsyncIterator[Any], call_id: int, binary: bool):
+        try:
+            async for chunk in stream:
+                if session.expired:
+                    self.logger.warning("Stopping %s stream for expired session %s", route, session.id)
+                    return
+                await self._write_result(session, MessageType.CHUNK, call_id, chunk, binary)
+        finally:
+            # tell the producer to stop if we bailed out early (cancelled or stale)
+            if hasattr(stream, "aclose"):
+                await stream.aclose() # pyright: ignore [reportAttributeAccessIssue, reportUnknownMemberType]
+
+    def _track_call(self, session: Session, call_id: int, task: Task[Any]):
+        session.running_calls[call_id] = task
+        def cleanup(_: Task[Any]):
+            if session.running_calls.get(call_id) is task:
+                del session.running_calls[call_id]
+        task.add_done_callback(cleanup)
+
+    def _start_call(self, session: Session, route: str, args: ..., call_id: int, binary: bool, priority: str, received: float):
+        self._track_call(session, call_id, self.loop.create_task(self._call_route(session, route, args, call_id, binary, priority, received)))
+
+    async def _batch_call(self, session: Session, route: str, args: ..., call_id: int, priority: str, received: float) -> Dict[str, Any] | None:
+        if route not in self.routes:
+            error = {"error":f'Route {route} does not exist.', "name": "RouteNotFoundError", "traceback": None}
+            return {"type": MessageType.ERROR.value, "id": call_id, "error": error}
+        res, error = await self._run_route(session, route, args, call_id, False, priority, received)
+        if self._is_stale(session, route, args, res):
+            return None
+        if error:
+            return {"type": MessageType.ERROR.value, "id": call_id, "error": error}
+        return {"type": MessageType.REPLY.value, "id": call_id, "result": res}
+
+    async def _call_batch(self, session: Session, calls: List[Dict[str, Any]], received: float):
+        tasks: List[Task[Dict[str, Any] | None]] = []
+        for call in calls:
+            priority = self._priority(call["route"], call.get("priority"))
+            task = self.loop.create_task(self._batch_call(session, call["route"], call["args"], call["id"], priority, received))
+            # each call can still be cancelled on its own
+            self._track_call(session, call["id"], task)
+            tasks.append(task)
+
+        results = await gather(*tasks, return_exceptions=True)
+        # cancelled calls don't get a reply, same as outside of a batch
+        replies = [self._encode_reply(r) for r in results if r is not None and not isinstance(r, BaseException)]
+        for r in results:
+            if isinstance(r, BaseException) and not isinstance(r, CancelledError):
+                self.logger.error("Batched call failed", exc_info=r)
+        if replies and not session.expired:
+            # the replies are already encoded, only the envelope is left
+            self.seq += 1
+            message = f'{{"type":{MessageType.BATCH.value},"replies":[{",".join(replies)}],"seq":{self.seq}}}'
+            session.send(self.seq, message)
+            await session.drain()
+
+    def _encode_reply(self, reply: Dict[str, Any]) -> str:
+        '''Encodes one reply of a batch, a result that can't be encoded only fails its own call'''
+        try:
+            return dumps(reply)
+        except Exception as err:
+            self.logger.error(f"Could not encode the result of batched call {reply['id']}", exc_info=err)
+            error = {"name": err.__class__.__name__, "message": str(err), "traceback": format_exc()}
+            return dumps({"type": MessageType.ERROR.value, "id": reply["id"], "error": error})
+
+    def _start_batch(self, session: Session, calls: List[Dict[str, Any]], received: float):
+        task = self.loop.create_task(self._call_batch(session, calls, received))
+        self.running_batches.add(task)
+        task.add_done_callback(self.running_batches.discard)
+
+    def _expire(self, session: Session):
+        '''Drops a session that can't be resumed anymore, along with the calls it was waiting on'''
+        self.logger.debug(f'Session {session.id} expired')
+        session.expired = True
+        session.detach()
+        if self.sessions.get(session.id) is session:
+            del self.sessions[session.id]
+        for task in list(session.running_calls.values()):
+            task.cancel()
 
     async def handle(self, request: Request):
         # Auth is a query param as JS WebSocket doesn't support headers
         if request.rel_url.query["auth"] != get_csrf_token():
             return Response(text='Forbidden', status=403) 
+        try:
+            last_seq = int(request.rel_url.query.get("seq", 0))
+        except ValueError:
+            return Response(text='Bad Request', status=400)
         self.logger.debug('Websocket connection starting')
+        # No permessage-deflate, the frontend connects over loopback where compressing a message takes longer than
+        # sending it uncompressed, see benchmarks/compression.py
         ws = WebSocketResponse()
         await ws.prepare(request)
-        self.instance_id += 1
         self.logger.debug('Websocket connection ready')
 
-        if self.ws != None:
-            try:
-                await self.ws.close()
-            except:
-                pass
-            self.ws = None
+        # A frontend that reconnects with its session id and the last sequence number it got is sent everything it
+        # missed, including replies to calls that were running. Otherwise it gets a new session.
+        session = self.sessions.get(request.rel_url.query.get("session", ""))
+        resumed = session != None and session.can_resume(last_seq)
+        if session != None and resumed:
+            if session.expire_handle:
+                session.expire_handle.cancel()
+                session.expire_handle = None
+            if session.ws != None:
+                # the same frontend is back before its old socket was noticed to be gone
+                old_ws = session.ws
+                session.detach()
+                self.loop.create_task(old_ws.close())
+        else:
+            if session != None:
+                self._expire(session)
+            session = Session(uuid4().hex)
+            self.sessions[session.id] = session
+            last_seq = self.seq
+        self.logger.debug(f'{"Resuming" if resumed else "Starting"} session {session.id}, {len(self.sessions)} sessions open')
 
-        self.ws = ws
+        await ws.send_str(dumps({"type": MessageType.SESSION.value, "session": session.id, "resumed": resumed}))
+        # anything written in the meantime only went to the outbox, attach picks it up from there
+        session.attach(ws, last_seq)
+        sender = self.loop.create_task(session.run_sender(ws))
         
         try:
             async for msg in ws:
@@ -106,32 +301,62 @@ class WSRouter:
                         # TODO DO NOT RELY ON THIS!
                         break
                     else:
-                        data = msg.json()
+                        data = msg.json(loads=loads)
                         match data["type"]:
                             case MessageType.CALL.value:
                                 # do stuff with the message
                                 if data["route"] in self.routes:
                                     self.logger.debug(f'Started PY call {data["route"]} ID {data["id"]}')
-                                    self.loop.create_task(self._call_route(data["route"], data["args"], data["id"]))
+                                    self._start_call(session, data["route"], data["args"], data["id"], data.get("binary", False),
+                                                     self._priority(data["route"], data.get("priority")), monotonic())
                                 else:
                                     error = {"error":f'Route {data["route"]} does not exist.', "name": "RouteNotFoundError", "traceback": None}
-                                    self.loop.create_task(self.write({"type": MessageType.ERROR.value, "id": data["id"], "error": error}))
+                                    self.loop.create_task(self.write(session, {"type": MessageType.ERROR.value, "id": data["id"], "error": error}))
+                            case MessageType.BATCH.value:
+                                self.logger.debug(f'Started batch of {len(data["calls"])} PY calls')
+                                self._start_batch(session, data["calls"], monotonic())
+                            case MessageType.SUBSCRIBE.value:
+                                session.subscribe(data["events"])
+                            case MessageType.UNSUBSCRIBE.value:
+                                session.unsubscribe(data["events"])
+                            case MessageType.CANCEL.value:
+                                if data["id"] in session.running_calls:
+                                    self.logger.debug(f'Cancelling PY call ID {data["id"]}')
+                                    session.running_calls[data["id"]].cancel()
                             case _:
                                 self.logger.error("Unknown message type", data)
         finally:
+            sender.cancel()
             try:
                 await ws.close()
-                self.ws = None
             except:
                 pass
+            if session.ws is ws:
+                session.detach()
+            # also the case if the session dropped the socket for not keeping up
+            if session.ws == None and not session.expired and not session.expire_handle:
+                # the frontend has until then to resume
+                session.expire_handle = self.loop.call_later(MAX_OUTBOX_AGE, self._expire, session)
 
         self.logger.debug('Websocket connection closed')
         return ws
 
-    async def emit(self, event: str, *args: Any):
+    async def emit(self, event: str, *args: Any, key: str | None = None, session: Session | None = None):
+        '''
+        Sends an event to every frontend subscribed to it, or only to `session` if given. `key` is what subscriptions
+        can filter on. The message is encoded once and never waits for slow clients.
+        '''
+        sessions = [s for s in ([session] if session else self.sessions.values()) if s.is_subscribed(event, key)]
+        if not sessions:
+            self.dropped_events[event] += 1
+            return
+        self.sent_events[event] += 1
         self.logger.debug(f'Firing frontend event {event} with args {args}')
-        await self.write({ "type": MessageType.EVENT.value, "event": event, "args": args })
+        seq, message = self._encode({ "type": MessageType.EVENT.value, "event": event, "args": args })
+        for s in sessions:
+            s.send(seq, message)
 
     async def disconnect(self):
-        if self.ws:
-            await self.ws.close(code=WSCloseCode.GOING_AWAY, message=b"Loader is shutting down")
+        for session in list(self.sessions.values()):
+            if session.ws:
+                await session.ws.close(code=WSCloseCode.GOING_AWAY, message=b"Loader is shutting down")
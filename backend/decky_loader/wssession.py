@@ -0,0 +1,134 @@
+from asyncio import Event, Task, TimerHandle, create_task
+from collections import deque
+from time import monotonic
+from typing import Any, Deque, Dict, List, Set, Tuple
+
+from aiohttp.web import WebSocketResponse
+
+# Sent messages are kept for resuming a session until either limit is hit
+MAX_OUTBOX_SIZE = 4 * 1024 * 1024 # characters of text frames and bytes of binary ones
+MAX_OUTBOX_AGE = 120 # seconds
+# Replies and stream chunks for a session wait while more than this is queued for its socket
+DRAIN_SIZE = 256 * 1024
+# A client that has this much queued isn't keeping up, its socket is closed and it has to resume from the outbox
+MAX_PENDING_SIZE = 2 * 1024 * 1024
+
+class Session:
+    '''
+    A frontend session, which outlives its websocket. Everything sent to it is numbered and kept in an outbox for a
+    while, so a frontend that reconnects with the session id and the last number it got can be sent what it missed
+    instead of losing replies and events. See handle in wsrouter.py.
+
+    Messages for the socket are queued and sent by `run_sender`, so a slow client only holds up its own replies.
+    '''
+    def __init__(self, session_id: str) -> None:
+        self.id = session_id
+        self.ws: WebSocketResponse | None = None
+        # sequence number, when it was sent, message
+        self.outbox: Deque[Tuple[int, float, str | bytes]] = deque()
+        self.outbox_size = 0
+        # the newest message that was dropped from the outbox, a frontend that didn't get it can't resume
+        self.evicted_seq = 0
+        self.pending: Deque[str | bytes] = deque()
+        self.pending_size = 0
+        self._wakeup = Event()
+        self._drained = Event()
+        self.running_calls: Dict[int, Task[Any]] = {}
+        # event name -> filter keys the frontend listens to, None meaning all of them
+        self.subscriptions: Dict[str, Set[str | None]] = {}
+        # events are only filtered once the frontend has sent its subscriptions
+        self.filter_events = False
+        # set once the session can't be resumed anymore
+        self.expired = False
+        self.expire_handle: TimerHandle | None = None
+
+    def send(self, seq: int, message: str | bytes):
+        '''Adds a message to the outbox and queues it for the socket, never blocks'''
+        now = monotonic()
+        self.outbox.append((seq, now, message))
+        self.outbox_size += len(message)
+        self._prune(now)
+
+        if self.ws != None:
+            # only what was queued before counts, apart from the message the sender takes next, so a single big
+            # reply never disconnects a client that keeps up
+            if self.pending and self.pending_size - len(self.pending[0]) > MAX_PENDING_SIZE:
+                create_task(self.ws.close())
+                self.detach()
+                return
+            self.pending.append(message)
+            self.pending_size += len(message)
+            self._wakeup.set()
+
+    async def drain(self):
+        '''Waits until the socket has caught up enough, so one call can't queue up unlimited data'''
+        while self.ws != None and self.pending_size > DRAIN_SIZE:
+            self._drained.clear()
+            await self._drained.wait()
+
+    def attach(self, ws: WebSocketResponse, last_seq: int):
+        '''Makes `ws` the session's socket, starting with everything sent after `last_seq`'''
+        self.ws = ws
+        self.pending = deque(message for seq, _, message in self.outbox if seq > last_seq)
+        self.pending_size = sum(len(message) for message in self.pending)
+        self._wakeup.set()
+        # the frontend sends its subscriptions again
+        self.subscriptions = {}
+        self.filter_events = False
+
+    def detach(self):
+        self.ws = None
+        self.pending.clear()
+        self.pending_size = 0
+        self._wakeup.set()
+        self._drained.set()
+
+    async def run_sender(self, ws: WebSocketResponse):
+        while self.ws is ws:
+            if not self.pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            message = self.pending.popleft()
+            self.pending_size -= len(message)
+            if self.pending_size <= DRAIN_SIZE:
+                self._drained.set()
+            try:
+                if isinstance(message, str):
+                    await ws.send_str(message)
+                else:
+                    await ws.send_bytes(message)
+            except ConnectionResetError:
+                # still in the outbox, the frontend gets it once it resumes
+                return
+
+    def _prune(self, now: float):
+        # the newest message stays even if it's over the size limit on its own, e.g. a big reply
+        while self.outbox and ((self.outbox_size > MAX_OUTBOX_SIZE and len(self.outbox) > 1)
+                               or now - self.outbox[0][1] > MAX_OUTBOX_AGE):
+            seq, _, message = self.outbox.popleft()
+            self.outbox_size -= len(message)
+            self.evicted_seq = seq
+
+    def can_resume(self, last_seq: int) -> bool:
+        self._prune(monotonic())
+        return not self.expired and last_seq >= self.evicted_seq
+
+    def is_subscribed(self, event: str, key: str | None = None) -> bool:
+        if not self.filter_events:
+            return True
+        keys = self.subscriptions.get(event)
+        return keys is not None and (key is None or None in keys or key in keys)
+
+    def subscribe(self, events: List[Tuple[str, str | None]]):
+        self.filter_events = True
+        for event, key in events:
+            self.subscriptions.setdefault(event, set()).add(key)
+
+    def unsubscribe(self, events: List[Tuple[str, str | None]]):
+        for event, key in events:
+            keys = self.subscriptions.get(event)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.subscriptions[event]
@@ -0,0 +1,106 @@
+import asyncio
+from json import loads
+from time import monotonic
+from typing import Any, Dict, List
+
+import pytest
+from aiohttp import WSServerHandshakeError
+from aiohttp.test_utils import TestClient, TestServer
+from aiohttp.web import Application
+
+from decky_loader.helpers import get_csrf_token
+from decky_loader.wsrouter import MessageType, WSRouter
+from decky_loader.wssession import MAX_OUTBOX_SIZE, Session
+
+def run_batch(calls: List[Dict[str, Any]]) -> Dict[str, Any]:
+    async def run() -> Dict[str, Any]:
+        router = WSRouter(asyncio.get_running_loop(), Application())
+
+        async def echo(value: Any) -> Any:
+            return value
+
+        async def unserializable() -> Any:
+            return object()
+
+        async def fail() -> Any:
+            raise ValueError("failed")
+
+        router.add_route("test/echo", echo)
+        router.add_route("test/unserializable", unserializable)
+        router.add_route("test/fail", fail)
+        session = Session("test")
+        await router._call_batch(session, calls, monotonic()) # pyright: ignore [reportPrivateUsage]
+        _, _, message = session.outbox[-1]
+        assert isinstance(message, str)
+        return loads(message)
+
+    return asyncio.run(run())
+
+def test_batch_with_unserializable_result():
+    batch = run_batch([
+        {"route": "test/echo", "args": ["first"], "id": 1},
+        {"route": "test/unserializable", "args": [], "id": 2},
+        {"route": "test/fail", "args": [], "id": 3},
+        {"route": "test/missing", "args": [], "id": 4},
+        {"route": "test/echo", "args": [{"last": True}], "id": 5},
+    ])
+
+    assert batch["type"] == MessageType.BATCH.value
+    replies = {reply["id"]: reply for reply in batch["replies"]}
+    assert replies[1] == {"type": MessageType.REPLY.value, "id": 1, "result": "first"}
+    assert replies[2]["type"] == MessageType.ERROR.value
+    assert replies[2]["error"]["name"] == "TypeError"
+    assert replies[3]["type"] == MessageType.ERROR.value
+    assert replies[3]["error"]["message"] == "failed"
+    assert replies[4]["type"] == MessageType.ERROR.value
+    assert replies[5] == {"type": MessageType.REPLY.value, "id": 5, "result": {"last": True}}
+
+def test_batch_is_one_message():
+    batch = run_batch([{"route": "test/echo", "args": [i], "id": i} for i in range(10)])
+
+    assert [reply["result"] for reply in batch["replies"]] == list(range(10))
+    assert isinstance(batch["seq"], int)
+
+def test_non_numeric_seq_is_rejected():
+    async def run():
+        app = Application()
+        WSRouter(asyncio.get_running_loop(), app)
+        async with TestClient(TestServer(app)) as client:
+            with pytest.raises(WSServerHandshakeError) as handshake:
+                await client.ws_connect("/ws", params={"auth": get_csrf_token(), "seq": "latest"})
+            assert handshake.value.status == 400
+
+    asyncio.run(run())
+
+def test_resume_after_reply_over_outbox_size():
+    async def run():
+        app = Application()
+        router = WSRouter(asyncio.get_running_loop(), app)
+        disconnected = asyncio.Event()
+        big = "x" * (MAX_OUTBOX_SIZE + 1)
+
+        async def big_reply() -> str:
+            await disconnected.wait()
+            return big
+
+        router.add_route("test/big", big_reply)
+        async with TestClient(TestServer(app)) as client:
+            ws = await client.ws_connect("/ws", params={"auth": get_csrf_token()})
+            session_id = (await ws.receive_json())["session"]
+            await ws.send_json({"type": MessageType.CALL.value, "route": "test/big", "args": [], "id": 1})
+            await ws.close()
+            # the reply is only written to the outbox once the frontend is gone
+            while router.sessions[session_id].ws != None:
+                await asyncio.sleep(0.01)
+            disconnected.set()
+            while router.sessions[session_id].running_calls:
+                await asyncio.sleep(0.01)
+
+            ws = await client.ws_connect("/ws", params={"auth": get_csrf_token(), "session": session_id, "seq": 0},
+                                         max_msg_size=0)
+            assert (await ws.receive_json())["resumed"]
+            reply = await ws.receive_json()
+            assert reply["id"] == 1 and reply["result"] == big
+            await ws.close()
+
+    asyncio.run(run())
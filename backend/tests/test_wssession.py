@@ -0,0 +1,61 @@
+import asyncio
+from typing import cast
+
+from aiohttp.web import WebSocketResponse
+
+from decky_loader.wssession import MAX_OUTBOX_SIZE, MAX_PENDING_SIZE, Session
+
+def test_resume_after_message_over_outbox_size():
+    session = Session("test")
+    session.send(1, "x" * (MAX_OUTBOX_SIZE + 1))
+
+    assert session.can_resume(0)
+    assert [seq for seq, _, _ in session.outbox] == [1]
+
+def test_outbox_size_evicts_oldest_messages():
+    session = Session("test")
+    session.send(1, "x" * (MAX_OUTBOX_SIZE + 1))
+    session.send(2, "small")
+
+    assert not session.can_resume(0)
+    assert session.can_resume(1)
+    assert [seq for seq, _, _ in session.outbox] == [2]
+
+class FakeSocket:
+    closed = False
+
+    async def close(self):
+        self.closed = True
+
+def test_big_reply_keeps_socket():
+    async def run():
+        session = Session("test")
+        ws = FakeSocket()
+        session.attach(cast(WebSocketResponse, ws), 0)
+        session.send(1, "x" * (MAX_PENDING_SIZE * 2))
+        session.send(2, "small")
+        await asyncio.sleep(0)
+
+        assert session.ws is ws and not ws.closed
+        assert session.pending_size == MAX_PENDING_SIZE * 2 + len("small")
+
+    asyncio.run(run())
+
+def test_client_that_does_not_keep_up_is_disconnected():
+    async def run():
+        session = Session("test")
+        ws = FakeSocket()
+        session.attach(cast(WebSocketResponse, ws), 0)
+        message = "x" * (64 * 1024)
+        seq = 0
+        while session.ws != None:
+            seq += 1
+            session.send(seq, message)
+        await asyncio.sleep(0)
+
+        assert ws.closed
+        assert seq * len(message) > MAX_PENDING_SIZE
+        # still there to resume from
+        assert session.can_resume(0)
+
+    asyncio.run(run())
@@ -0,0 +1,118 @@
+import Logger from './logger';
+import { PyError } from './wsrouter';
+
+// Mirrors SocketMessageType in backend/decky_loader/plugin/messages.py
+enum SocketMessageType {
+  CALL = 0,
+  RESPONSE = 1,
+}
+
+interface CallMessage {
+  type: SocketMessageType.CALL;
+  method: string;
+  args: any[];
+  id: string;
+}
+
+interface ResponseMessage {
+  type: SocketMessageType.RESPONSE;
+  id: string;
+  success: boolean;
+  res: any;
+}
+
+// Helper to resolve a promise from the outside
+interface PromiseResolver<T> {
+  resolve: (res: T) => void;
+  reject: (error: PyError) => void;
+}
+
+/**
+ * A dedicated connection to a single plugin's backend.
+ * The loader relays these messages to the plugin process as-is, skipping the decode/encode in the main WSRouter.
+ * Methods that stream their results are rejected here as channels have no flow control, use the backend API's stream().
+ */
+export class PluginChannel extends Logger {
+  runningCalls: Map<string, PromiseResolver<any>> = new Map();
+  ws?: WebSocket;
+  connectPromise?: Promise<void>;
+  decoder = new TextDecoder();
+  reqId: number = 0;
+
+  constructor(private pluginName: string) {
+    super(`PluginChannel (${pluginName})`);
+  }
+
+  connect() {
+    return (this.connectPromise = new Promise<void>((resolve) => {
+      // Auth is a query param as JS WebSocket doesn't support headers
+      this.ws = new WebSocket(
+        `ws://127.0.0.1:1337/plugins/${encodeURIComponent(this.pluginName)}/channel?auth=${deckyAuthToken}`,
+      );
+      this.ws.binaryType = 'arraybuffer';
+
+      this.ws.addEventListener('open', () => {
+        this.debug('Channel connected');
+        resolve();
+      });
+      this.ws.addEventListener('message', this.onMessage.bind(this));
+      this.ws.addEventListener('close', this.onClose.bind(this));
+    }));
+  }
+
+  async write(data: CallMessage) {
+    if (!this.connectPromise) this.connect();
+    await this.connectPromise;
+    this.ws?.send(JSON.stringify(data));
+  }
+
+  onMessage(msg: MessageEvent) {
+    try {
+      const data = JSON.parse(
+        typeof msg.data == 'string' ? msg.data : this.decoder.decode(msg.data),
+      ) as ResponseMessage;
+      if (data.type != SocketMessageType.RESPONSE || !this.runningCalls.has(data.id)) return;
+      if (data.success) {
+        this.runningCalls.get(data.id)!.resolve(data.res);
+      } else {
+        this.runningCalls.get(data.id)!.reject(new PyError('Exception', data.res, null));
+      }
+      this.runningCalls.delete(data.id);
+    } catch (e) {
+      this.error('Error parsing channel message', e);
+    }
+  }
+
+  call<Args extends any[] = [], Return = void>(method: string, ...args: Args): Promise<Return> {
+    const id = `${++this.reqId}`;
+    const promise = new Promise<Return>((resolve, reject) => {
+      this.runningCalls.set(id, { resolve, reject });
+    });
+
+    this.write({ type: SocketMessageType.CALL, method, args, id });
+
+    return promise;
+  }
+
+  callable<Args extends any[] = [], Return = void>(method: string): (...args: Args) => Promise<Return> {
+    return (...args) => this.call<Args, Return>(method, ...args);
+  }
+
+  onClose() {
+    this.debug('Channel closed');
+    // The plugin backend went away (reload, uninstall, loader restart), calls in flight will never get a reply.
+    for (const [id, resolver] of this.runningCalls) {
+      resolver.reject(
+        new PyError('ChannelClosedError', `Channel to ${this.pluginName} closed during call ${id}`, null),
+      );
+    }
+    this.runningCalls.clear();
+    // Reconnect lazily on the next call
+    delete this.connectPromise;
+    delete this.ws;
+  }
+
+  close() {
+    this.ws?.close();
+  }
+}
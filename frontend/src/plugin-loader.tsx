@@ -31,6 +31,7 @@ import { HiddenPluginsService } from './hidden-plugins-service';
 import Logger from './logger';
 import { NotificationService } from './notification-service';
 import { InstallType, Plugin, PluginLoadType } from './plugin';
+import { PluginChannel } from './plugin-channel';
 import RouterHook from './router-hook';
 import { deinitSteamFixes, initSteamFixes } from './steamfixes';
 import { checkForPluginUpdates } from './store';
@@ -73,6 +74,8 @@ class PluginLoader extends Logger {
   private deckyState: DeckyState = new DeckyState();
   // stores a map of plugin names to all their event listeners
   private pluginEventListeners: Map<string, listenerMap> = new Map();
+  // stores a map of telemetry subscription ids to their listeners
+  private telemetryListeners: Map<number, (value: any) => any> = new Map();
 
   public frozenPluginsService = new FrozenPluginService(this.deckyState);
   public hiddenPluginsService = new HiddenPluginsService(this.deckyState);
@@ -81,6 +84,10 @@ class PluginLoader extends Logger {
   private reloadLock: boolean = false;
   // stores a list of plugin names which requested to be reloaded
   private pluginReloadQueue: { name: string; version?: string; loadType: PluginLoadType }[] = [];
+  // plugins being imported right now, so one announced while loadPlugins is running isn't imported twice
+  private loadingPlugins = new Set<string>();
+  // loader/plugin_ready is only needed for plugins that weren't loaded yet when loadPlugins asked for the list
+  private initialLoadStarted: boolean = false;
 
   private loaderUpdateToast?: ToastNotification;
   private pluginUpdateToast?: ToastNotification;
@@ -90,6 +97,7 @@ class PluginLoader extends Logger {
 
     DeckyBackend.addEventListener('loader/notify_updates', this.notifyUpdates.bind(this));
     DeckyBackend.addEventListener('loader/import_plugin', this.importPlugin.bind(this));
+    DeckyBackend.addEventListener('loader/plugin_ready', this.onPluginReady.bind(this));
     DeckyBackend.addEventListener('loader/unload_plugin', this.unloadPlugin.bind(this));
     DeckyBackend.addEventListener('loader/add_plugin_install_prompt', this.addPluginInstallPrompt.bind(this));
     DeckyBackend.addEventListener(
@@ -100,6 +108,7 @@ class PluginLoader extends Logger {
       this.deckyState.setIsLoaderUpdating(true);
     });
     DeckyBackend.addEventListener(`loader/plugin_event`, this.pluginEventListener);
+    DeckyBackend.addEventListener('loader/telemetry', this.telemetryListener);
 
     this.tabsHook.init();
 
@@ -196,11 +205,12 @@ class PluginLoader extends Logger {
       }
     }
     this.runCrashChecker();
+    this.initialLoadStarted = true;
     const plugins = await this.getPluginsFromBackend();
     const pluginLoadPromises = [];
     const loadStart = performance.now();
     for (const plugin of plugins) {
-      if (!this.hasPlugin(plugin.name))
+      if (!this.hasPlugin(plugin.name) && !this.loadingPlugins.has(plugin.name))
         pluginLoadPromises.push(this.importPlugin(plugin.name, plugin.version, plugin.load_type, false));
     }
     await Promise.all(pluginLoadPromises);
@@ -358,6 +368,11 @@ class PluginLoader extends Logger {
     if (!skipStateUpdate) this.deckyState.setPlugins(this.plugins);
   }
 
+  private onPluginReady(name: string, version: string | undefined, loadType: PluginLoadType) {
+    if (!this.initialLoadStarted || this.hasPlugin(name) || this.loadingPlugins.has(name)) return;
+    this.importPlugin(name, version, loadType);
+  }
+
   public async importPlugin(
     name: string,
     version?: string | undefined,
@@ -367,11 +382,14 @@ class PluginLoader extends Logger {
     if (useQueue && this.reloadLock) {
       this.log('Reload currently in progress, adding to queue', name);
       this.pluginReloadQueue.push({ name, version: version, loadType });
+      // counts as loading already, so loader/plugin_ready doesn't import it a second time
+      this.loadingPlugins.add(name);
       return;
     }
 
     try {
       if (useQueue) this.reloadLock = true;
+      this.loadingPlugins.add(name);
       this.log(`Trying to load ${name}`);
 
       this.unloadPlugin(name, true);
@@ -384,11 +402,13 @@ class PluginLoader extends Logger {
     } catch (e) {
       throw e;
     } finally {
+      // still loading if another import of it is queued
+      if (!this.pluginReloadQueue.some((plugin) => plugin.name === name)) this.loadingPlugins.delete(name);
       if (useQueue) {
         this.reloadLock = false;
         const nextPlugin = this.pluginReloadQueue.shift();
         if (nextPlugin) {
-          this.importPlugin(nextPlugin.name, nextPlugin.version, loadType);
+          this.importPlugin(nextPlugin.name, nextPlugin.version, nextPlugin.loadType);
         }
       }
     }
@@ -612,6 +632,10 @@ class PluginLoader extends Logger {
           console.warn(`Plugin ${pluginName} requested unsupported api version ${version}.`);
         }
 
+        // listeners of a previous load of this plugin are gone with it
+        this.pluginEventListeners
+          .get(pluginName)
+          ?.forEach(() => DeckyBackend.unsubscribe('loader/plugin_event', pluginName));
         const eventListeners: listenerMap = new Map();
         this.pluginEventListeners.set(pluginName, eventListeners);
 
@@ -622,9 +646,24 @@ class PluginLoader extends Logger {
           callable: (methodName: string) => {
             return (...args: any) => callPluginMethod(pluginName, methodName, ...args);
           },
+          // Runs the method with background priority, see callBackground in wsrouter.ts
+          callBackground: (methodName: string, ...args: any) => {
+            return DeckyBackend.callBackground('loader/call_plugin_method', pluginName, methodName, ...args);
+          },
+          // For backend methods that are async generators, yields their chunks as they arrive
+          stream: (methodName: string, ...args: any) => {
+            return DeckyBackend.stream('loader/call_plugin_method', pluginName, methodName, ...args);
+          },
+          // Direct connection to the plugin backend for high-rate calls, see plugin-channel.ts
+          openChannel: () => new PluginChannel(pluginName),
+          // Latest values of a channel set with decky.publish, read at most `fps` times per second
+          subscribeTelemetry: (channel: string, fps: number, listener: (value: any) => any) =>
+            this.subscribeTelemetry(pluginName, channel, fps, listener),
           addEventListener: (event: string, listener: (...args: any) => any) => {
             if (!eventListeners.has(event)) {
               eventListeners.set(event, new Set([listener]));
+              // the backend only sends events of plugins that have listeners, one subscription per event name
+              DeckyBackend.subscribe('loader/plugin_event', pluginName);
             } else {
               eventListeners.get(event)?.add(listener);
             }
@@ -634,6 +673,10 @@ class PluginLoader extends Logger {
             if (eventListeners.has(event)) {
               const set = eventListeners.get(event);
               set?.delete(listener);
+              if (set?.size === 0) {
+                eventListeners.delete(event);
+                DeckyBackend.unsubscribe('loader/plugin_event', pluginName);
+              }
             }
           },
           openFilePicker: this.openFilePicker.bind(this),
@@ -663,6 +706,35 @@ class PluginLoader extends Logger {
     };
   }
 
+  async subscribeTelemetry(
+    pluginName: string,
+    channel: string,
+    fps: number,
+    listener: (value: any) => any,
+  ): Promise<() => Promise<void>> {
+    const id = await DeckyBackend.call<[pluginName: string, channel: string, interval: number], number>(
+      'loader/subscribe_telemetry',
+      pluginName,
+      channel,
+      Math.round(1000 / fps),
+    );
+    this.telemetryListeners.set(id, listener);
+    return async () => {
+      this.telemetryListeners.delete(id);
+      await DeckyBackend.call<[id: number]>('loader/unsubscribe_telemetry', id);
+    };
+  }
+
+  telemetryListener = (id: number, value: any) => {
+    const listener = this.telemetryListeners.get(id);
+    if (!listener) return;
+    try {
+      listener(value);
+    } catch (e) {
+      this.error(`error in telemetry listener ${id}`, e, listener);
+    }
+  };
+
   pluginEventListener = (data: { plugin: string; event: string; args: any }) => {
     const { plugin, event, args } = data;
     this.debug(`Recieved plugin event ${event} for ${plugin} with args`, args);
@@ -13,13 +13,31 @@ enum MessageType {
   REPLY = 1,
   // Pub/Sub, Backend -> Frontend
   EVENT = 3,
+  // Streamed replies, Backend -> Frontend. The stream is finished by a REPLY or ERROR with the same id
+  CHUNK = 4,
+  // Frontend -> Backend, stops a running call
+  CANCEL = 5,
+  // Many calls in one frame, Frontend -> Backend -> Frontend. The reply carries a REPLY or ERROR for each call
+  BATCH = 6,
+  // Frontend -> Backend, starts or stops sending EVENTs. Events nothing subscribed to are dropped in the backend
+  SUBSCRIBE = 7,
+  UNSUBSCRIBE = 8,
+  // Backend -> Frontend, first message on every connection. Says whether the session was resumed
+  SESSION = 9,
 }
 
+// Background calls wait while the backend is busy with others, interactive ones never do
+export type CallPriority = 'interactive' | 'background';
+
 interface CallMessage {
   type: MessageType.CALL;
   args: any[];
   route: string;
   id: number;
+  // Lets the backend send a bytes result as a binary frame, see callBinary
+  binary?: boolean;
+  // Overrides the route's priority in the backend, see callBackground
+  priority?: CallPriority;
 }
 
 interface ReplyMessage {
@@ -28,6 +46,17 @@ interface ReplyMessage {
   id: number;
 }
 
+interface ChunkMessage {
+  type: MessageType.CHUNK;
+  result: any;
+  id: number;
+}
+
+interface CancelMessage {
+  type: MessageType.CANCEL;
+  id: number;
+}
+
 interface ErrorMessage {
   type: MessageType.ERROR;
   error: { name: string; error: string; traceback: string | null };
@@ -58,7 +87,44 @@ interface EventMessage {
   args: any;
 }
 
-type Message = CallMessage | ReplyMessage | ErrorMessage | EventMessage;
+// An event name and, for events like loader/plugin_event, the key (plugin name) to filter on or null for all
+type Subscription = [event: string, key: string | null];
+
+// Events that are subscribed to per key, a listener for them doesn't subscribe to all keys, see subscribe
+const KEYED_EVENTS = new Set(['loader/plugin_event']);
+
+interface SubscriptionMessage {
+  type: MessageType.SUBSCRIBE | MessageType.UNSUBSCRIBE;
+  events: Subscription[];
+}
+
+interface SessionMessage {
+  type: MessageType.SESSION;
+  session: string;
+  resumed: boolean;
+}
+
+interface BatchCallMessage {
+  type: MessageType.BATCH;
+  calls: Omit<CallMessage, 'type'>[];
+}
+
+interface BatchReplyMessage {
+  type: MessageType.BATCH;
+  replies: (ReplyMessage | ErrorMessage)[];
+}
+
+type Message =
+  | CallMessage
+  | ReplyMessage
+  | ChunkMessage
+  | CancelMessage
+  | ErrorMessage
+  | EventMessage
+  | BatchCallMessage
+  | BatchReplyMessage
+  | SubscriptionMessage
+  | SessionMessage;
 
 // Helper to resolve a promise from the outside
 interface PromiseResolver<T> {
@@ -67,11 +133,25 @@ interface PromiseResolver<T> {
   promise: Promise<T>;
 }
 
+// Chunks of a streamed call that have not been consumed yet
+interface RunningStream {
+  chunks: any[];
+  done: boolean;
+  error?: PyError;
+  wake?: () => void;
+}
+
 export class WSRouter extends Logger {
   runningCalls: Map<number, PromiseResolver<any>> = new Map();
+  runningStreams: Map<number, RunningStream> = new Map();
   eventListeners: Map<string, Set<(...args: any) => any>> = new Map();
+  // JSON of a Subscription -> how many listeners need it
+  subscriptions: Map<string, number> = new Map();
   ws?: WebSocket;
   connectPromise?: Promise<void>;
+  // Sent when reconnecting so the backend can send what was missed, see wssession.py
+  sessionId?: string;
+  lastSeq: number = 0;
   // Used to map results and errors to calls
   reqId: number = 0;
   constructor() {
@@ -81,10 +161,15 @@ export class WSRouter extends Logger {
   connect() {
     return (this.connectPromise = new Promise<void>((resolve) => {
       // Auth is a query param as JS WebSocket doesn't support headers
-      this.ws = new WebSocket(`ws://127.0.0.1:1337/ws?auth=${deckyAuthToken}`);
+      const session = this.sessionId ? `&session=${this.sessionId}&seq=${this.lastSeq}` : '';
+      const ws = (this.ws = new WebSocket(`ws://127.0.0.1:1337/ws?auth=${deckyAuthToken}${session}`));
+      ws.binaryType = 'arraybuffer';
 
-      this.ws.addEventListener('open', () => {
+      ws.addEventListener('open', () => {
         this.debug('WS Connected');
+        // a new connection starts without subscriptions, and the backend only filters events once it got these
+        const events = [...this.subscriptions.keys()].map((subscription) => JSON.parse(subscription));
+        ws.send(JSON.stringify({ type: MessageType.SUBSCRIBE, events }));
         resolve();
         delete this.connectPromise;
       });
@@ -109,9 +194,33 @@ export class WSRouter extends Logger {
     this.ws?.send(JSON.stringify(data));
   }
 
+  // Makes the backend send `event` (only for `key` if given), subscriptions are counted so every subscribe needs an
+  // unsubscribe. addEventListener does this on its own, except for KEYED_EVENTS which are subscribed to per key.
+  subscribe(event: string, key: string | null = null) {
+    const subscription = JSON.stringify([event, key]);
+    const count = this.subscriptions.get(subscription) ?? 0;
+    this.subscriptions.set(subscription, count + 1);
+    if (count === 0) {
+      this.write({ type: MessageType.SUBSCRIBE, events: [[event, key]] });
+    }
+  }
+
+  unsubscribe(event: string, key: string | null = null) {
+    const subscription = JSON.stringify([event, key]);
+    const count = this.subscriptions.get(subscription);
+    if (!count) return;
+    if (count > 1) {
+      this.subscriptions.set(subscription, count - 1);
+    } else {
+      this.subscriptions.delete(subscription);
+      this.write({ type: MessageType.UNSUBSCRIBE, events: [[event, key]] });
+    }
+  }
+
   addEventListener(event: string, listener: (...args: any) => any) {
     if (!this.eventListeners.has(event)) {
       this.eventListeners.set(event, new Set([listener]));
+      if (!KEYED_EVENTS.has(event)) this.subscribe(event);
     } else {
       this.eventListeners.get(event)?.add(listener);
     }
@@ -124,59 +233,145 @@ export class WSRouter extends Logger {
       set?.delete(listener);
       if (set?.size === 0) {
         this.eventListeners.delete(event);
+        if (!KEYED_EVENTS.has(event)) this.unsubscribe(event);
       }
     }
   }
 
+  // Binary frames are the length of a JSON header (4 bytes, little endian), the header and the raw result
+  parseBinaryMessage(buffer: ArrayBuffer): Message {
+    const headerLength = new DataView(buffer).getUint32(0, true);
+    const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, headerLength)));
+    return { ...header, result: new Uint8Array(buffer, 4 + headerLength) };
+  }
+
   async onMessage(msg: MessageEvent) {
     try {
-      const data = JSON.parse(msg.data) as Message;
-      switch (data.type) {
-        case MessageType.REPLY:
-          if (this.runningCalls.has(data.id)) {
-            this.runningCalls.get(data.id)!.resolve(data.result);
-            this.runningCalls.delete(data.id);
-            this.debug(`[${data.id}] Resolved PY call with value`, data.result);
-          }
-          break;
-
-        case MessageType.ERROR:
-          if (this.runningCalls.has(data.id)) {
-            let err = new PyError(data.error.name, data.error.error, data.error.traceback);
-            this.runningCalls.get(data.id)!.reject(err);
-            this.runningCalls.delete(data.id);
-            this.debug(`[${data.id}] Rejected PY call with error`, data.error);
-          }
-          break;
-
-        case MessageType.EVENT:
-          this.debug(`Recieved event ${data.event} with args`, data.args);
-          if (this.eventListeners.has(data.event)) {
-            for (const listener of this.eventListeners.get(data.event)!) {
-              (async () => {
-                try {
-                  await listener(...data.args);
-                } catch (e) {
-                  this.error(`error in event ${data.event}`, e, listener);
-                }
-              })();
-            }
-          } else {
-            this.warn(`event ${data.event} has no listeners`);
-          }
-          break;
-
-        default:
-          this.error('Unknown message type', data);
-          break;
-      }
+      const data = (
+        msg.data instanceof ArrayBuffer ? this.parseBinaryMessage(msg.data) : JSON.parse(msg.data)
+      ) as Message & { seq?: number };
+      if (data.seq) this.lastSeq = Math.max(this.lastSeq, data.seq);
+      this.handleMessage(data);
     } catch (e) {
       this.error('Error parsing WebSocket message', e);
     }
   }
 
+  handleMessage(data: Message) {
+    switch (data.type) {
+      case MessageType.CHUNK:
+        if (this.runningStreams.has(data.id)) {
+          const stream = this.runningStreams.get(data.id)!;
+          stream.chunks.push(data.result);
+          stream.wake?.();
+        }
+        break;
+
+      case MessageType.REPLY:
+        if (this.runningStreams.has(data.id)) {
+          const stream = this.runningStreams.get(data.id)!;
+          stream.done = true;
+          stream.wake?.();
+          this.debug(`[${data.id}] Finished PY stream`);
+        }
+        if (this.runningCalls.has(data.id)) {
+          this.runningCalls.get(data.id)!.resolve(data.result);
+          this.runningCalls.delete(data.id);
+          this.debug(`[${data.id}] Resolved PY call with value`, data.result);
+        }
+        break;
+
+      case MessageType.ERROR:
+        if (this.runningStreams.has(data.id)) {
+          const stream = this.runningStreams.get(data.id)!;
+          stream.error = new PyError(data.error.name, data.error.error, data.error.traceback);
+          stream.wake?.();
+          this.debug(`[${data.id}] Rejected PY stream with error`, data.error);
+        }
+        if (this.runningCalls.has(data.id)) {
+          let err = new PyError(data.error.name, data.error.error, data.error.traceback);
+          this.runningCalls.get(data.id)!.reject(err);
+          this.runningCalls.delete(data.id);
+          this.debug(`[${data.id}] Rejected PY call with error`, data.error);
+        }
+        break;
+
+      case MessageType.EVENT:
+        this.debug(`Recieved event ${data.event} with args`, data.args);
+        if (this.eventListeners.has(data.event)) {
+          for (const listener of this.eventListeners.get(data.event)!) {
+            (async () => {
+              try {
+                await listener(...data.args);
+              } catch (e) {
+                this.error(`error in event ${data.event}`, e, listener);
+              }
+            })();
+          }
+        } else {
+          this.warn(`event ${data.event} has no listeners`);
+        }
+        break;
+
+      case MessageType.SESSION:
+        if (!data.resumed) {
+          // replies to calls from the old session are lost
+          if (this.sessionId) this.failRunningCalls();
+          this.lastSeq = 0;
+        }
+        this.sessionId = data.session;
+        this.debug(`${data.resumed ? 'Resumed' : 'Started'} session ${data.session}`);
+        break;
+
+      case MessageType.BATCH:
+        if ('replies' in data) {
+          for (const reply of data.replies) this.handleMessage(reply);
+        }
+        break;
+
+      default:
+        this.error('Unknown message type', data);
+        break;
+    }
+  }
+
+  failRunningCalls() {
+    const error = new PyError('ConnectionLost', 'The connection to the backend was lost', null);
+    for (const resolver of this.runningCalls.values()) resolver.reject(error);
+    this.runningCalls.clear();
+    for (const stream of this.runningStreams.values()) {
+      stream.error = error;
+      stream.wake?.();
+    }
+  }
+
   // this.call<[number, number], string>('methodName', 1, 2);
   call<Args extends any[] = [], Return = void>(route: string, ...args: Args): Promise<Return> {
+    return this.startCall<Return>(route, args, false);
+  }
+
+  // Like call, but for work nobody is waiting on (prefetching, scans...), so it can't delay interactive calls
+  callBackground<Args extends any[] = [], Return = void>(route: string, ...args: Args): Promise<Return> {
+    return this.startCall<Return>(route, args, false, 'background');
+  }
+
+  // Like call, but if the method returns bytes they arrive as a Uint8Array in a binary frame instead of failing to
+  // serialize, other results are unaffected.
+  callBinary<Args extends any[] = [], Return = Uint8Array>(route: string, ...args: Args): Promise<Return> {
+    return this.startCall<Return>(route, args, true);
+  }
+
+  // Sends several calls in one frame, e.g. everything a page needs when it opens. The backend replies to all of them
+  // at once when the slowest is done, so only batch calls that take about as long as each other.
+  // const [plugins, version] = this.callBatch(['loader/get_plugins'], ['updater/get_version_info']);
+  callBatch(...calls: [route: string, ...args: any[]][]): Promise<any>[] {
+    const messages = calls.map(([route, ...args]) => this.createCall(route, args));
+    this.debug(`Batching ${messages.length} PY calls`);
+    this.write({ type: MessageType.BATCH, calls: messages.map(([{ type, ...call }]) => call) });
+    return messages.map(([, promise]) => promise);
+  }
+
+  private createCall<Return>(route: string, args: any[]): [CallMessage, Promise<Return>] {
     const resolver = this.createPromiseResolver<Return>();
 
     const id = ++this.reqId;
@@ -185,19 +380,57 @@ export class WSRouter extends Logger {
 
     this.debug(`[${id}] Calling PY method ${route} with args`, args);
 
-    this.write({ type: MessageType.CALL, route, args, id });
+    return [{ type: MessageType.CALL, route, args, id }, resolver.promise];
+  }
 
-    return resolver.promise;
+  private startCall<Return>(route: string, args: any[], binary: boolean, priority?: CallPriority): Promise<Return> {
+    const [message, promise] = this.createCall<Return>(route, args);
+    if (priority) message.priority = priority;
+    if (binary) message.binary = true;
+    this.write(message);
+    return promise;
   }
 
   callable<Args extends any[] = [], Return = void>(route: string): (...args: Args) => Promise<Return> {
     return (...args) => this.call<Args, Return>(route, ...args);
   }
 
+  // for await (const chunk of this.stream<[string], string>('methodName', 'arg')) { ... }
+  // Breaking out of the loop cancels the call in the backend.
+  async *stream<Args extends any[] = [], Chunk = any>(route: string, ...args: Args): AsyncGenerator<Chunk> {
+    const id = ++this.reqId;
+    const stream: RunningStream = { chunks: [], done: false };
+
+    this.runningStreams.set(id, stream);
+
+    this.debug(`[${id}] Streaming PY method ${route} with args`, args);
+
+    this.write({ type: MessageType.CALL, route, args, id });
+
+    try {
+      while (true) {
+        if (stream.chunks.length > 0) {
+          yield stream.chunks.shift();
+        } else if (stream.error) {
+          throw stream.error;
+        } else if (stream.done) {
+          return;
+        } else {
+          await new Promise<void>((resolve) => (stream.wake = resolve));
+          delete stream.wake;
+        }
+      }
+    } finally {
+      this.runningStreams.delete(id);
+      if (!stream.done && !stream.error) {
+        this.write({ type: MessageType.CANCEL, id });
+      }
+    }
+  }
+
   async onError(error: any) {
     this.error('WS DISCONNECTED', error);
-    // TODO queue up lost messages and send them once we connect again
-    await sleep(5000);
-    await this.connect();
+    // messages written until we're connected again wait for this, replies and events we missed get resent on resume
+    await (this.connectPromise = sleep(5000).then(() => this.connect()));
   }
 }